@@ -0,0 +1,196 @@
+import os
+import io
+import hashlib
+import threading
+import functools
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from mutagen.mp3 import MP3
+from mutagen.id3 import ID3
+from PIL import Image, ImageDraw
+from PIL.PngImagePlugin import PngInfo
+from tags import cover_picture
+
+ART_SIZE = (180, 180)
+CORNER_RADIUS = 20
+
+
+@functools.lru_cache(maxsize=1)
+def default_art():
+    """The rounded default art, drawn once and shared; treat it as read-only"""
+    return add_rounded_corners(create_default_art(), CORNER_RADIUS)
+
+
+def create_default_art():
+    """Create a gradient default album art"""
+    img = Image.new("RGB", ART_SIZE, color="#16213e")
+    draw = ImageDraw.Draw(img)
+
+    # Draw gradient circles
+    for i in range(0, 180, 20):
+        color = f"#{57:02x}{197:02x}{187:02x}"  # Cyan
+        draw.ellipse([90-i, 90-i, 90+i, 90+i], outline=color, width=2)
+
+    return img
+
+
+@functools.lru_cache(maxsize=8)
+def rounded_mask(size, radius):
+    """Alpha mask with rounded corners, drawn once per size and shared"""
+    mask = Image.new('L', size, 0)
+    draw = ImageDraw.Draw(mask)
+    draw.rounded_rectangle([(0, 0), size], radius, fill=255)
+    return mask
+
+
+def add_rounded_corners(image, radius):
+    """Add rounded corners to image"""
+    # putalpha copies the mask into the new image, so one mask serves every song
+    result = image.convert('RGBA')
+    result.putalpha(rounded_mask(image.size, radius))
+    return result
+
+
+class ArtLoader:
+    """
+    Reads artist names and album art off the Tk thread.
+    Finished thumbnails are cached on disk as PNGs keyed by path, mtime and
+    size (the artist name rides along as a PNG text chunk), with a small LRU
+    of decoded images in front of the disk cache.
+
+    Songs already in the tag catalogue (see tags.py) come with info, their
+    (artist, art_hash): their tags aren't parsed again, songs without art
+    aren't opened at all, and thumbnails are keyed by art_hash, so every
+    track of an album shares one.
+    """
+
+    def __init__(self, post, cache_dir, max_workers=2, memory_items=64):
+        self.post = post
+        self.cache_dir = cache_dir
+        self.memory_items = memory_items
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.pool = ThreadPoolExecutor(max_workers=max_workers)
+        self.default_art = default_art()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def request(self, filepath, callback, info=None):
+        """
+        Load info for filepath in the background, then call callback(artist, image)
+        through post, which must run it on the Tk thread.
+        """
+        future = self.pool.submit(self.load, filepath, info)
+        future.add_done_callback(lambda f: self.post(callback, *f.result()))
+
+    def prefetch(self, filepath, info=None):
+        """Warm the caches for a song that is about to play"""
+        self.pool.submit(self.load, filepath, info)
+
+    def cache_key(self, filepath):
+        stat = os.stat(filepath)
+        ident = f"{os.path.abspath(filepath)}|{stat.st_mtime_ns}|{stat.st_size}"
+        return hashlib.sha1(ident.encode("utf-8")).hexdigest()
+
+    def _remember(self, key, entry):
+        with self.lock:
+            self.memory[key] = entry
+            self.memory.move_to_end(key)
+            while len(self.memory) > self.memory_items:
+                self.memory.popitem(last=False)
+
+    def load(self, filepath, info=None):
+        """Returns (artist, rounded 180x180 image). Runs on a worker thread."""
+        if info is not None:
+            return self._load_catalogued(filepath, *info)
+        try:
+            key = self.cache_key(filepath)
+        except OSError as e:
+            print(f"Failed to load song info: {e}")
+            return "Unknown Artist", self.default_art
+
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None:
+                self.memory.move_to_end(key)
+                return entry
+
+        cache_file = os.path.join(self.cache_dir, key + ".png")
+        try:
+            with Image.open(cache_file) as cached:
+                cached.load()
+                entry = (cached.text.get("artist", "Unknown Artist"), cached.copy())
+            self._remember(key, entry)
+            return entry
+        except (OSError, ValueError):
+            pass
+
+        try:
+            entry = self._read_tags(filepath)
+        except Exception as e:
+            print(f"Failed to load song info: {e}")
+            return "Unknown Artist", self.default_art
+
+        artist, image = entry
+        if image is not self.default_art:
+            info = PngInfo()
+            info.add_text("artist", artist)
+            try:
+                image.save(cache_file, pnginfo=info)
+            except OSError as e:
+                print(f"Failed to cache album art: {e}")
+        self._remember(key, entry)
+        return entry
+
+    def _load_catalogued(self, filepath, artist, art_hash):
+        artist = artist or "Unknown Artist"
+        if not art_hash:
+            return artist, self.default_art
+        key = "art-" + art_hash
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None:
+                self.memory.move_to_end(key)
+                return artist, entry[1]
+
+        cache_file = os.path.join(self.cache_dir, key + ".png")
+        try:
+            with Image.open(cache_file) as cached:
+                cached.load()
+                image = cached.copy()
+        except (OSError, ValueError):
+            try:
+                image = self._read_art(filepath)
+            except Exception as e:
+                print(f"Failed to load album art: {e}")
+                return artist, self.default_art
+            try:
+                image.save(cache_file)
+            except OSError as e:
+                print(f"Failed to cache album art: {e}")
+        self._remember(key, (artist, image))
+        return artist, image
+
+    def _read_art(self, filepath):
+        picture = cover_picture(ID3(filepath).getall("APIC"))
+        if picture is None:
+            return self.default_art
+        image = Image.open(io.BytesIO(picture.data))
+        return add_rounded_corners(image.resize(ART_SIZE), CORNER_RADIUS)
+
+    def _read_tags(self, filepath):
+        audio = MP3(filepath, ID3=ID3)
+        tags = audio.tags
+
+        artist_tag = tags.get("TPE1")
+        artist_name = artist_tag.text[0] if artist_tag else "Unknown Artist"
+
+        picture = cover_picture(tags.getall("APIC"))
+        if picture is None:
+            return artist_name, self.default_art
+
+        image = Image.open(io.BytesIO(picture.data))
+        image = image.resize(ART_SIZE)
+        return artist_name, add_rounded_corners(image, CORNER_RADIUS)
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,1251 @@
+"""
+Benchmarks for the player's hot paths. Run with:
+
+    python benchmark.py [name ...]
+
+With no names every benchmark runs. None of them need Tk or VLC, except the
+first-paint half of 'startup' and the button half of 'canvas', which need a
+display (use xvfb-run on CI). 'tags' needs mutagen to write its corpus.
+
+Pick and save latency over a long session are also tracked with
+pytest-benchmark, in benchmarks/.
+"""
+import os
+import re
+import sys
+import json
+import math
+import time
+import random
+import datetime
+import queue
+import base64
+import asyncio
+import tempfile
+import subprocess
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+from library_store import JsonLibraryStore, SqliteLibraryStore
+from score_engine import ScoreEngine, song_weight
+from sampler import WeightedSampler
+from scheduler import ScoreScheduler
+from scanner import scan_folder, scan_paths, path_key
+from content_hash import hash_scan_changes
+from watcher import LibraryWatcher
+from search_index import SearchIndex
+from player_core import PlayerCore
+from journal import EventJournal
+from features import SimilarityIndex, FEATURE_DIM
+from track_table import TrackTable
+from playback import HeadlessPlayer
+from profiles import ProfileCore
+from control_server import ControlServer, call_via
+from metrics import Metrics
+from profiler import SamplingProfiler
+from simulator import simulate, sweep, format_results
+from playlists import Playlist
+from tags import read_tags, read_tags_batches, read_scan_tags
+
+try:
+    import resource
+except ImportError:     # Windows
+    resource = None
+
+LIBRARY_SIZES = (1_000, 10_000, 100_000)
+
+
+def make_library(n):
+    return {
+        f"song_{i:06d}.mp3": {
+            "last_played": "2000-01-01",
+            "vote_weight": 1.0,
+            "path": f"C:/Music/Artist {i % 500}/song_{i:06d}.mp3"
+        }
+        for i in range(n)
+    }
+
+
+def make_played_library(n, seed=0):
+    """Library with varied last_played times, vote weights and skip history"""
+    rng = random.Random(seed)
+    now = datetime.datetime.now()
+    data = make_library(n)
+    for meta in data.values():
+        if rng.random() < 0.8:
+            played = now - datetime.timedelta(hours=rng.uniform(0, 2000))
+            meta["last_played"] = played.isoformat()
+        if rng.random() < 0.3:
+            meta["vote_weight"] = rng.choice([0.5, 0.81, 0.9, 1.1, 1.21, 2.0])
+        if rng.random() < 0.2:
+            meta["completions"] = round(rng.uniform(0, 20), 3)
+            meta["skips"] = round(rng.uniform(0, 20), 3)
+    return data
+
+
+def reference_scores(data, now):
+    """The original per-song MusicPlayer.get_scores loop, with votes and skips combined"""
+    scores = {}
+    for song, meta in data.items():
+        delta = now - datetime.datetime.fromisoformat(meta["last_played"])
+        hours = delta.total_seconds() / 3600
+
+        weight = song_weight(meta)
+        if weight != 1.0:
+            weight = 1.0 + (weight - 1.0) * 0.5 ** (hours / 100)
+        weight = min(max(weight, 0.5), 2.0)
+
+        scores[song] = math.log1p(max(hours, 0.1)) * weight
+    return scores
+
+
+def reference_pick(scores, recent_songs, repeat_limit=150):
+    """The original list-based MusicPlayer.pick_song"""
+    limit = min(repeat_limit, len(scores))
+    available = {song: score for song, score in scores.items() if song not in recent_songs}
+    if not available:
+        available = scores
+    r = random.uniform(0, sum(available.values()))
+    cumulative = 0
+    for song, score in available.items():
+        cumulative += score
+        if r <= cumulative:
+            break
+    recent_songs.append(song)
+    if len(recent_songs) > limit:
+        recent_songs.pop(0)
+    return song
+
+
+def report(name, size, timings):
+    timings = sorted(timings)
+    mean = sum(timings) / len(timings)
+    p95 = timings[int(len(timings) * 0.95) - 1]
+    print(f"{name:<28} {size:>8} tracks  mean {mean * 1000:9.3f} ms  p95 {p95 * 1000:9.3f} ms")
+
+
+def bench_store_writes(plays=50):
+    """Per-play write latency: last_played update on one song, made durable"""
+    for size in LIBRARY_SIZES:
+        data = make_library(size)
+        keys = list(data)
+        with tempfile.TemporaryDirectory() as tmp:
+            stores = [
+                ("json (full rewrite)", JsonLibraryStore(os.path.join(tmp, "songs.json"))),
+                ("sqlite (commit per play)", SqliteLibraryStore(os.path.join(tmp, "songs.db"), batch_size=1)),
+                ("sqlite (batched)", SqliteLibraryStore(os.path.join(tmp, "batched.db"))),
+            ]
+            for name, store in stores:
+                store.save_all(data)
+                timings = []
+                for i in range(plays):
+                    song = keys[(i * 7919) % size]
+                    start = time.perf_counter()
+                    data[song]["last_played"] = datetime.datetime.now().isoformat()
+                    store.update_song(song, data[song])
+                    if name.startswith("json"):
+                        store.flush()
+                    timings.append(time.perf_counter() - start)
+                report(name, size, timings)
+                store.close()
+
+            journal = EventJournal(os.path.join(tmp, "events.log"))
+            timings = []
+            for i in range(plays):
+                song = keys[(i * 7919) % size]
+                start = time.perf_counter()
+                journal.append({"type": "play", "song": song,
+                                "at": datetime.datetime.now().isoformat()})
+                timings.append(time.perf_counter() - start)
+            report("journal (fsync per batch)", size, timings)
+            journal.close()
+
+
+def bench_scores(rounds=5):
+    """get_scores: per-song loop vs the vectorized ScoreEngine, checked for parity"""
+    for size in LIBRARY_SIZES:
+        data = make_played_library(size)
+        engine = ScoreEngine()
+        engine.rebuild(data)
+        now = datetime.datetime.now()
+
+        expected = reference_scores(data, now)
+        actual = engine.scores(now)
+        worst = max(abs(expected[k] - actual[k]) / expected[k] for k in expected)
+        assert worst < 1e-9, f"score mismatch: relative error {worst}"
+
+        for name, fn in (("loop", lambda: reference_scores(data, now)),
+                         ("vectorized", lambda: engine.score_array(now)),
+                         ("vectorized (as dict)", lambda: engine.scores(now))):
+            timings = []
+            for _ in range(rounds):
+                start = time.perf_counter()
+                fn()
+                timings.append(time.perf_counter() - start)
+            report(name, size, timings)
+
+
+def bench_picks(picks=200):
+    """pick_song: original list-based picker vs the Fenwick-tree WeightedSampler"""
+    for size in LIBRARY_SIZES:
+        data = make_played_library(size)
+        engine = ScoreEngine()
+        engine.rebuild(data)
+        scores = engine.scores()
+        sampler = WeightedSampler(rng=random.Random(0))
+        sampler.rebuild(engine.keys, engine.score_array())
+
+        recent = []
+        cases = (("list", lambda: reference_pick(scores, recent)),
+                 ("sampler (pick only)", sampler.pick),
+                 ("sampler (rebuild + pick)",
+                  lambda: (sampler.rebuild(engine.keys, engine.score_array()), sampler.pick())))
+        for name, fn in cases:
+            timings = []
+            for _ in range(picks):
+                start = time.perf_counter()
+                fn()
+                timings.append(time.perf_counter() - start)
+            report(name, size, timings)
+
+
+def bench_incremental(picks=2000, staleness=0.01):
+    """
+    ScoreScheduler over a simulated session (one pick every ~3.5 minutes):
+    per-pick latency, and the worst relative error of any pickable song's
+    weight against the exact get_scores result, which must stay within the
+    staleness tolerance.
+    """
+    for size in LIBRARY_SIZES:
+        data = make_played_library(size)
+        engine = ScoreEngine()
+        engine.rebuild(data)
+        sampler = WeightedSampler(rng=random.Random(0))
+        scheduler = ScoreScheduler(engine, sampler, staleness)
+        now = datetime.datetime.now()
+        scheduler.rebuild(now)
+
+        timings, worst = [], 0.0
+        for i in range(picks):
+            now += datetime.timedelta(seconds=210)
+            start = time.perf_counter()
+            song = scheduler.pick(now)
+            data[song]["last_played"] = now.isoformat()
+            engine.update(song, data[song])
+            scheduler.touch([song], now)
+            timings.append(time.perf_counter() - start)
+
+            if i % 200 == 199:
+                # What the next pick draws from, once it has refreshed what's due
+                later = now + datetime.timedelta(seconds=209)
+                scheduler.refresh(later)
+                exact = engine.scores(later)
+                for key, weight in zip(sampler.keys, sampler.weights):
+                    if key not in sampler.recent_counts:
+                        worst = max(worst, abs(weight - exact[key]) / exact[key])
+        report("incremental pick", size, timings)
+        print(f"{'':<28} {'':>8}         worst relative error {worst:.5f} (limit {staleness})")
+        assert worst <= staleness, "scheduler drifted past its staleness tolerance"
+
+
+def make_tree(root, files, per_dir=100, distinct=False):
+    """
+    Synthetic music tree: artist/album folders holding .mp3 files, empty
+    unless distinct, when each holds its own bytes and so its own audio id
+    """
+    for i in range(files):
+        folder = os.path.join(root, f"Artist {i // (per_dir * 10)}", f"Album {i // per_dir}")
+        if i % per_dir == 0:
+            os.makedirs(folder, exist_ok=True)
+        ext = ".MP3" if i % 10 == 0 else ".mp3"
+        with open(os.path.join(folder, f"track {i:06d}{ext}"), "wb") as f:
+            if distinct:
+                f.write(f"track {i}".encode())
+
+
+def bench_scan(files=100_000):
+    """Folder scan of a synthetic tree: first import, then a rescan after a few changes"""
+    with tempfile.TemporaryDirectory() as tmp:
+        start = time.perf_counter()
+        make_tree(tmp, files)
+        print(f"built {files} file tree in {time.perf_counter() - start:.1f} s")
+
+        start = time.perf_counter()
+        added, changed, deleted = scan_folder(tmp, {})
+        elapsed = time.perf_counter() - start
+        print(f"full scan      {len(added):>8} added              {elapsed:7.2f} s "
+              f"({len(added) / elapsed:,.0f} files/s)")
+
+        known = {path_key(path): (mtime, size) for path, mtime, size in added}
+        for path, _, _ in added[:100]:
+            os.remove(path)
+        for path, _, _ in added[100:200]:
+            with open(path, "ab") as f:
+                f.write(b"x")
+        start = time.perf_counter()
+        added, changed, deleted = scan_folder(tmp, known)
+        elapsed = time.perf_counter() - start
+        print(f"rescan         {len(added):>8} added {len(changed):>5} changed "
+              f"{len(deleted):>5} deleted  {elapsed:7.2f} s")
+
+
+# One MPEG-1 Layer III frame at 128 kbit/s and 44.1 kHz, silent
+MP3_FRAME = b"\xff\xfb\x90\x00" + bytes(413)
+
+
+def make_tagged_corpus(root, files, per_album=10, corrupt_every=100, seed=0):
+    """
+    Synthetic tagged MP3s in artist/album folders: ID3 text frames, a cover
+    image per album shared by its tracks, and every corrupt_every-th file
+    damaged (a tag header promising more than the file holds). Returns the paths.
+    """
+    from mutagen.id3 import ID3, TPE1, TALB, TIT2, TDRC, APIC
+    rng = random.Random(seed)
+    paths = []
+    for i in range(files):
+        album = i // per_album
+        folder = os.path.join(root, f"Artist {album // 10}", f"Album {album}")
+        if i % per_album == 0:
+            os.makedirs(folder, exist_ok=True)
+            art = rng.randbytes(4096)
+            year = rng.randint(1960, 2029)
+        path = os.path.join(folder, f"track {i:06d}.mp3")
+        paths.append(path)
+        with open(path, "wb") as f:
+            if i % corrupt_every == corrupt_every - 1:
+                f.write(b"ID3\x04\x00\x00\x7f\x7f\x7f\x7f" + rng.randbytes(1000))
+                continue
+            f.write(MP3_FRAME * rng.randint(40, 80))
+        tags = ID3()
+        tags.add(TPE1(encoding=3, text=f"Artist {album // 10}"))
+        tags.add(TALB(encoding=3, text=f"Album {album}"))
+        tags.add(TIT2(encoding=3, text=f"Track {i}"))
+        tags.add(TDRC(encoding=3, text=str(year)))
+        tags.add(APIC(encoding=3, mime="image/png", type=3, desc="Cover", data=art))
+        tags.save(path)
+    return paths
+
+
+def bench_tags(files=5_000, changed=50, workers=(2, 4)):
+    """
+    Tag catalogue ingestion over a synthetic tagged corpus, in files per
+    second: in-process, on threads and on process pools, checked for
+    parity; then a rescan after a few files are retagged, which only reads those
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        start = time.perf_counter()
+        try:
+            paths = make_tagged_corpus(tmp, files)
+        except ImportError:
+            print("mutagen not installed, skipping")
+            return
+        print(f"built {files} tagged files in {time.perf_counter() - start:.1f} s "
+              f"({sum(os.path.getsize(p) for p in paths) / 1024 / 1024:.0f} MB)")
+
+        def threads():
+            with ThreadPoolExecutor(max_workers=8) as pool:
+                return dict(zip(paths, pool.map(read_tags, paths)))
+
+        def processes(count):
+            found = {}
+            for batch in read_tags_batches(paths, count):
+                found.update(batch)
+            return found
+
+        cases = [("in-process", lambda: {path: read_tags(path) for path in paths}),
+                 ("8 threads", threads)]
+        cases += [(f"{count} processes", lambda count=count: processes(count)) for count in workers]
+        expected = None
+        for name, read in cases:
+            start = time.perf_counter()
+            found = read()
+            elapsed = time.perf_counter() - start
+            print(f"{name:<16} {files:>8} files  {elapsed:7.2f} s  ({files / elapsed:,.0f} files/s)")
+            if expected is None:
+                expected = found
+            assert found == expected, name
+
+        damaged = sum(1 for fields in expected.values() if not fields)
+        art = {fields["art_hash"] for fields in expected.values() if "art_hash" in fields}
+        durations = [fields["duration"] for fields in expected.values() if "duration" in fields]
+        print(f"{damaged} damaged files read as untagged, {len(art)} distinct covers, "
+              f"lengths {min(durations):.2f}-{max(durations):.2f} s")
+        assert damaged == files // 100 and len(art) == math.ceil(files / 10)
+
+        core = PlayerCore(JsonLibraryStore(os.devnull))
+        result = scan_folder(tmp, {})
+        core.apply_folder_scan(result, {}, expected)
+        assert not core.songs_needing_tags()
+        from mutagen.id3 import ID3, TIT2
+        for path in random.Random(0).sample([p for p in paths if expected[p]], changed):
+            tags = ID3(path)
+            tags.add(TIT2(encoding=3, text="Retagged"))
+            tags.save(path)
+        known, _ = core.folder_snapshot(tmp)
+        start = time.perf_counter()
+        result = scan_folder(tmp, known)
+        tags = read_scan_tags(result)
+        core.apply_folder_scan(result, {}, tags)
+        elapsed = time.perf_counter() - start
+        retitled = sum(1 for meta in core.data.values() if meta.get("title") == "Retagged")
+        print(f"rescan + tags    {len(tags):>8} files read, {retitled} retitled  {elapsed:7.2f} s")
+        assert len(tags) == changed == retitled and not core.songs_needing_tags()
+
+
+def sync_batch(core, paths):
+    """What MusicPlayer.sync_changes does with a watcher batch, on one thread"""
+    known, unhashed = core.paths_snapshot(paths)
+    result = scan_paths(paths, known)
+    return core.apply_folder_scan(result, hash_scan_changes(result, unhashed))
+
+
+def churn(root, rng, count):
+    """Delete, move and add files under root the way a library gets reorganized"""
+    paths = sorted(os.path.join(folder, name) for folder, _, names in os.walk(root)
+                   for name in names if name.lower().endswith(".mp3"))
+    albums = sorted({os.path.dirname(path) for path in paths})
+    for path in rng.sample(paths, count):
+        if os.path.exists(path):
+            os.remove(path)
+    # An album moved to another artist, and some tracks filed into a new folder
+    album = rng.choice(albums)
+    os.rename(album, os.path.join(root, "Artist 0", "Moved " + os.path.basename(album)))
+    sorted_into = os.path.join(root, "Sorted")
+    os.makedirs(sorted_into, exist_ok=True)
+    for path in rng.sample(paths, count // 2):
+        if os.path.exists(path):
+            os.rename(path, os.path.join(sorted_into, os.path.basename(path)))
+    for i in range(count):
+        with open(os.path.join(sorted_into, f"new {i:05d}.mp3"), "wb") as f:
+            f.write(f"new {i}".encode())
+
+
+def library_matches_disk(core, root):
+    on_disk = {path_key(os.path.join(folder, name)) for folder, _, names in os.walk(root)
+               for name in names if name.lower().endswith(".mp3")}
+    in_library = {path_key(meta["path"]) for meta in core.data.values() if not meta.get("missing")}
+    return on_disk == in_library
+
+
+def bench_watch(files=10_000, churned=200, picks=2000, seed=0):
+    """
+    Watched folders vs finding missing files at pick time. The same
+    reorganization (deletes, an album and loose tracks moved, new files) is
+    made under a library; unwatched, picks run into the stale entries, while
+    a watcher turns it into a few debounced batches that are synced before
+    the next pick. Checks the synced library against the disk and that
+    moved songs keep their history.
+    """
+    modes = [("unwatched", None), ("polling", True)]
+    if sys.platform.startswith("linux"):
+        modes.insert(1, ("inotify", False))
+    for mode, polling in modes:
+        rng = random.Random(seed)
+        with tempfile.TemporaryDirectory() as tmp:
+            root = os.path.join(tmp, "music")
+            make_tree(root, files, distinct=True)
+            store = SqliteLibraryStore(os.path.join(tmp, "songs.db"))
+            core = PlayerCore(store, rng=random.Random(seed),
+                              journal=EventJournal(os.path.join(tmp, "events.log")))
+            sync_batch(core, [root])
+            played = {song for song in rng.sample(list(core.data), files // 2)}
+            for song in played:
+                core.vote(song, 1.1)
+
+            batches = queue.Queue()
+            watcher = None
+            if polling is not None:
+                watcher = LibraryWatcher(batches.put, debounce=0.2, poll_interval=0.5,
+                                         polling=polling)
+                watcher.add_root(root, sync=False)
+                time.sleep(1.0)     # let the polling snapshot or the inotify watches settle
+
+            churn(root, rng, churned)
+            changed_at = time.perf_counter()
+            synced = 0
+            sync_time = 0.0
+            if watcher is not None:
+                # Sync batches until none come for a few debounce periods
+                while True:
+                    try:
+                        paths = batches.get(timeout=1.5)
+                    except queue.Empty:
+                        break
+                    start = time.perf_counter()
+                    sync_batch(core, paths)
+                    sync_time += time.perf_counter() - start
+                    synced += 1
+                    last_synced = time.perf_counter()
+                watcher.stop()
+                latency = (last_synced - changed_at) if synced else float("nan")
+            matches = library_matches_disk(core, root)
+
+            stale = []
+            pick_times = []
+            for _ in range(picks):
+                start = time.perf_counter()
+                song = core.pick_playable_song(on_missing=stale.append)
+                pick_times.append(time.perf_counter() - start)
+                core.mark_played(song)
+            kept = sum(1 for song in played if song in core.data and not core.data[song].get("missing"))
+            # A moved song keeps the key (and history) it had at its old path
+            relinked = sum(1 for song, meta in core.data.items()
+                           if song != os.path.normpath(meta["path"]) and not meta.get("missing"))
+            core.flush_data()
+            if watcher is not None:
+                print(f"{mode:<10} {synced:>3} batches, synced {latency:5.2f} s after the last change "
+                      f"({sync_time * 1000:.0f} ms syncing), library matches disk: {matches}")
+            else:
+                print(f"{mode:<10} library matches disk: {matches}")
+            print(f"{'':<10} {len(stale):>4} picks hit missing files, {relinked} moved songs re-linked, "
+                  f"{kept} of {len(played)} voted songs in rotation")
+            report(f"{mode} pick", files, pick_times)
+            core.close()
+
+
+def bench_search(queries=50):
+    """Remove Songs search: linear substring scan vs the trigram SearchIndex, checked for parity"""
+    rng = random.Random(0)
+    words = ["love", "night", "blue", "song", "dance", "river", "fire", "dream", "road", "heart"]
+    for size in LIBRARY_SIZES:
+        texts = {f"song{i}.mp3": f"{rng.choice(words)} {rng.choice(words)} {i}.mp3"
+                 for i in range(size)}
+        start = time.perf_counter()
+        index = SearchIndex()
+        for song, text in texts.items():
+            index.add(song, text)
+        print(f"{'index build':<28} {size:>8} tracks  {(time.perf_counter() - start) * 1000:9.1f} ms")
+
+        typed = [f"{rng.choice(words)} {rng.choice(words)[:2]}" for _ in range(queries)]
+        for query in typed:
+            expected = {song for song, text in texts.items() if query in text}
+            assert index.search(query) == expected, query
+        cases = (("linear scan", lambda q: [s for s, t in texts.items() if q in t]),
+                 ("trigram index", index.search))
+        for name, fn in cases:
+            timings = []
+            for query in typed:
+                start = time.perf_counter()
+                fn(query)
+                timings.append(time.perf_counter() - start)
+            report(name, size, timings)
+
+
+def bench_similarity(lookups=500, k=50):
+    """
+    Nearest-neighbour lookups in the SimilarityIndex over synthetic embeddings
+    (tracks scattered around a few hundred "styles"), with recall against an
+    exact search
+    """
+    import numpy as np
+    rng = np.random.default_rng(0)
+    for size in LIBRARY_SIZES:
+        styles = rng.normal(size=(300, FEATURE_DIM))
+        vectors = styles[rng.integers(0, len(styles), size)] + rng.normal(scale=0.7, size=(size, FEATURE_DIM))
+        keys = [f"song_{i:06d}.mp3" for i in range(size)]
+        start = time.perf_counter()
+        index = SimilarityIndex(keys, vectors)
+        print(f"{'index build':<28} {size:>8} tracks  {(time.perf_counter() - start) * 1000:9.1f} ms")
+
+        queries = rng.integers(0, size, lookups)
+        timings, recalls = [], []
+        for i in queries:
+            start = time.perf_counter()
+            found, _ = index.neighbours(keys[i], k)
+            timings.append(time.perf_counter() - start)
+            exact = index.vectors[:size] @ index.vectors[i]
+            exact[i] = -np.inf
+            best = {keys[j] for j in np.argpartition(-exact, k)[:k]}
+            recalls.append(len(best & set(found)) / k)
+        report("neighbours", size, timings)
+        print(f"{'':<46}recall@{k} {sum(recalls) / len(recalls):.2f}")
+
+
+def analyzed_entries(n, seed=0):
+    """(key, entry) pairs shaped like a fully scanned and analyzed library"""
+    rng = random.Random(seed)
+    for i in range(n):
+        path = f"C:/Music/Artist {i // 1000}/Album {i // 10}/track {i:06d}.mp3"
+        played = datetime.datetime(2030, 1, 1) - datetime.timedelta(hours=rng.uniform(0, 2000))
+        yield os.path.normpath(path), {
+            "last_played": played.isoformat(),
+            "vote_weight": rng.choice([0.9, 1.0, 1.1]),
+            "path": path,
+            "mtime": 1_700_000_000_000_000_000 + i,
+            "size": rng.randint(2_000_000, 12_000_000),
+            "audio_id": f"{rng.getrandbits(128):032x}",
+            "loudness": rng.uniform(-30, -5),
+            "peak": rng.uniform(0.5, 1.0),
+            "gain_db": rng.uniform(-10, 10),
+            "analyzed_mtime": 1_700_000_000_000_000_000 + i,
+            "analysis_version": 2,
+            "tempo": rng.uniform(60, 200),
+            "centroid": rng.uniform(500, 4000),
+            "energy": rng.uniform(-40, -10),
+            "feature_row": i,
+            "seq": i,
+            "completions": rng.uniform(0, 10),
+            "skips": rng.uniform(0, 10),
+        }
+
+
+def traced_mb(build):
+    """Memory still allocated by what build() returns, in MB"""
+    tracemalloc.start()
+    kept = build()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del kept
+    return current / 1024 / 1024
+
+
+def bench_memory():
+    """Library held as a dict of entry dicts (plus the old files list) vs a TrackTable"""
+    for size in LIBRARY_SIZES:
+        def as_dicts():
+            data = dict(analyzed_entries(size))
+            return data, list(data.keys())
+        for name, build in (("dict of dicts + files list", as_dicts),
+                            ("TrackTable", lambda: TrackTable(analyzed_entries(size)))):
+            mb = traced_mb(build)
+            print(f"{name:<28} {size:>8} tracks  {mb:9.1f} MB  {mb * 1024 * 1024 / size:7.0f} B/track")
+
+
+def tagged_entries(n, seed=0):
+    """analyzed_entries with the tags a scan reads: artist and album as in the path, a year and length"""
+    rng = random.Random(seed)
+    for i, (key, meta) in enumerate(analyzed_entries(n, seed)):
+        meta.update({"artist": f"Artist {i // 1000}", "album": f"Album {i // 10}",
+                     "title": f"Track {i}", "year": rng.randint(1960, 2029),
+                     "duration": rng.uniform(90, 600), "tagged_mtime": meta["mtime"]})
+        yield key, meta
+
+
+def reference_filter(data, rules, now):
+    """Playlist rules checked against every entry, as a filter without an index would"""
+    cutoff = None
+    if "not_played_since" in rules:
+        days = rules["not_played_since"]
+        day = datetime.datetime.combine((now - datetime.timedelta(days=days)).date(), datetime.time())
+        cutoff = day.isoformat()
+    found = set()
+    for song, meta in data.items():
+        if "artist" in rules and (meta.get("artist") or "").casefold() != rules["artist"].casefold():
+            continue
+        if "folder" in rules and not path_key(meta["path"]).startswith(path_key(rules["folder"]) + os.sep):
+            continue
+        ok = True
+        for rule, field in (("year", "year"), ("duration", "duration"), ("weight", "vote_weight")):
+            if rule in rules:
+                low, high = rules[rule]
+                value = meta.get(field)
+                ok = ok and value is not None and (low is None or value >= low) and (high is None or value <= high)
+        if ok and (cutoff is None or meta["last_played"] < cutoff):
+            found.add(song)
+    return found
+
+
+def bench_playlists(evaluations=20, picks=2_000, seed=0):
+    """
+    Smart playlists: rule evaluation from the TagIndex vs a filter over every
+    entry, checked for parity, and playlist-constrained picks (with a play
+    recorded after each, which the index has to follow) vs unconstrained ones
+    """
+    now = datetime.datetime(2030, 1, 1)
+    step = datetime.timedelta(minutes=3.5)
+    rule_sets = {
+        "artist": {"artist": "artist 0"},
+        "folder": {"folder": "C:/Music/Artist 0/Album 5"},
+        "decade": {"year": [1990, 1999]},
+        "short and liked": {"duration": [None, 180], "weight": [1.05, None]},
+        "not played 30d": {"not_played_since": 30},
+        "decade, not played": {"year": [1990, 1999], "not_played_since": 30},
+    }
+    for size in LIBRARY_SIZES:
+        core = PlayerCore(JsonLibraryStore(os.devnull), rng=random.Random(seed))
+        core.data = TrackTable(tagged_entries(size, seed))
+        core.index_library()
+        core.rebuild_scores(now)
+        start = time.perf_counter()
+        index = core.get_tag_index()
+        print(f"{'index build':<28} {size:>8} tracks  {(time.perf_counter() - start) * 1000:9.1f} ms")
+
+        for name, rules in rule_sets.items():
+            expected = reference_filter(core.data, rules, now)
+            assert index.members(Playlist(rules), now) == expected, name
+            for label, fn in ((f"{name}: scan", lambda: reference_filter(core.data, rules, now)),
+                              (f"{name}: index", lambda: index.members(Playlist(rules), now))):
+                timings = []
+                for _ in range(evaluations if size < 100_000 or label.endswith("index") else 3):
+                    start = time.perf_counter()
+                    fn()
+                    timings.append(time.perf_counter() - start)
+                report(label, size, timings)
+            print(f"{'':<46}{len(expected)} songs")
+
+        # Songs leave "not played" as they play, so that one goes first, and
+        # no more picks than would play a quarter of the library
+        played = now
+        for name, rules in (("not played 30d", {"not_played_since": 30}), ("album", {"album": "album 7"}),
+                            ("artist", {"artist": "artist 0"}), ("whole library", None)):
+            playlist = Playlist(rules) if rules is not None else None
+            core.set_playlist(playlist)
+            timings = []
+            for _ in range(min(picks, size // 4)):
+                played += step
+                start = time.perf_counter()
+                song = core.pick_song(played)
+                core.mark_played(song, played)
+                timings.append(time.perf_counter() - start)
+                if rules is not None and "not_played_since" not in rules:
+                    assert reference_filter({song: core.data[song]}, rules, now), (name, song)
+            report(f"pick + play: {name}", size, timings)
+        core.set_playlist(None)
+
+
+def bench_zones(size=20_000, zones=4, plays=2_000, seed=0):
+    """
+    Memory per playback zone over one library: a second full PlayerCore (what
+    a process per zone holds on top of the interpreter and libvlc) against
+    each ProfileCore added on the shared catalogue, after plays picks and
+    plays on each, every tenth one voted on.
+    """
+    now = datetime.datetime(2030, 1, 1)
+    step = datetime.timedelta(minutes=3.5)
+
+    def listen(core, rng):
+        played = now
+        for i in range(plays):
+            played += step
+            song = core.pick_song(played)
+            core.mark_played(song, played)
+            if i % 10 == 0:
+                core.vote(song, rng.choice([0.8, 1.25]), played)
+
+    def open_core():
+        core = PlayerCore(JsonLibraryStore(os.devnull), rng=random.Random(seed))
+        core.data = TrackTable(analyzed_entries(size, seed))
+        core.index_library()
+        core.rebuild_scores(now)
+        return core
+
+    tracemalloc.start()
+    host = open_core()
+    host_mb = tracemalloc.get_traced_memory()[0] / 1024 / 1024
+    print(f"host core          {size:>8} tracks  {host_mb:9.1f} MB")
+    kept = []
+    before = tracemalloc.get_traced_memory()[0]
+    full = open_core()
+    listen(full, random.Random(seed))
+    kept.append(full)
+    full_mb = (tracemalloc.get_traced_memory()[0] - before) / 1024 / 1024
+    print(f"+ full core        {size:>8} tracks  {full_mb:9.1f} MB  {full_mb * 1024 * 1024 / size:7.0f} B/track")
+    for zone in range(1, zones + 1):
+        before = tracemalloc.get_traced_memory()[0]
+        profile = ProfileCore(host, JsonLibraryStore(os.devnull), rng=random.Random(seed + zone))
+        listen(profile, random.Random(seed + zone))
+        kept.append(profile)
+        mb = (tracemalloc.get_traced_memory()[0] - before) / 1024 / 1024
+        print(f"+ profile {zone:<8} {size:>8} tracks  {mb:9.1f} MB  {mb * 1024 * 1024 / size:7.0f} B/track  "
+              f"({len(profile.data.own)} songs with history)")
+    tracemalloc.stop()
+
+    # The profiles pick from their own histories: the same song plays at
+    # different times in each, and the host's entry is left alone
+    song = next(iter(kept[1].data.own))
+    print(f"{song}: host last played {host.data[song]['last_played']}, "
+          + ", ".join(f"profile {i} {profile.data[song]['last_played']}"
+                      for i, profile in enumerate(kept[1:], 1)))
+
+
+def peak_rss_mb():
+    if resource is None:
+        return float("nan")
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def bench_session(picks=1_000_000, size=10_000, track_minutes=3.5, seed=0):
+    """
+    A long listening session on the headless core with a null playback backend:
+    every track is picked and saved, and along the way songs are voted on,
+    added and removed. Time runs on a simulated clock, one track at a time.
+    Reports pick and save latency, and peak memory every tenth of the session.
+    """
+    rng = random.Random(seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        make_tree(tmp, size)
+        paths = [os.path.join(folder, name) for folder, _, names in os.walk(tmp) for name in names]
+        data = {os.path.normpath(path): {"last_played": "2000-01-01", "vote_weight": 1.0, "path": path}
+                for path in paths}
+        store = SqliteLibraryStore(os.path.join(tmp, "songs.db"))
+        store.save_all(data)
+
+        # Commits are scheduled a couple of seconds out, so with tracks minutes
+        # long every scheduled flush is due by the next track
+        pending = []
+        journal = EventJournal(os.path.join(tmp, "events.log"))
+        core = PlayerCore(store, lambda ms, func: pending.append(func), rng=random.Random(seed),
+                          journal=journal)
+        player = HeadlessPlayer(core)
+        now = datetime.datetime(2030, 1, 1)
+        step = datetime.timedelta(minutes=track_minutes)
+        core.rebuild_scores(now)
+        print(f"session over {len(core.data)} tracks, {picks} picks, "
+              f"peak RSS {peak_rss_mb():.0f} MB after load")
+
+        pick_times, save_times = [], []
+        votes = adds = removes = 0
+        checkpoint = max(1, picks // 10)
+        started = time.perf_counter()
+        for i in range(1, picks + 1):
+            now += step
+            start = time.perf_counter()
+            song = core.pick_playable_song(now)
+            picked = time.perf_counter()
+            if song is None:
+                break
+            meta = core.data[song]
+            player.backend.play(meta["path"], meta.get("gain_db"))
+            player.current_song = song
+            core.mark_played(song, now)
+            for flush in pending:
+                flush()
+            pending.clear()
+            pick_times.append(picked - start)
+            save_times.append(time.perf_counter() - picked)
+
+            roll = rng.random()
+            if roll < 0.1:
+                player.vote(rng.choice([0.9, 1.1]), now)
+                votes += 1
+            elif roll < 0.11:
+                path = os.path.join(tmp, f"added {i:07d}.mp3")
+                open(path, "wb").close()
+                added = core.new_song_entry(path)
+                core.save_songs([added], now)
+                adds += 1
+            elif roll < 0.12 and len(core.data) > core.repeat_limit * 2:
+                victim = rng.choice(list(core.data))
+                if victim in core.data:
+                    os.remove(core.data[victim]["path"])
+                    player.remove([victim])
+                    removes += 1
+
+            if i % checkpoint == 0:
+                print(f"  {i:>9} picks  {time.perf_counter() - started:7.1f} s  "
+                      f"{len(core.data):>7} tracks  peak RSS {peak_rss_mb():7.0f} MB")
+        core.close()
+
+    print(f"{votes} votes, {adds} adds, {removes} removes")
+    report("pick", size, pick_times)
+    report("save (update + commit)", size, save_times)
+
+
+async def ws_subscribe(port):
+    """Open the control server's event stream; returns (reader, writer)"""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    key = base64.b64encode(os.urandom(16)).decode()
+    writer.write((f"GET /events HTTP/1.1\r\nHost: localhost\r\nUpgrade: websocket\r\n"
+                  f"Connection: Upgrade\r\nSec-WebSocket-Key: {key}\r\n"
+                  f"Sec-WebSocket-Version: 13\r\n\r\n").encode())
+    head = await reader.readuntil(b"\r\n\r\n")
+    if b" 101 " not in head.split(b"\r\n", 1)[0]:
+        raise RuntimeError(f"WebSocket upgrade refused: {head!r}")
+    return reader, writer
+
+
+async def http_post(reader, writer, path, params):
+    """One request on a kept-alive connection; returns (status, reply)"""
+    body = json.dumps(params).encode()
+    writer.write((f"POST {path} HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n"
+                  f"Content-Length: {len(body)}\r\n\r\n").encode() + body)
+    head = await reader.readuntil(b"\r\n\r\n")
+    status = int(head.split(b" ", 2)[1])
+    length = int(re.search(rb"Content-Length: (\d+)", head).group(1))
+    return status, json.loads(await reader.readexactly(length))
+
+
+def subscriber_process(port, count, ready, final_seq, results):
+    """
+    count event-stream clients in a process of their own. Puts (delays,
+    clients that saw the last event) on results once final_seq is set and
+    reached, or after a timeout.
+    """
+    async def client(delays, seen):
+        reader, writer = await ws_subscribe(port)
+        ready.release()
+        buffer = b""
+        try:
+            while True:
+                # Whole reads split into frames here; cheaper than a read per frame
+                data = await reader.read(1 << 16)
+                if not data:
+                    break
+                buffer += data
+                now = time.time()
+                offset = 0
+                while len(buffer) - offset >= 2:
+                    size, header = buffer[offset + 1] & 0x7f, 2
+                    if size == 126:
+                        if len(buffer) - offset < 4:
+                            break
+                        size, header = int.from_bytes(buffer[offset + 2:offset + 4], "big"), 4
+                    end = offset + header + size
+                    if len(buffer) < end:
+                        break
+                    message = json.loads(buffer[offset + header:end])
+                    offset = end
+                    if message["event"] != "snapshot":
+                        delays.append(now - message["at"])
+                    seen[0] = message["seq"]
+                buffer = buffer[offset:]
+        except (asyncio.CancelledError, ConnectionError):
+            pass
+        writer.close()
+
+    async def run():
+        delays = []
+        seen = [[0] for _ in range(count)]
+        tasks = [asyncio.ensure_future(client(delays, seen[i])) for i in range(count)]
+        deadline = None
+        while True:
+            await asyncio.sleep(0.05)
+            final = final_seq.value
+            if final:
+                deadline = deadline or time.perf_counter() + 10
+                if all(s[0] >= final for s in seen) or time.perf_counter() > deadline:
+                    break
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        return delays, sum(1 for s in seen if s[0] >= final)
+
+    results.put(asyncio.run(run()))
+
+
+def bench_control(subscribers=500, commands=1000, rate=100, connections=20, size=10_000,
+                  processes=4, seed=0):
+    """
+    Load test for the control server: many WebSocket clients subscribed to
+    the state stream, spread over a few processes, while a pool of HTTP
+    clients sends play-next, vote and seek commands to a headless player
+    with the null backend, rate commands a second between them (0 for as
+    fast as they go). Reports command latency and the delay from each state
+    change to its arrival at every subscriber.
+    """
+    import multiprocessing
+    rng = random.Random(seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        make_tree(tmp, size)
+        paths = [os.path.join(folder, name) for folder, _, names in os.walk(tmp) for name in names]
+        store = SqliteLibraryStore(os.path.join(tmp, "songs.db"))
+        store.save_all({os.path.normpath(path): {"last_played": "2000-01-01", "vote_weight": 1.0,
+                                                 "path": path} for path in paths})
+        # The player's own thread; every command runs on it, one at a time
+        owner = ThreadPoolExecutor(max_workers=1)
+        core = owner.submit(PlayerCore, store, rng=random.Random(seed),
+                            journal=EventJournal(os.path.join(tmp, "events.log"))).result()
+        player = HeadlessPlayer(core)
+        server = ControlServer(player.control_commands(), call_via(owner.submit), port=0).start()
+        player.listener = server.publish
+
+        context = multiprocessing.get_context("spawn")
+        ready = context.Semaphore(0)
+        final_seq = context.Value("q", 0)
+        results = context.Queue()
+        workers = [context.Process(target=subscriber_process,
+                                   args=(server.port, len(range(i, subscribers, processes)),
+                                         ready, final_seq, results))
+                   for i in range(processes)]
+        for worker in workers:
+            worker.start()
+        for _ in range(subscribers):
+            ready.acquire()
+
+        async def commander(count, latencies, failures, started):
+            reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+            interval = connections / rate if rate else 0
+            phase = rng.random() * interval
+            for i in range(count):
+                delay = started + phase + i * interval - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                roll = rng.random()
+                if roll < 0.6:
+                    path, params = "/play-next", {}
+                elif roll < 0.9:
+                    path, params = "/vote", {"multiplier": rng.choice([0.9, 1.1])}
+                else:
+                    path, params = "/seek", {"position": rng.uniform(0, 200)}
+                start = time.perf_counter()
+                status, _ = await http_post(reader, writer, path, params)
+                latencies.append(time.perf_counter() - start)
+                if status != 200:
+                    failures.append(status)
+            writer.close()
+
+        async def run():
+            latencies, failures = [], []
+            started = time.perf_counter()
+            await asyncio.gather(*(commander(commands // connections, latencies, failures, started)
+                                   for _ in range(connections)))
+            return latencies, failures
+
+        start = time.perf_counter()
+        latencies, failures = asyncio.run(run())
+        elapsed = time.perf_counter() - start
+        coalesced = sum(client.coalesced for client in list(server.subscribers))
+        final_seq.value = server.seq
+        delays, caught_up = [], 0
+        for _ in workers:
+            worker_delays, worker_caught_up = results.get()
+            delays += worker_delays
+            caught_up += worker_caught_up
+        for worker in workers:
+            worker.join()
+        server.stop()
+        owner.submit(core.close).result()
+        owner.shutdown()
+
+    print(f"{subscribers} subscribers in {processes} processes, {connections} command connections: "
+          f"{len(latencies)} commands in {elapsed:.2f} s ({len(latencies) / elapsed:,.0f}/s), "
+          f"{len(failures)} failed")
+    print(f"{server.seq} events, {len(delays):,} deliveries, {coalesced} backlogs coalesced, "
+          f"{caught_up}/{subscribers} subscribers saw the last event")
+    report("command round trip", size, latencies)
+    report("event fan-out delay", size, delays)
+
+
+def bench_metrics(picks=20_000, size=10_000, rounds=5, seed=0):
+    """
+    Cost of instrumentation on the pick path: the same picks on a plain core,
+    with metrics disabled, with timing histograms, and with the sampling
+    profiler running as well, taking turns so none gets a warmer machine.
+    Prints the histograms the run produced and the profile's hottest stacks.
+    """
+    data = make_library(size)
+    now = datetime.datetime(2030, 1, 1)
+    modes = ("plain", "disabled", "enabled", "profiled")
+    cores, registries = {}, {}
+    for mode in modes:
+        core = PlayerCore(JsonLibraryStore(os.devnull), rng=random.Random(seed))
+        core.data = TrackTable(data)
+        core.rebuild_scores(now)
+        registries[mode] = Metrics(enabled=mode in ("enabled", "profiled"))
+        if mode != "plain":
+            registries[mode].instrument(core, "pick_song", "save_songs")
+            registries[mode].instrument(core.scheduler, "refresh")
+        cores[mode] = core
+    profiler = SamplingProfiler()
+    timings = {mode: [] for mode in modes}
+    for _ in range(rounds):
+        for mode in modes:
+            core = cores[mode]
+            if mode == "profiled":
+                profiler.start()
+            start = time.perf_counter()
+            for _ in range(picks):
+                core.previous_song = core.pick_song(now)
+            timings[mode].append(time.perf_counter() - start)
+            if mode == "profiled":
+                profiler.stop()
+
+    plain = min(timings["plain"])
+    for mode in modes:
+        best = min(timings[mode])
+        print(f"{mode:<10} {picks} picks, best of {rounds}: {best:7.3f} s  "
+              f"{best / picks * 1e6:6.2f} us/pick  ({(best / plain - 1) * 100:+5.1f}%)")
+    pick = registries["enabled"].to_dict()["pick_song_seconds"]
+    print(f"pick_song histogram: {pick['count']} calls, mean {pick['mean'] * 1e6:.1f} us, "
+          f"p95 <= {pick['p95'] * 1e6:.0f} us")
+    lines = registries["enabled"].prometheus().splitlines()
+    print(f"Prometheus export: {len(lines)} lines, e.g. {lines[-1]}")
+    print(f"profile: {profiler.samples} samples, {len(profiler.stacks)} distinct stacks; hottest:")
+    for line in profiler.folded().splitlines()[:3]:
+        stack, count = line.rsplit(" ", 1)
+        print(f"  {count:>6}  ...{stack[-100:]}")
+
+
+def legacy_draw_button(button, bg_color, fg_color):
+    """How RoundedButton used to redraw: every item deleted and created again"""
+    button.delete("all")
+    w, h = button.winfo_reqwidth(), button.winfo_reqheight()
+    r = button.corner_radius
+    button.create_arc(0, 0, r*2, r*2, start=90, extent=90, fill=bg_color, outline="")
+    button.create_arc(w-r*2, 0, w, r*2, start=0, extent=90, fill=bg_color, outline="")
+    button.create_arc(0, h-r*2, r*2, h, start=180, extent=90, fill=bg_color, outline="")
+    button.create_arc(w-r*2, h-r*2, w, h, start=270, extent=90, fill=bg_color, outline="")
+    button.create_rectangle(r, 0, w-r, h, fill=bg_color, outline="")
+    button.create_rectangle(0, r, w, h-r, fill=bg_color, outline="")
+    button.create_text(w//2, h//2, text=button.text, fill=fg_color, font=("Segoe UI", 11, "bold"))
+
+
+def last_item_id(canvas):
+    """Canvas item ids only ever grow, so a throwaway item's id counts every item made so far"""
+    probe = canvas.create_line(0, 0, 0, 0)
+    canvas.delete(probe)
+    return probe
+
+
+def bench_canvas(interactions=2_000, art_songs=200):
+    """
+    Canvas items allocated per button interaction (hover in, hover out, pause
+    toggle) by the old redraw-everything RoundedButton and the current one,
+    and the time per interaction. With Pillow installed, also the cost of
+    rounding a song's art corners with a fresh mask against the shared one.
+    """
+    if sys.platform.startswith("linux") and not os.environ.get("DISPLAY"):
+        print("no DISPLAY, skipping button rendering (run under xvfb-run)")
+    else:
+        import tkinter as tk
+        from main import RoundedButton
+        root = tk.Tk()
+        root.withdraw()
+        labels = ("⏸ Pause", "▶ Resume")
+        for mode in ("redraw", "cached"):
+            button = RoundedButton(root, labels[0], lambda: None, "#16213e", "#ffffff", "#39c5bb")
+            first = last_item_id(button)
+            start = time.perf_counter()
+            for i in range(interactions):
+                label = labels[i % 2 == 0]
+                if mode == "redraw":
+                    legacy_draw_button(button, button.active_bg, button.fg)
+                    legacy_draw_button(button, button.bg, button.fg)
+                    button.text = label
+                    legacy_draw_button(button, button.bg, button.fg)
+                else:
+                    button.on_enter(None)
+                    button.on_leave(None)
+                    button.set_text(label)
+            root.update_idletasks()
+            elapsed = time.perf_counter() - start
+            steps = 3 * interactions
+            # Less the probe item taken at the start
+            allocated = last_item_id(button) - first - 1
+            print(f"{mode:<7} {steps} interactions: {allocated / steps:5.2f} items "
+                  f"allocated each, {elapsed / steps * 1e6:7.1f} us each, "
+                  f"{len(button.find_all())} items on the canvas")
+            button.destroy()
+        root.destroy()
+
+    try:
+        from PIL import Image, ImageDraw
+    except ImportError:
+        print("Pillow not installed, skipping album art corners")
+        return
+    from art_loader import ART_SIZE, CORNER_RADIUS, add_rounded_corners
+
+    def fresh_mask_corners(image, radius):
+        mask = Image.new('L', image.size, 0)
+        ImageDraw.Draw(mask).rounded_rectangle([(0, 0), image.size], radius, fill=255)
+        result = Image.new('RGBA', image.size)
+        result.paste(image, (0, 0))
+        result.putalpha(mask)
+        return result
+
+    images = [Image.new("RGB", ART_SIZE, (i % 256, 40, 90)) for i in range(art_songs)]
+    for name, corners in (("fresh mask", fresh_mask_corners), ("shared mask", add_rounded_corners)):
+        start = time.perf_counter()
+        results = [corners(image, CORNER_RADIUS) for image in images]
+        elapsed = time.perf_counter() - start
+        print(f"{name:<12} {art_songs} songs: {elapsed / art_songs * 1e6:7.1f} us per song")
+    if fresh_mask_corners(images[0], CORNER_RADIUS).tobytes() != results[0].tobytes():
+        print("WARNING: shared-mask corners differ from the fresh-mask ones")
+
+
+def bench_simulate(tracks=100_000, days=90, processes=2):
+    """
+    The selection simulator (simulator.py): months of listening over a large
+    library, a repeat run to check it comes out the same, and a small sweep
+    run one process at a time and then in parallel.
+    """
+    result = simulate({"tracks": tracks, "days": days})
+    metrics = result["metrics"]
+    print(f"{days} days over {tracks} tracks: {metrics['plays']} plays in {metrics['seconds']:.1f} s, "
+          f"coverage {metrics['coverage']:.3f}, median repeat {metrics['repeat_median_days']:.1f} days")
+
+    small = {"tracks": 10_000, "days": 30}
+    first, second = simulate(small)["metrics"], simulate(small)["metrics"]
+    same = all(first[key] == second[key] for key in first if key != "seconds")
+    print(f"repeat run {'matches' if same else 'DIFFERS'}")
+
+    grid = {"tracks": [10_000], "days": [30], "repeat_limit": [50, 150, 300, 1000]}
+    runs = []
+    for workers in (1, processes):
+        start = time.perf_counter()
+        runs.append(sweep(grid, workers))
+        print(f"sweep of {len(runs[-1])} with {workers} process(es): {time.perf_counter() - start:.1f} s "
+              f"({os.cpu_count()} CPUs)")
+    same = all({k: v for k, v in a["metrics"].items() if k != "seconds"}
+               == {k: v for k, v in b["metrics"].items() if k != "seconds"} for a, b in zip(*runs))
+    print(f"parallel sweep {'matches' if same else 'DIFFERS FROM'} the serial one")
+    print(format_results(runs[-1], ["repeat_limit"]))
+
+
+def bench_startup(top=10):
+    """
+    Cold start of main.py: import time of the module (python -X importtime),
+    then the time to first paint and to a loaded library, as printed by the
+    app itself in startup-probe mode.
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"],
+                            cwd=here, capture_output=True, text=True)
+    imports = []
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line and "cumulative" not in line:
+            _, cumulative, name = line[len("import time:"):].split("|")
+            depth = (len(name) - len(name.lstrip()) - 1) // 2
+            imports.append((int(cumulative), name.strip(), depth))
+    if result.returncode != 0 or not imports:
+        print(f"import main failed:\n{result.stderr[-2000:]}")
+        return
+    total = next(us for us, name, depth in imports if name == "main" and depth == 0)
+    print(f"import main      {total / 1000:8.1f} ms, slowest imports it makes:")
+    # main's own imports are the ones nested one level under it
+    direct = sorted(((us, name) for us, name, depth in imports if depth == 1), reverse=True)
+    for us, name in direct[:top]:
+        print(f"  {name:<28} {us / 1000:8.1f} ms")
+
+    if sys.platform.startswith("linux") and not os.environ.get("DISPLAY"):
+        print("no DISPLAY, skipping first paint (run under xvfb-run)")
+        return
+    # A scratch data folder, so the probe neither opens nor creates a library in the checkout
+    with tempfile.TemporaryDirectory() as data_dir:
+        env = dict(os.environ, SMART_PLAYER_STARTUP_PROBE="1", SMART_PLAYER_DATA_DIR=data_dir)
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, "main.py"], cwd=here, env=env,
+                                capture_output=True, text=True, timeout=120)
+    print(result.stdout.strip())
+    print(f"process exited after {(time.perf_counter() - start) * 1000:.0f} ms "
+          f"(code {result.returncode})")
+
+
+BENCHMARKS = {
+    "store_writes": bench_store_writes,
+    "scores": bench_scores,
+    "picks": bench_picks,
+    "incremental": bench_incremental,
+    "scan": bench_scan,
+    "tags": bench_tags,
+    "watch": bench_watch,
+    "search": bench_search,
+    "similarity": bench_similarity,
+    "memory": bench_memory,
+    "zones": bench_zones,
+    "playlists": bench_playlists,
+    "session": bench_session,
+    "control": bench_control,
+    "metrics": bench_metrics,
+    "simulate": bench_simulate,
+    "canvas": bench_canvas,
+    "startup": bench_startup,
+}
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        print(f"== {name}")
+        BENCHMARKS[name]()
@@ -0,0 +1,112 @@
+"""
+pytest-benchmark suite for the headless core, over a synthetic library on
+disk with a null playback backend and a simulated clock:
+
+    python -m pytest benchmarks --benchmark-autosave
+
+and --benchmark-compare against an earlier run. BENCH_TRACKS and
+BENCH_PICKS size the library and the long session; the session defaults to
+a short one so the suite fits in a test run, BENCH_PICKS=1000000 is the
+full one. benchmark.py session prints the same session with checkpoints.
+"""
+import os
+import random
+import datetime
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+from benchmark import make_tree, peak_rss_mb
+from library_store import SqliteLibraryStore
+from journal import EventJournal
+from player_core import PlayerCore
+from playback import HeadlessPlayer
+
+TRACKS = int(os.environ.get("BENCH_TRACKS", 10_000))
+PICKS = int(os.environ.get("BENCH_PICKS", 5_000))
+STEP = datetime.timedelta(minutes=3.5)
+
+
+class Session:
+    """A core over a library of TRACKS files under root, whose scheduled commits run on each track"""
+
+    def __init__(self, root, seed=0):
+        self.root = root
+        make_tree(root, TRACKS)
+        paths = [os.path.join(folder, name) for folder, _, names in os.walk(root) for name in names]
+        store = SqliteLibraryStore(os.path.join(root, "songs.db"))
+        store.save_all({os.path.normpath(path): {"last_played": "2000-01-01", "vote_weight": 1.0,
+                                                 "path": path} for path in paths})
+        self.pending = []
+        self.core = PlayerCore(store, lambda ms, func: self.pending.append(func),
+                               rng=random.Random(seed), journal=EventJournal(os.path.join(root, "events.log")))
+        self.player = HeadlessPlayer(self.core)
+        self.rng = random.Random(seed)
+        self.now = datetime.datetime(2030, 1, 1)
+        self.core.rebuild_scores(self.now)
+        self.added = 0
+
+    def pick(self):
+        self.now += STEP
+        return self.core.pick_playable_song(self.now)
+
+    def save(self, song):
+        self.player.current_song = song
+        self.core.mark_played(song, self.now)
+        for flush in self.pending:
+            flush()
+        self.pending.clear()
+
+    def track(self):
+        """One track of a session: pick, play, save, and now and then a vote, an add or a remove"""
+        song = self.pick()
+        meta = self.core.data[song]
+        self.player.backend.play(meta["path"], meta.get("gain_db"))
+        self.save(song)
+        roll = self.rng.random()
+        if roll < 0.1:
+            self.player.vote(self.rng.choice([0.9, 1.1]), self.now)
+        elif roll < 0.11:
+            self.added += 1
+            path = os.path.join(self.root, f"added {self.added:07d}.mp3")
+            open(path, "wb").close()
+            self.core.save_songs([self.core.new_song_entry(path)], self.now)
+        elif roll < 0.12 and len(self.core.data) > self.core.repeat_limit * 2:
+            victim = self.rng.choice(list(self.core.data))
+            os.remove(self.core.data[victim]["path"])
+            self.player.remove([victim])
+
+    def close(self):
+        self.core.close()
+
+
+@pytest.fixture
+def session(tmp_path):
+    session = Session(str(tmp_path))
+    yield session
+    session.close()
+
+
+def test_pick_latency(benchmark, session):
+    benchmark.extra_info["tracks"] = TRACKS
+    benchmark(session.pick)
+
+
+def test_save_latency(benchmark, session):
+    benchmark.extra_info["tracks"] = TRACKS
+    song = session.pick()
+    benchmark(session.save, song)
+
+
+def test_long_session(benchmark, session):
+    """PICKS tracks with votes, adds and removes, with peak memory before and after"""
+    def run():
+        for _ in range(PICKS):
+            session.track()
+
+    loaded = peak_rss_mb()
+    benchmark.pedantic(run, rounds=1, iterations=1)
+    benchmark.extra_info.update(tracks=TRACKS, picks=PICKS, songs_after=len(session.core.data),
+                                peak_rss_mb_loaded=round(loaded, 1),
+                                peak_rss_mb=round(peak_rss_mb(), 1))
+    assert len(session.core.data) > session.core.repeat_limit
@@ -0,0 +1,140 @@
+import os
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from scanner import path_key
+
+CHUNK = 1024 * 1024
+SAMPLE = 256 * 1024
+
+
+def audio_payload_range(f, size):
+    """(start, end) byte offsets of an MP3's audio frames, skipping ID3v2, APEv2 and ID3v1 tags"""
+    start, end = 0, size
+
+    f.seek(0)
+    header = f.read(10)
+    if len(header) == 10 and header[:3] == b"ID3":
+        tag_size = ((header[6] & 0x7f) << 21 | (header[7] & 0x7f) << 14
+                    | (header[8] & 0x7f) << 7 | (header[9] & 0x7f))
+        has_footer = header[5] & 0x10
+        start = min(10 + tag_size + (10 if has_footer else 0), size)
+
+    if end - start >= 128:
+        f.seek(end - 128)
+        if f.read(3) == b"TAG":
+            end -= 128
+
+    if end - start >= 32:
+        f.seek(end - 32)
+        footer = f.read(32)
+        if footer[:8] == b"APETAGEX":
+            tag_size = int.from_bytes(footer[12:16], "little")
+            flags = int.from_bytes(footer[20:24], "little")
+            has_header = flags & 0x80000000
+            end = max(start, end - tag_size - (32 if has_header else 0))
+
+    return start, end
+
+
+def _hash_range(f, digest, start, end):
+    f.seek(start)
+    remaining = end - start
+    while remaining > 0:
+        chunk = f.read(min(CHUNK, remaining))
+        if not chunk:
+            break
+        digest.update(chunk)
+        remaining -= len(chunk)
+
+
+def audio_id(path):
+    """
+    Fast identity for a track: a hash of the audio payload's length and three
+    samples from its start, middle and end. Retagging or moving a file keeps
+    the same id.
+    """
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        start, end = audio_payload_range(f, size)
+        length = end - start
+        digest = hashlib.blake2b(str(length).encode(), digest_size=16)
+        if length <= 3 * SAMPLE:
+            _hash_range(f, digest, start, end)
+        else:
+            middle = start + (length - SAMPLE) // 2
+            for offset in (start, middle, end - SAMPLE):
+                _hash_range(f, digest, offset, offset + SAMPLE)
+    return digest.hexdigest()
+
+
+def full_hash(path, audio_only=False):
+    """Hash of the whole file, or of the whole audio payload, read in chunks"""
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        start, end = audio_payload_range(f, size) if audio_only else (0, size)
+        digest = hashlib.blake2b(digest_size=16)
+        _hash_range(f, digest, start, end)
+    return digest.hexdigest()
+
+
+def hash_files(paths, func=audio_id, max_workers=8):
+    """{path: hash} for the files that could be read; hashing releases the GIL so threads scale"""
+    def safe(path):
+        try:
+            return func(path)
+        except OSError as e:
+            print(f"Failed to hash {path}: {e}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        results = dict(zip(paths, pool.map(safe, paths)))
+    return {path: digest for path, digest in results.items() if digest is not None}
+
+
+def hash_scan_changes(result, unhashed, max_workers=8):
+    """
+    Audio ids for a scan's new and changed files, and for the unhashed
+    entries it didn't find deleted. result is what scan_folder returns.
+    """
+    added, changed, deleted = result
+    gone = set(deleted)
+    to_hash = [path for path, _, _ in added + changed]
+    to_hash += [path for path in unhashed if path_key(path) not in gone]
+    return hash_files(to_hash, max_workers=max_workers)
+
+
+def find_duplicates(entries, max_workers=8):
+    """
+    Group library entries that hold the same audio.
+    entries is a list of (song, path, audio_id). Candidates sharing an
+    audio_id are confirmed with full hashes. Returns (byte_identical,
+    audio_identical): lists of song groups. Audio-identical groups are files
+    whose audio matches but whose tags differ; any byte-identical copies among
+    them are also listed in byte_identical.
+    """
+    by_id = {}
+    for song, path, ident in entries:
+        if ident:
+            by_id.setdefault(ident, []).append((song, path))
+    candidates = [group for group in by_id.values() if len(group) > 1]
+    paths = [path for group in candidates for _, path in group]
+
+    audio_hashes = hash_files(paths, lambda p: full_hash(p, audio_only=True), max_workers)
+    file_hashes = hash_files(paths, full_hash, max_workers)
+
+    byte_identical, audio_identical = [], []
+    for group in candidates:
+        by_audio = {}
+        for song, path in group:
+            if path in audio_hashes:
+                by_audio.setdefault(audio_hashes[path], []).append((song, path))
+        for same_audio in by_audio.values():
+            if len(same_audio) < 2:
+                continue
+            by_file = {}
+            for song, path in same_audio:
+                by_file.setdefault(file_hashes.get(path), []).append(song)
+            byte_identical.extend(songs for songs in by_file.values() if len(songs) > 1)
+            if len(by_file) > 1:
+                audio_identical.append([song for song, _ in same_audio])
+    return byte_identical, audio_identical
@@ -0,0 +1,428 @@
+import json
+import time
+import base64
+import struct
+import asyncio
+import hashlib
+import hmac
+import threading
+from concurrent.futures import Future
+from urllib.parse import urlsplit, parse_qs
+
+WS_GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+# Largest request body or WebSocket frame accepted from a client
+MAX_BODY = 64 * 1024
+# Events a subscriber may fall behind by before its backlog is replaced by one snapshot
+CLIENT_BACKLOG = 64
+# Bytes a subscriber's socket may have unsent before its events are held back in its backlog
+WRITE_BUFFER_LIMIT = 256 * 1024
+# Events published this close together go out to subscribers in one write
+STREAM_INTERVAL = 0.002
+# Longest a command may take on the player's thread before the request fails
+COMMAND_TIMEOUT = 10.0
+
+# Names a client on this machine may reach a server bound to any of them by
+LOCAL_NAMES = ("127.0.0.1", "localhost", "::1")
+# Bound to one of these, the server answers to whatever name it was reached by
+WILDCARD_HOSTS = ("", "0.0.0.0", "::")
+
+STATUS_TEXT = {200: "OK", 400: "Bad Request", 401: "Unauthorized", 403: "Forbidden",
+               404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large",
+               415: "Unsupported Media Type", 500: "Internal Server Error",
+               504: "Gateway Timeout"}
+
+
+def call_via(post):
+    """
+    A call(func, params) for ControlServer that runs func(params) through
+    post(func, *args), e.g. a TkDispatcher's post or a single-thread
+    executor's submit, and returns a Future for what it returns
+    """
+    def run(future, func, params):
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(func(params))
+        except BaseException as e:
+            future.set_exception(e)
+
+    def call(func, params):
+        future = Future()
+        post(run, future, func, params)
+        return future
+    return call
+
+
+def number_param(params, name, low=None, high=None):
+    """params[name] as a float in [low, high], or ValueError for the client"""
+    try:
+        value = float(params[name])
+    except (KeyError, TypeError, ValueError):
+        raise ValueError(f"'{name}' must be a number")
+    if value != value or (low is not None and value < low) or (high is not None and value > high):
+        raise ValueError(f"'{name}' must be between {low} and {high}")
+    return value
+
+
+def ws_frame(payload, opcode=0x1):
+    """A single unmasked WebSocket frame, as a server sends them"""
+    size = len(payload)
+    if size < 126:
+        header = struct.pack("!BB", 0x80 | opcode, size)
+    elif size < 1 << 16:
+        header = struct.pack("!BBH", 0x80 | opcode, 126, size)
+    else:
+        header = struct.pack("!BBQ", 0x80 | opcode, 127, size)
+    return header + payload
+
+
+async def read_ws_frame(reader):
+    """(opcode, payload) of the next frame, unmasked"""
+    first, second = await reader.readexactly(2)
+    size = second & 0x7f
+    if size == 126:
+        size = struct.unpack("!H", await reader.readexactly(2))[0]
+    elif size == 127:
+        size = struct.unpack("!Q", await reader.readexactly(8))[0]
+    if size > MAX_BODY:
+        raise ValueError("WebSocket frame too large")
+    mask = await reader.readexactly(4) if second & 0x80 else None
+    payload = await reader.readexactly(size)
+    if mask and size:
+        key = (mask * (size // 4 + 1))[:size]
+        payload = (int.from_bytes(payload, "big") ^ int.from_bytes(key, "big")).to_bytes(size, "big")
+    return first & 0x0f, payload
+
+
+class Subscriber:
+    """
+    One WebSocket client of the state stream. Frames wait in its backlog
+    until the server flushes. While its socket can't take more it is skipped
+    until it drains, and once it falls CLIENT_BACKLOG events behind its
+    backlog is replaced by a single snapshot.
+    """
+
+    def __init__(self, writer, snapshot):
+        self.writer = writer
+        self.snapshot = snapshot
+        self.backlog = []
+        self.draining = False
+        self.coalesced = 0
+
+    def send(self, frame):
+        if len(self.backlog) >= CLIENT_BACKLOG:
+            # The snapshot already holds whatever frame changed
+            self.backlog = [self.snapshot()]
+            self.coalesced += 1
+            return
+        self.backlog.append(frame)
+
+    def flush(self):
+        if self.draining or not self.backlog:
+            return
+        if self.writer.transport.get_write_buffer_size() >= WRITE_BUFFER_LIMIT:
+            self.draining = True
+            asyncio.ensure_future(self._drain())
+            return
+        self.writer.write(b"".join(self.backlog))
+        self.backlog = []
+
+    async def _drain(self):
+        try:
+            await self.writer.drain()
+        except ConnectionError:
+            return
+        self.draining = False
+        self.flush()
+
+
+class ControlServer:
+    """
+    Local HTTP and WebSocket control of the player, on an asyncio loop in a
+    thread of its own:
+
+        GET  /state          the player's state
+        GET  /events         WebSocket: the state on connect, then each change
+        POST /<command>      one of commands, with an optional JSON body
+        GET  /metrics        with metrics, in Prometheus text format
+        GET  /metrics.json   the same as JSON
+
+    commands maps names to functions taking the parsed body as a dict; they
+    run through call(func, params), which must hand them to the thread that
+    owns the player and return a Future (see call_via). A ValueError from a
+    command is the client's fault and comes back as a 400.
+
+    publish(event, **fields) may be called from any thread: fields are
+    merged into the state and every subscriber is sent the event and the
+    new state, encoded once for all of them. A subscriber that can't keep
+    up is sent a single snapshot in place of what it missed.
+
+    With a token, clients must send it as a bearer token or ?token=.
+    Requests must name this server in Host, and a browser's Origin must be
+    it too, so web pages can't reach it through the user's browser; command
+    bodies must be sent as application/json for the same reason.
+    """
+
+    def __init__(self, commands, call, host="127.0.0.1", port=8765, token=None, state=None,
+                 metrics=None):
+        self.commands = commands
+        self.call = call
+        self.metrics = metrics
+        self.host = host
+        self.port = port
+        self.token = token
+        self.state = dict(state or {})
+        self.seq = 0
+        self.subscribers = set()
+        self.flush_scheduled = False
+        self.connections = set()
+        self.loop = None
+        self.server = None
+        self.thread = None
+        self.started = threading.Event()
+        self.error = None
+
+    # Lifecycle
+
+    def start(self):
+        """Start serving; returns once the port is bound (self.port is the real one)"""
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        self.started.wait()
+        if self.error is not None:
+            raise self.error
+        return self
+
+    def _run(self):
+        self.loop = asyncio.new_event_loop()
+        try:
+            self.server = self.loop.run_until_complete(
+                asyncio.start_server(self._handle, self.host, self.port, limit=MAX_BODY))
+        except OSError as e:
+            self.error = e
+            self.started.set()
+            return
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.started.set()
+        try:
+            self.loop.run_forever()
+        finally:
+            self.loop.close()
+
+    def stop(self):
+        if self.loop is None or self.server is None:
+            return
+
+        async def shutdown():
+            self.server.close()
+            for writer in list(self.connections):
+                writer.close()
+            # Closed connections end their handlers; cancel only what's left after that
+            tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+            if tasks:
+                _, pending = await asyncio.wait(tasks, timeout=1)
+                for task in pending:
+                    task.cancel()
+            self.loop.stop()
+
+        asyncio.run_coroutine_threadsafe(shutdown(), self.loop)
+        self.thread.join(timeout=5)
+
+    # State stream
+
+    def publish(self, event, **fields):
+        if self.loop is not None and not self.loop.is_closed():
+            try:
+                self.loop.call_soon_threadsafe(self._broadcast, event, fields, time.time())
+            except RuntimeError:
+                # Shutting down
+                pass
+        else:
+            self.state.update(fields)
+
+    def _message(self, event, at):
+        return ws_frame(json.dumps({"event": event, "seq": self.seq, "at": at,
+                                    "state": self.state}).encode())
+
+    def _broadcast(self, event, fields, at):
+        self.state.update(fields)
+        self.seq += 1
+        if not self.subscribers:
+            return
+        frame = self._message(event, at)
+        for subscriber in self.subscribers:
+            subscriber.send(frame)
+        if not self.flush_scheduled:
+            self.flush_scheduled = True
+            self.loop.call_later(STREAM_INTERVAL, self._flush)
+
+    def _flush(self):
+        self.flush_scheduled = False
+        for subscriber in self.subscribers:
+            subscriber.flush()
+
+    # HTTP
+
+    async def _handle(self, reader, writer):
+        self.connections.add(writer)
+        try:
+            while True:
+                request = await self._read_request(reader)
+                if request is None:
+                    break
+                method, target, headers, body = request
+                url = urlsplit(target)
+                if not self._same_host(headers.get("host"), default_port=None):
+                    await self._respond(writer, 403, {"error": "wrong Host"}, keep_alive=False)
+                    break
+                if "origin" in headers and not self._same_host(urlsplit(headers["origin"]).netloc):
+                    await self._respond(writer, 403, {"error": "cross-origin requests are not allowed"},
+                                        keep_alive=False)
+                    break
+                if not self._authorized(headers, parse_qs(url.query)):
+                    await self._respond(writer, 401, {"error": "missing or wrong token"})
+                elif url.path == "/events" and headers.get("upgrade", "").lower() == "websocket":
+                    await self._subscribe(reader, writer, headers)
+                    break
+                else:
+                    status, reply = await self._route(method, url.path, body,
+                                                      headers.get("content-type", ""))
+                    await self._respond(writer, status, reply,
+                                        keep_alive=headers.get("connection", "").lower() != "close")
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError, ValueError):
+            pass
+        finally:
+            self.connections.discard(writer)
+            writer.close()
+
+    async def _read_request(self, reader):
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.IncompleteReadError:
+            return None
+        lines = head.decode("latin-1").split("\r\n")
+        method, target, _ = lines[0].split(" ", 2)
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+        length = int(headers.get("content-length", 0))
+        if length > MAX_BODY:
+            raise ValueError("request body too large")
+        body = await reader.readexactly(length) if length else b""
+        return method, target, headers, body
+
+    def _same_host(self, netloc, default_port=80):
+        """
+        True if a Host or Origin netloc names this server: a local name for a
+        server bound to one, or the bound name otherwise, and the bound port.
+        A Host without a port is taken as this one; an Origin's means port 80.
+        """
+        if not netloc:
+            return False
+        try:
+            parts = urlsplit("//" + netloc)
+            name, port = (parts.hostname or "").lower(), parts.port
+        except ValueError:
+            return False
+        if port is None:
+            port = self.port if default_port is None else default_port
+        if port != self.port:
+            return False
+        bound = self.host.lower()
+        if bound in WILDCARD_HOSTS:
+            return True
+        if bound.strip("[]") in LOCAL_NAMES:
+            return name in LOCAL_NAMES
+        return name == bound.strip("[]")
+
+    def _authorized(self, headers, query):
+        if not self.token:
+            return True
+        token = self.token.encode()
+        header = headers.get("authorization", "")
+        given = query.get("token", [""])[0]
+        # Both compared every time, in time independent of where they differ
+        by_header = hmac.compare_digest(header.encode(), b"Bearer " + token)
+        by_query = hmac.compare_digest(given.encode(), token)
+        return by_header or by_query
+
+    async def _route(self, method, path, body, content_type=""):
+        name = path.strip("/")
+        if name == "state":
+            if method != "GET":
+                return 405, {"error": "use GET"}
+            return 200, {"state": self.state}
+        if name in ("metrics", "metrics.json") and self.metrics is not None:
+            if method != "GET":
+                return 405, {"error": "use GET"}
+            return 200, self.metrics.prometheus() if name == "metrics" else self.metrics.to_dict()
+        func = self.commands.get(name)
+        if func is None:
+            return 404, {"error": f"no such command: {name}"}
+        if method != "POST":
+            return 405, {"error": "use POST"}
+        # A form or text/plain post is what a web page can send without asking
+        if content_type.split(";")[0].strip().lower() != "application/json":
+            return 415, {"error": "send the body as application/json"}
+        try:
+            params = json.loads(body) if body else {}
+            if not isinstance(params, dict):
+                raise ValueError("body must be a JSON object")
+        except ValueError as e:
+            return 400, {"error": f"bad JSON: {e}"}
+        try:
+            result = await asyncio.wait_for(asyncio.wrap_future(self.call(func, params)),
+                                            COMMAND_TIMEOUT)
+        except ValueError as e:
+            return 400, {"error": str(e)}
+        except asyncio.TimeoutError:
+            return 504, {"error": f"{name} timed out"}
+        except Exception as e:
+            print(f"Control command {name} failed: {e}")
+            return 500, {"error": str(e)}
+        # Whatever the command published was queued on this loop before its result
+        return 200, {"result": result, "state": self.state}
+
+    async def _respond(self, writer, status, reply, keep_alive=True):
+        """reply goes out as JSON, or as plain text if it is a string"""
+        if isinstance(reply, str):
+            body, content_type = reply.encode(), "text/plain; version=0.0.4; charset=utf-8"
+        else:
+            body, content_type = json.dumps(reply).encode(), "application/json"
+        writer.write((f"HTTP/1.1 {status} {STATUS_TEXT[status]}\r\n"
+                      f"Content-Type: {content_type}\r\n"
+                      f"Content-Length: {len(body)}\r\n"
+                      f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n").encode() + body)
+        await writer.drain()
+
+    # WebSocket
+
+    async def _subscribe(self, reader, writer, headers):
+        key = headers.get("sec-websocket-key")
+        if not key:
+            await self._respond(writer, 400, {"error": "missing Sec-WebSocket-Key"}, keep_alive=False)
+            return
+        accept = base64.b64encode(hashlib.sha1(key.encode() + WS_GUID).digest()).decode()
+        writer.write(("HTTP/1.1 101 Switching Protocols\r\n"
+                      "Upgrade: websocket\r\nConnection: Upgrade\r\n"
+                      f"Sec-WebSocket-Accept: {accept}\r\n\r\n").encode())
+        subscriber = Subscriber(writer, lambda: self._message("snapshot", time.time()))
+        subscriber.send(subscriber.snapshot())
+        subscriber.flush()
+        self.subscribers.add(subscriber)
+        try:
+            while True:
+                opcode, payload = await read_ws_frame(reader)
+                if opcode == 0x8:
+                    writer.write(ws_frame(payload[:2], 0x8))
+                    break
+                if opcode == 0x9:
+                    subscriber.send(ws_frame(payload, 0xA))
+                    subscriber.flush()
+                # Anything else a client sends is ignored; commands go over HTTP
+        finally:
+            self.subscribers.discard(subscriber)
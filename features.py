@@ -0,0 +1,231 @@
+import os
+import numpy as np
+from loudness import SAMPLE_RATE, SUBBLOCK
+
+BANDS = 12
+BAND_EDGES = np.geomspace(40, 16000, BANDS + 1)
+ONSET_HOP = SAMPLE_RATE // 100      # 10 ms onset envelope
+MIN_BPM, MAX_BPM = 60, 200
+# 12 band level means, 12 band level deviations, centroid, energy, tempo, onset strength
+FEATURE_DIM = 2 * BANDS + 4
+
+
+class FeatureAccumulator:
+    """
+    Collects acoustic features from a track as it is decoded, a chunk at a
+    time, next to the loudness measurement. Gets each chunk's samples and the
+    power spectrum of its 100 ms frames, summed over channels.
+    """
+
+    def __init__(self):
+        freqs = np.fft.rfftfreq(SUBBLOCK, 1 / SAMPLE_RATE)
+        band = np.searchsorted(BAND_EDGES, freqs, side="right") - 1
+        self.band_matrix = np.zeros((len(freqs), BANDS))
+        inside = (band >= 0) & (band < BANDS)
+        self.band_matrix[np.nonzero(inside)[0], band[inside]] = 1.0
+        self.freqs = freqs
+        self.band_levels = []
+        self.frame_power = []
+        self.centroid_sum = 0.0
+        self.power_sum = 0.0
+        self.envelope = []
+
+    def add(self, samples, power):
+        total = power.sum(axis=1)
+        self.band_levels.append(np.log10(power @ self.band_matrix + 1e-9))
+        self.frame_power.append(total)
+        self.centroid_sum += float((power @ self.freqs).sum())
+        self.power_sum += float(total.sum())
+
+        mono = samples.mean(axis=1)
+        hops = len(mono) // ONSET_HOP
+        framed = mono[:hops * ONSET_HOP].reshape(hops, ONSET_HOP)
+        self.envelope.append(np.sqrt((framed ** 2).mean(axis=1)))
+
+    def tempo(self, envelope):
+        """Beats per minute from the autocorrelation of the onset strength"""
+        onsets = np.maximum(np.diff(np.log(envelope + 1e-4)), 0)
+        onsets -= onsets.mean()
+        if len(onsets) < 4 * 6000 // MIN_BPM:
+            return 0.0, 0.0
+        spectrum = np.fft.rfft(onsets, 2 * len(onsets))
+        autocorr = np.fft.irfft(np.abs(spectrum) ** 2)[:len(onsets)]
+        lags = np.arange(6000 // MAX_BPM, 6000 // MIN_BPM + 1)
+        # Lean toward tempos near 120 BPM, where octave errors are least likely
+        bias = np.exp(-0.5 * np.log2(lags / 50) ** 2)
+        best = lags[np.argmax(autocorr[lags] * bias)]
+        strength = float(np.maximum(np.diff(np.log(envelope + 1e-4)), 0).mean())
+        return 6000 / best, strength
+
+    def result(self):
+        """(fields for the song entry, embedding), or (None, None) for a silent track"""
+        if not self.frame_power:
+            return None, None
+        power = np.concatenate(self.frame_power)
+        levels = np.concatenate(self.band_levels)
+        # Leave silence out of the band statistics
+        loud = power > power.max() * 1e-4
+        if not loud.any():
+            return None, None
+        levels = levels[loud]
+
+        means = levels.mean(axis=0)
+        deviations = levels.std(axis=0)
+        centroid = self.centroid_sum / self.power_sum
+        energy = 10 * np.log10(power[loud].mean() / SUBBLOCK ** 2)
+        bpm, onset_strength = self.tempo(np.concatenate(self.envelope))
+
+        embedding = np.concatenate((
+            means - means.mean(),
+            deviations,
+            [np.log2(centroid / 1000), energy / 10,
+             np.log2(bpm / 120) if bpm else 0.0, onset_strength]
+        )).astype(np.float32)
+        fields = {"tempo": round(float(bpm), 1), "centroid": round(float(centroid), 1),
+                  "energy": round(float(energy), 2)}
+        return fields, embedding
+
+
+class FeatureMatrix:
+    """
+    Embeddings on disk as one float32 row per track, appended as tracks are
+    analyzed. Songs remember their row in their entry (feature_row), which
+    is written over when the track is analyzed again; load() maps the file
+    instead of reading it.
+    """
+
+    def __init__(self, path, dim=FEATURE_DIM):
+        self.path = path
+        self.dim = dim
+        self.row_bytes = dim * 4
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        self.rows = size // self.row_bytes
+        self.file = open(path, "r+b" if size else "w+b")
+        if size != self.rows * self.row_bytes:
+            # A half-written last row from a crash
+            self.file.truncate(self.rows * self.row_bytes)
+
+    def add(self, vector, row=None):
+        """Write a row over row if it is one of ours, else append it; returns its number"""
+        if row is None or not 0 <= row < self.rows:
+            row = self.rows
+            self.rows += 1
+        self.file.seek(row * self.row_bytes)
+        self.file.write(np.asarray(vector, dtype="<f4").tobytes())
+        return row
+
+    def load(self):
+        self.file.flush()
+        if not self.rows:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return np.memmap(self.path, dtype="<f4", mode="r", shape=(self.rows, self.dim))
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class SimilarityIndex:
+    """
+    Approximate nearest neighbours by cosine similarity, as an inverted file:
+    embeddings are standardized with the library's statistics, normalized, and
+    filed under the nearest of about sqrt(n) k-means centroids. A lookup
+    compares against the centroids, then only the songs in the nprobe
+    closest lists.
+    """
+
+    def __init__(self, keys, vectors, nprobe=8, rng=None):
+        """keys and vectors (one row each) must be non-empty"""
+        self.nprobe = nprobe
+        self.rng = rng if rng is not None else np.random.default_rng(0)
+        vectors = np.asarray(vectors, dtype=np.float32)
+        self.mean = vectors.mean(axis=0)
+        self.scale = vectors.std(axis=0) + 1e-6
+        self.built_size = len(keys)
+
+        self.keys = list(keys)
+        self.index = {key: i for i, key in enumerate(self.keys)}
+        self.vectors = self._normalize(vectors)
+        self.count = len(self.keys)
+        self.centroids = self._kmeans(self.vectors, max(1, int(np.sqrt(len(self.keys)))))
+        assignment = self._nearest_centroid(self.vectors)
+        self.assignment = assignment.tolist()
+        self.lists = [np.nonzero(assignment == c)[0] for c in range(len(self.centroids))]
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def _normalize(self, vectors):
+        standardized = (vectors - self.mean) / self.scale
+        norms = np.linalg.norm(standardized, axis=-1, keepdims=True)
+        return (standardized / np.maximum(norms, 1e-6)).astype(np.float32)
+
+    def _kmeans(self, vectors, clusters, iterations=8, sample=20000):
+        if len(vectors) > sample:
+            vectors = vectors[self.rng.choice(len(vectors), sample, replace=False)]
+        centroids = vectors[self.rng.choice(len(vectors), clusters, replace=False)]
+        for _ in range(iterations):
+            nearest = np.argmax(vectors @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, nearest, vectors)
+            counts = np.bincount(nearest, minlength=clusters)
+            filled = counts > 0
+            centroids[filled] = sums[filled] / counts[filled, None]
+            centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-6)
+        return centroids
+
+    def _nearest_centroid(self, vectors):
+        return np.argmax(vectors @ self.centroids.T, axis=1)
+
+    def add(self, key, vector):
+        """Add or replace a song's embedding, filed under the existing centroids"""
+        self.remove(key)
+        row = self._normalize(np.asarray(vector, dtype=np.float32)[None, :])
+        i = self.count
+        if i >= len(self.vectors):
+            grown = np.zeros((max(16, 2 * len(self.vectors)), self.vectors.shape[1]), np.float32)
+            grown[:len(self.vectors)] = self.vectors
+            self.vectors = grown
+        self.vectors[i] = row[0]
+        self.count += 1
+        self.keys.append(key)
+        self.index[key] = i
+        cluster = int(self._nearest_centroid(row)[0])
+        self.assignment.append(cluster)
+        self.lists[cluster] = np.append(self.lists[cluster], i)
+
+    def remove(self, key):
+        i = self.index.pop(key, None)
+        if i is None:
+            return
+        self.keys[i] = None
+        cluster = self.assignment[i]
+        self.lists[cluster] = self.lists[cluster][self.lists[cluster] != i]
+
+    def needs_rebuild(self):
+        """True once the library has doubled since the centroids were fitted"""
+        return len(self.index) > max(64, 2 * self.built_size)
+
+    def neighbours(self, key, k=50):
+        """Up to k (other song, cosine similarity) pairs, most similar first"""
+        i = self.index.get(key)
+        if i is None:
+            return [], []
+        query = self.vectors[i]
+        probe = min(self.nprobe, len(self.centroids))
+        closest = np.argpartition(-(self.centroids @ query), probe - 1)[:probe]
+        rows = np.concatenate([self.lists[c] for c in closest])
+        rows = rows[rows != i]
+        if not len(rows):
+            return [], []
+        sims = self.vectors[rows] @ query
+        if len(rows) > k:
+            top = np.argpartition(-sims, k - 1)[:k]
+            rows, sims = rows[top], sims[top]
+        order = np.argsort(-sims)
+        return [self.keys[r] for r in rows[order]], sims[order].tolist()
@@ -0,0 +1,107 @@
+import os
+import json
+
+# Share of a track past which it counts as played through (the rest is often silence or a fade)
+COMPLETE_FRACTION = 0.9
+
+
+def apply_event(data, event):
+    """
+    Apply one journal event to a library dict. Returns the song it touched.
+    Journaled events carry a sequence number and each song remembers the last
+    one applied to it, so replaying a journal over a snapshot that already
+    holds some of its events changes nothing twice.
+    """
+    song = event["song"]
+    kind = event["type"]
+    seq = event.get("seq")
+    if kind == "remove":
+        data.pop(song, None)
+        return song
+    if kind == "update":
+        data[song] = dict(event["meta"])
+    else:
+        meta = data.get(song)
+        if meta is None or (seq is not None and meta.get("seq", 0) >= seq):
+            return song
+        if kind == "play":
+            meta["last_played"] = event["at"]
+        elif kind == "vote":
+            meta["vote_weight"] = event["weight"]
+        elif kind == "finish":
+            # Each play adds the share of the track that was heard to completions
+            # and the rest to skips. Without a length that share is unknown, so
+            # the play counts as neither.
+            duration = event["duration"]
+            if duration > 0:
+                played = min(max(event["position"] / duration, 0.0), 1.0)
+                if played >= COMPLETE_FRACTION:
+                    played = 1.0
+                meta["completions"] = round(meta.get("completions", 0) + played, 3)
+                meta["skips"] = round(meta.get("skips", 0) + 1.0 - played, 3)
+        else:
+            raise ValueError(f"Unknown journal event: {kind}")
+    if seq is not None:
+        data[song]["seq"] = seq
+    return song
+
+
+class EventJournal:
+    """
+    Append-only log of library changes, one JSON event per line.
+    Events are buffered and written with an fsync in batches of batch_size or
+    whenever flush() is called, so a crash loses at most the last batch. A torn
+    last line is ignored on replay.
+    """
+
+    def __init__(self, path, batch_size=50):
+        self.path = path
+        self.batch_size = batch_size
+        self.buffer = []
+        self.count = 0
+        self.next_seq = 1
+        self.file = open(path, "a", encoding="utf-8")
+
+    def replay(self):
+        """Every event on disk, in order"""
+        events = []
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    events.append(json.loads(line))
+                except json.JSONDecodeError:
+                    print(f"Ignoring damaged journal line in {self.path}")
+        self.count = len(events)
+        if events:
+            self.next_seq = max(self.next_seq, events[-1]["seq"] + 1)
+        return events
+
+    def append(self, event):
+        """Number event and queue it for the next batch; returns the event"""
+        event["seq"] = self.next_seq
+        self.next_seq += 1
+        self.buffer.append(json.dumps(event, ensure_ascii=False))
+        self.count += 1
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+        return event
+
+    def flush(self):
+        if not self.buffer:
+            return
+        self.file.write("\n".join(self.buffer) + "\n")
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.buffer = []
+
+    def truncate(self):
+        """Drop every event, once a snapshot holds them all"""
+        self.buffer = []
+        self.file.truncate(0)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.count = 0
+
+    def close(self):
+        self.flush()
+        self.file.close()
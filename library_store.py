@@ -0,0 +1,198 @@
+import os
+import json
+import sqlite3
+from abc import ABC, abstractmethod
+
+# Columns stored directly in the songs table; anything else a song entry
+# carries is kept in the JSON "extra" column.
+SONG_COLUMNS = ("path", "last_played", "vote_weight")
+
+
+class LibraryStore(ABC):
+    """
+    Base class for song library persistence.
+    A library is a dict of song key -> metadata dict, as used by MusicPlayer.
+    """
+
+    @abstractmethod
+    def load(self):
+        """The stored library, as a dict"""
+
+    @abstractmethod
+    def save_all(self, data):
+        """Replace the whole stored library with data"""
+
+    @abstractmethod
+    def update_song(self, key, meta):
+        """Insert or update a single song entry"""
+
+    def update_songs(self, items):
+        for key, meta in items:
+            self.update_song(key, meta)
+
+    @abstractmethod
+    def delete_songs(self, keys):
+        """Remove the entries of keys"""
+
+    def flush(self):
+        """Make any pending changes durable"""
+        pass
+
+    def close(self):
+        self.flush()
+
+
+class JsonLibraryStore(LibraryStore):
+    """Whole-file JSON storage. Changes are buffered and written out on flush."""
+
+    def __init__(self, path):
+        self.path = path
+        self.data = {}
+        self.dirty = False
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return {}
+        if os.path.getsize(self.path) == 0:
+            return {}
+        try:
+            with open(self.path, "r", encoding='utf-8') as f:
+                self.data = json.load(f)
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            self.data = {}
+        return dict(self.data)
+
+    def save_all(self, data):
+        self.data = {key: dict(meta) for key, meta in data.items()}
+        self.dirty = True
+        self.flush()
+
+    def update_song(self, key, meta):
+        self.data[key] = dict(meta)
+        self.dirty = True
+
+    def delete_songs(self, keys):
+        for key in keys:
+            self.data.pop(key, None)
+        self.dirty = True
+
+    def flush(self):
+        if not self.dirty:
+            return
+        # Write to a temp file first so a crash mid-write can't truncate the library
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding='utf-8') as f:
+            json.dump(self.data, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+        self.dirty = False
+
+
+class SqliteLibraryStore(LibraryStore):
+    """
+    Embedded SQLite storage in WAL mode.
+    Songs are updated row by row and committed in batches of batch_size
+    changes, or whenever flush() is called.
+    """
+
+    def __init__(self, path, batch_size=50):
+        self.path = path
+        self.batch_size = batch_size
+        self.pending = 0
+        # The player opens the store on a loader thread and then hands it over
+        # to the Tk thread, so it is never used from two threads at once
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS songs ("
+            "key TEXT PRIMARY KEY, "
+            "path TEXT NOT NULL, "
+            "last_played TEXT NOT NULL, "
+            "vote_weight REAL NOT NULL, "
+            "extra TEXT)"
+        )
+        self.conn.commit()
+
+    def _to_row(self, key, meta):
+        extra = {k: v for k, v in meta.items() if k not in SONG_COLUMNS}
+        return (key, meta["path"], meta["last_played"], meta["vote_weight"],
+                json.dumps(extra, ensure_ascii=False) if extra else None)
+
+    def load(self):
+        data = {}
+        rows = self.conn.execute(
+            "SELECT key, path, last_played, vote_weight, extra FROM songs"
+        )
+        for key, path, last_played, vote_weight, extra in rows:
+            meta = {
+                "last_played": last_played,
+                "vote_weight": vote_weight,
+                "path": path
+            }
+            if extra:
+                meta.update(json.loads(extra))
+            data[key] = meta
+        return data
+
+    def save_all(self, data):
+        self.conn.execute("DELETE FROM songs")
+        self.conn.executemany(
+            "INSERT INTO songs VALUES (?, ?, ?, ?, ?)",
+            [self._to_row(key, meta) for key, meta in data.items()]
+        )
+        self.conn.commit()
+        self.pending = 0
+
+    def update_song(self, key, meta):
+        self.update_songs([(key, meta)])
+
+    def update_songs(self, items):
+        rows = [self._to_row(key, meta) for key, meta in items]
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO songs VALUES (?, ?, ?, ?, ?)", rows
+        )
+        self._mark_pending(len(rows))
+
+    def delete_songs(self, keys):
+        keys = list(keys)
+        self.conn.executemany("DELETE FROM songs WHERE key = ?",
+                              [(key,) for key in keys])
+        self._mark_pending(len(keys))
+
+    def _mark_pending(self, count):
+        self.pending += count
+        if self.pending >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.conn.commit()
+            self.pending = 0
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+
+def import_json_library(json_path, store):
+    """One-shot import of an existing song_data.json into store. Returns the song count."""
+    data = JsonLibraryStore(json_path).load()
+    if data:
+        store.save_all(data)
+    return len(data)
+
+
+def open_library_store(backend, db_path, json_path):
+    """
+    Open the configured storage backend.
+    The SQLite backend imports json_path the first time its database is created.
+    """
+    if backend == "json":
+        return JsonLibraryStore(json_path)
+    if backend == "sqlite":
+        is_new = not os.path.exists(db_path)
+        store = SqliteLibraryStore(db_path)
+        if is_new and os.path.exists(json_path):
+            import_json_library(json_path, store)
+        return store
+    raise ValueError(f"Unknown library store backend: {backend}")
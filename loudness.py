@@ -0,0 +1,283 @@
+import os
+import sys
+import time
+import wave
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+
+SAMPLE_RATE = 48000
+SUBBLOCK = SAMPLE_RATE // 10        # 100 ms; gating blocks are 4 of these (400 ms, 75% overlap)
+TARGET_LOUDNESS = -18.0             # LUFS, the ReplayGain 2 reference level
+ABSOLUTE_GATE = -70.0
+RELATIVE_GATE = -10.0
+# Bumped when analyze_file starts producing new fields, so every track gets analyzed again
+ANALYSIS_VERSION = 2
+# Longest a decode may take: this much, plus the track's own length once VLC knows
+# it, since transcoding runs at least as fast as playback. Past it the file is given up on.
+DECODE_ALLOWANCE = 60.0
+
+
+class DecodeError(Exception):
+    """A file that couldn't be decoded or measured; analyzing it again won't help"""
+
+
+# BS.1770 K-weighting filter (high shelf + high pass) at 48 kHz
+K_SHELF = ([1.53512485958697, -2.69169618940638, 1.19839281085285],
+           [1.0, -1.69065929318241, 0.73248077421585])
+K_HIGHPASS = ([1.0, -2.0, 1.0],
+              [1.0, -1.99004745483398, 0.99007225036621])
+
+
+def _biquad_power(coeffs, z):
+    b, a = coeffs
+    num = b[0] + b[1] / z + b[2] / z ** 2
+    den = a[0] + a[1] / z + a[2] / z ** 2
+    return np.abs(num / den) ** 2
+
+
+def subblock_weights(n=SUBBLOCK):
+    """
+    Per-bin weights turning an rfft of an n-sample frame into the mean square of
+    the K-weighted frame. Filtering in the frequency domain per frame ignores
+    filter state across frames, which is well below a tenth of a LU on music.
+    """
+    z = np.exp(2j * np.pi * np.arange(n // 2 + 1) / n)
+    weights = _biquad_power(K_SHELF, z) * _biquad_power(K_HIGHPASS, z)
+    weights[1:(n + 1) // 2] *= 2     # bins mirrored in the negative half
+    return weights / n ** 2
+
+
+def frame_power(samples):
+    """Power spectrum of each full 100 ms frame, summed over channels"""
+    frames = len(samples) // SUBBLOCK
+    framed = samples[:frames * SUBBLOCK].reshape(frames, SUBBLOCK, -1)
+    return (np.abs(np.fft.rfft(framed, axis=1)) ** 2).sum(axis=2)
+
+
+def integrated_loudness(energies):
+    """Gated integrated loudness (LUFS) from 100 ms sub-block energies"""
+    if len(energies) >= 4:
+        cumulative = np.concatenate(([0.0], np.cumsum(energies)))
+        blocks = (cumulative[4:] - cumulative[:-4]) / 4
+    else:
+        blocks = np.asarray(energies)
+    if not len(blocks):
+        return None
+
+    with np.errstate(divide="ignore"):
+        block_loudness = -0.691 + 10 * np.log10(blocks)
+    gated = blocks[block_loudness > ABSOLUTE_GATE]
+    if not len(gated):
+        return None
+    relative_gate = -0.691 + 10 * np.log10(gated.mean()) + RELATIVE_GATE
+    gated = blocks[(block_loudness > ABSOLUTE_GATE) & (block_loudness > relative_gate)]
+    return float(-0.691 + 10 * np.log10(gated.mean()))
+
+
+def track_gain(loudness, peak):
+    """Gain in dB that brings a track to TARGET_LOUDNESS without clipping its peak"""
+    gain = TARGET_LOUDNESS - loudness
+    if peak > 0:
+        gain = min(gain, -20 * np.log10(peak))
+    return float(gain)
+
+
+def measure_wav(wav_path, chunk_frames=600, features=None):
+    """
+    (loudness, peak) of a 16-bit WAV at SAMPLE_RATE, read a minute at a time.
+    features, a FeatureAccumulator, is fed the same chunks and spectra.
+    """
+    weights = subblock_weights()
+    energies, peak = [], 0.0
+    with wave.open(wav_path, "rb") as wav:
+        channels = wav.getnchannels()
+        leftover = np.zeros((0, channels), dtype=np.float32)
+        while True:
+            raw = wav.readframes(chunk_frames * SUBBLOCK)
+            if not raw:
+                break
+            samples = np.frombuffer(raw, dtype="<i2").reshape(-1, channels) / 32768.0
+            peak = max(peak, float(np.abs(samples).max()))
+            samples = np.concatenate((leftover, samples))
+            usable = len(samples) // SUBBLOCK * SUBBLOCK
+            power = frame_power(samples[:usable])
+            energies.append(power @ weights)
+            if features is not None:
+                features.add(samples[:usable], power)
+            leftover = samples[usable:]
+    if not energies:
+        return None, peak
+    return integrated_loudness(np.concatenate(energies)), peak
+
+
+# Worker process side. Each worker keeps its own libvlc instance for decoding.
+_instance = None
+
+
+def _init_worker(vlc_folder):
+    global _instance
+    # Stay out of the way of the player's own audio thread
+    if hasattr(os, "nice"):
+        os.nice(10)
+    elif sys.platform == "win32":
+        import ctypes
+        BELOW_NORMAL_PRIORITY_CLASS = 0x4000
+        kernel32 = ctypes.windll.kernel32
+        kernel32.SetPriorityClass(kernel32.GetCurrentProcess(), BELOW_NORMAL_PRIORITY_CLASS)
+
+    if sys.platform == "win32" and vlc_folder and os.path.exists(vlc_folder):
+        os.add_dll_directory(vlc_folder)
+    import vlc
+    _instance = vlc.Instance(["--quiet", "--no-video"])
+
+
+def decode_to_wav(path, wav_path):
+    """Transcode path to a 16-bit stereo WAV with VLC's stream output"""
+    import vlc
+    media = _instance.media_new(path)
+    media.add_option(
+        f":sout=#transcode{{acodec=s16l,channels=2,samplerate={SAMPLE_RATE}}}"
+        f":std{{access=file,mux=wav,dst='{wav_path}'}}"
+    )
+    player = _instance.media_player_new()
+    player.set_media(media)
+    player.play()
+    started = time.monotonic()
+    try:
+        while player.get_state() not in (vlc.State.Ended, vlc.State.Error, vlc.State.Stopped):
+            # VLC can sit in Opening or Buffering for good on a bad file
+            length = max(player.get_length(), 0) / 1000
+            if time.monotonic() - started > DECODE_ALLOWANCE + length:
+                raise DecodeError(f"VLC was still decoding after {time.monotonic() - started:.0f} s")
+            time.sleep(0.05)
+        if player.get_state() == vlc.State.Error:
+            raise DecodeError("VLC could not decode the file")
+    finally:
+        player.stop()
+        player.release()
+        media.release()
+
+
+def analyze_file(path):
+    """
+    Loudness and acoustic feature entry fields for one file, decoded once.
+    The embedding, if any, comes back under "embedding" for the caller to
+    store apart from the entry. Runs in a worker process.
+    """
+    from features import FeatureAccumulator
+    fd, wav_path = tempfile.mkstemp(suffix=".wav")
+    os.close(fd)
+    features = FeatureAccumulator()
+    try:
+        decode_to_wav(path, wav_path)
+        try:
+            loudness, peak = measure_wav(wav_path, features=features)
+        except (wave.Error, EOFError, ValueError) as e:
+            raise DecodeError(f"VLC wrote an unreadable WAV: {e}") from None
+    finally:
+        os.remove(wav_path)
+    feature_fields, embedding = features.result()
+    fields = dict(feature_fields or {})
+    if embedding is not None:
+        fields["embedding"] = embedding.tolist()
+    if loudness is None:
+        fields.update({"loudness": None, "peak": peak, "gain_db": None})
+    else:
+        fields.update({"loudness": loudness, "peak": peak, "gain_db": track_gain(loudness, peak)})
+    return fields
+
+
+def needs_analysis(meta):
+    """True until the file has been analyzed at its current mtime by the current analyzer"""
+    return (meta.get("analyzed_mtime", "never") != meta.get("mtime")
+            or meta.get("analysis_version", 1) != ANALYSIS_VERSION)
+
+
+class LoudnessAnalyzer:
+    """
+    Runs analyze_file over songs in a low-priority process pool.
+    Only a few files are in flight at a time; each result is handed to
+    on_result(song, fields) through post on the Tk thread, where it is saved
+    straight away, so a restart resumes with whatever is still unanalyzed.
+    A file that can't be decoded is saved as analyzed with no loudness; any
+    other failure leaves the song to be analyzed again next time, and one
+    that takes the pool down (say, VLC missing in the workers) stops the run.
+    """
+
+    def __init__(self, post, on_result, vlc_folder, max_workers=None):
+        self.post = post
+        self.on_result = on_result
+        self.vlc_folder = vlc_folder
+        self.max_workers = max_workers or max(1, (os.cpu_count() or 2) // 2)
+        self.pool = None
+        self.lock = threading.Lock()
+        self.queue = []
+        self.queued = set()
+        self.in_flight = 0
+
+    def add(self, jobs):
+        """Queue (song, path) pairs that aren't queued already"""
+        with self.lock:
+            for song, path in jobs:
+                if song not in self.queued:
+                    self.queued.add(song)
+                    self.queue.append((song, path))
+            if self.pool is None and self.queue:
+                self.pool = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    initializer=_init_worker,
+                    initargs=(self.vlc_folder,)
+                )
+        self._feed()
+
+    def _feed(self):
+        with self.lock:
+            while self.pool is not None and self.queue and self.in_flight < self.max_workers * 2:
+                song, path = self.queue.pop()
+                self.in_flight += 1
+                future = self.pool.submit(analyze_file, path)
+                future.add_done_callback(lambda f, song=song, pool=self.pool: self._done(song, f, pool))
+
+    def _done(self, song, future, pool):
+        with self.lock:
+            self.in_flight -= 1
+            self.queued.discard(song)
+        if future.cancelled():
+            return
+        try:
+            fields = future.result()
+        except DecodeError as e:
+            print(f"Loudness analysis failed for {song}: {e}")
+            fields = {"loudness": None, "peak": None, "gain_db": None}
+        except BrokenProcessPool as e:
+            self._broken(pool, e)
+            return
+        except Exception as e:
+            # Not the file's fault; it stays unanalyzed and is queued again next run
+            print(f"Loudness analysis of {song} didn't finish: {e}")
+            self._feed()
+            return
+        self.post(self.on_result, song, fields)
+        self._feed()
+
+    def _broken(self, pool, error):
+        """Drop a pool whose workers died or couldn't start, with the songs waiting on it"""
+        with self.lock:
+            if self.pool is not pool:
+                return
+            self.pool = None
+            dropped = len(self.queue)
+            self.queue = []
+            self.queued.clear()
+        print(f"Loudness analysis stopped, {dropped} songs left for next time: {error}")
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def stop(self):
+        with self.lock:
+            self.queue = []
+            pool, self.pool = self.pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
@@ -1,17 +1,20 @@
+import time
+STARTED = time.perf_counter()
+
 import os
 import json
-import random
 import datetime
-import time
-import math
-import vlc
 import sys
+import queue
+import threading
+import multiprocessing
 import tkinter as tk
 from tkinter import messagebox, filedialog, ttk
-from mutagen.mp3 import MP3
-from mutagen.id3 import ID3
-from PIL import Image, ImageTk, ImageDraw, ImageFilter
-import io
+from library_store import open_library_store
+from scanner import scan_folder, scan_paths
+from content_hash import hash_files, hash_scan_changes, find_duplicates
+from tags import read_scan_tags, read_tags_batches, needs_tags
+from metrics import Metrics
 
 def resource_path(relative_path):
     """ Get absolute path to resource, works for dev and PyInstaller """
@@ -21,36 +24,186 @@ def resource_path(relative_path):
         base_path = os.path.abspath(".")
     return os.path.join(base_path, relative_path)
 
-DATA_FILE = resource_path("song_data.json")
+# Folder for the library, caches and everything else the player writes, in place of
+# the app's own; the startup benchmark points it at a scratch folder
+DATA_DIR = os.environ.get("SMART_PLAYER_DATA_DIR")
+
+def data_path(relative_path):
+    return os.path.join(DATA_DIR, relative_path) if DATA_DIR else resource_path(relative_path)
+
+DATA_FILE = data_path("song_data.json")
+DB_FILE = data_path("song_data.db")
+JOURNAL_FILE = data_path("song_events.log")
+FEATURES_FILE = data_path("song_features.f32")
+WATCH_FILE = data_path("watched_folders.json")
+PLAYLISTS_FILE = data_path("playlists.json")
+ART_CACHE_DIR = data_path("art_cache")
+VLC_FOLDER = resource_path("VLC")
+# "sqlite" or "json"
+STORE_BACKEND = "sqlite"
+# Largest relative error allowed between a song's pick weight and its exact score
+SCORE_STALENESS = 0.01
+# Pick and pre-load the next song while the current one plays
+LOOKAHEAD = True
+# Overlap between tracks when LOOKAHEAD is on, 0 for a straight cut
+CROSSFADE_MS = 0
+# Print how many times per minute the Tk loop was woken up
+REPORT_WAKEUPS = False
+# Print startup timings and quit once the library is loaded (see benchmark.py startup)
+STARTUP_PROBE = os.environ.get("SMART_PLAYER_STARTUP_PROBE") == "1"
+# Slider position until VLC is up
+DEFAULT_VOLUME = 100
+# Analyze each track's loudness in the background and level tracks with a per-track gain
+NORMALIZE_LOUDNESS = True
+# Share of picks drawn from the songs that sound most like the previous one
+# (needs NORMALIZE_LOUDNESS, whose analysis also extracts the acoustic features)
+SIMILARITY_BLEND = 0.5
+# Keep folders added with Add Folder in sync as files in them are added, moved or deleted
+WATCH_FOLDERS = True
+# Local HTTP/WebSocket control API (see control_server.py); no port, no server.
+# Anything beyond localhost should set a token
+CONTROL_PORT = int(os.environ.get("SMART_PLAYER_CONTROL_PORT", 0)) or None
+CONTROL_HOST = os.environ.get("SMART_PLAYER_CONTROL_HOST", "127.0.0.1")
+CONTROL_TOKEN = os.environ.get("SMART_PLAYER_CONTROL_TOKEN")
+# Time the hot paths into histograms (see metrics.py). They are served at the control
+# server's /metrics and /metrics.json and written to METRICS_FILE on exit
+METRICS = os.environ.get("SMART_PLAYER_METRICS") == "1"
+METRICS_FILE = data_path("metrics.json")
+# Sample every thread's stack while running and write them here on exit, as folded
+# stacks for flamegraph.pl or speedscope
+PROFILE_FILE = os.environ.get("SMART_PLAYER_PROFILE")
+# More playback zones hosted beside the main player, as comma-separated "name" or
+# "name=device" entries (device ids as VLC lists them). Each zone keeps its own votes
+# and history under PROFILES_DIR and plays through the shared VLC instance and library,
+# steered through the control server as "<zone>/<command>"
+ZONES = os.environ.get("SMART_PLAYER_ZONES", "")
+PROFILES_DIR = data_path("profiles")
+# Realtime compressor on playback; mostly redundant once loudness is normalized
+USE_COMPRESSOR = False
+COMPRESSOR_ARGS = [
+    "--audio-filter=compressor",
+    "--compressor-attack=20",
+    "--compressor-release=200",
+    "--compressor-threshold=-18",
+    "--compressor-ratio=3.0",
+    "--compressor-knee=6",
+    "--compressor-makeup=8"
+]
 
 # VLC setup
 def init_vlc():
     """
     Initialize VLC instance and media player.
     Works for both normal Python and PyInstaller exe.
+    Runs on a loader thread, so failures are raised for the caller to report.
     """
-    vlc_folder = resource_path("VLC")
-    if os.path.exists(vlc_folder):
-        os.add_dll_directory(vlc_folder)
-
+    # Only Windows looks for libvlc's DLLs by directory; elsewhere it's the system's
+    if sys.platform == "win32" and os.path.exists(VLC_FOLDER):
+        os.add_dll_directory(VLC_FOLDER)
+
+    import vlc
+    instance = vlc.Instance(COMPRESSOR_ARGS if USE_COMPRESSOR else [])
+    player = instance.media_player_new()
+    return instance, player
+
+def load_library(schedule):
+    """Open the store and build the core. Runs on a loader thread; pulls in numpy."""
+    from player_core import PlayerCore
+    from journal import EventJournal
+    from features import FeatureMatrix
+    store = open_library_store(STORE_BACKEND, DB_FILE, DATA_FILE)
+    return PlayerCore(store, schedule, SCORE_STALENESS, journal=EventJournal(JOURNAL_FILE),
+                      features=FeatureMatrix(FEATURES_FILE), similarity_blend=SIMILARITY_BLEND)
+
+def parse_zones(spec):
+    """[(name, device or None)] from a ZONES string"""
+    zones = []
+    for entry in spec.split(","):
+        name, _, device = entry.strip().partition("=")
+        name = name.strip()
+        if not name:
+            continue
+        if not all(c.isalnum() or c in "-_" for c in name):
+            print(f"Ignoring zone {name!r}: names take letters, digits, - and _")
+            continue
+        zones.append((name, device.strip() or None))
+    return zones
+
+def load_profile(host, name, schedule):
+    """Open a zone's own store and journal and build its core on top of host"""
+    from profiles import ProfileCore
+    from journal import EventJournal
+    os.makedirs(PROFILES_DIR, exist_ok=True)
+    base = os.path.join(PROFILES_DIR, name)
+    store = open_library_store(STORE_BACKEND, base + ".db", base + ".json")
+    return ProfileCore(host, store, schedule, SCORE_STALENESS, journal=EventJournal(base + ".log"))
+
+def load_watched_folders():
     try:
-        instance = vlc.Instance([
-            "--audio-filter=compressor",
-            "--compressor-attack=20",
-            "--compressor-release=200",
-            "--compressor-threshold=-18",
-            "--compressor-ratio=3.0",
-            "--compressor-knee=6",
-            "--compressor-makeup=8"
-        ])
-        player = instance.media_player_new()
-        return instance, player
-    except Exception as e:
-        messagebox.showerror("VLC Error", f"Failed to initialize VLC: {e}\n"
-                                          f"Make sure VLC is included and DLLs are accessible.")
-        sys.exit(1)
+        with open(WATCH_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return []
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"Could not read {WATCH_FILE}: {e}")
+        return []
+
+def save_watched_folders(folders):
+    with open(WATCH_FILE, "w", encoding="utf-8") as f:
+        json.dump(folders, f, indent=2)
+
+def load_playlists():
+    """Saved smart playlists, name -> rules (see playlists.py)"""
+    try:
+        with open(PLAYLISTS_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"Could not read {PLAYLISTS_FILE}: {e}")
+        return {}
+
+def save_playlists(playlists):
+    with open(PLAYLISTS_FILE, "w", encoding="utf-8") as f:
+        json.dump(playlists, f, indent=2)
+
+def startup_mark(stage):
+    if STARTUP_PROBE:
+        print(f"startup: {stage} after {(time.perf_counter() - STARTED) * 1000:.0f} ms", flush=True)
+
+class TkDispatcher:
+    """
+    Runs callbacks from other threads (VLC events, worker pools) on the Tk thread.
+    post() never blocks the caller; a helper thread does the hand-off, so a VLC
+    thread can't deadlock against the Tk thread waiting on libvlc.
+    """
+
+    def __init__(self, schedule):
+        self.schedule = schedule
+        self.queue = queue.Queue()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def post(self, func, *args):
+        self.queue.put((func, args))
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            func, args = item
+            self.schedule(0, func, *args)
+
+    def stop(self):
+        self.queue.put(None)
 
 class RoundedButton(tk.Canvas):
+    """
+    Rounded, hover-highlighted button drawn on a canvas. Its shapes and label
+    are created once; hovering and relabelling only reconfigure them, so an
+    interaction allocates no canvas items.
+    """
+
     def __init__(self, parent, text, command, bg, fg, active_bg, width=200, height=40, corner_radius=20):
         super().__init__(parent, width=width, height=height, bg=parent['bg'], highlightthickness=0)
         self.command = command
@@ -59,25 +212,42 @@ class RoundedButton(tk.Canvas):
         self.active_bg = active_bg
         self.corner_radius = corner_radius
         self.text = text
+        self.fill = bg
+        self.text_fill = fg
+        
+        w, h = self.winfo_reqwidth(), self.winfo_reqheight()
+        r = corner_radius
+        self.shapes = (
+            self.create_arc(0, 0, r*2, r*2, start=90, extent=90, fill=bg, outline=""),
+            self.create_arc(w-r*2, 0, w, r*2, start=0, extent=90, fill=bg, outline=""),
+            self.create_arc(0, h-r*2, r*2, h, start=180, extent=90, fill=bg, outline=""),
+            self.create_arc(w-r*2, h-r*2, w, h, start=270, extent=90, fill=bg, outline=""),
+            self.create_rectangle(r, 0, w-r, h, fill=bg, outline=""),
+            self.create_rectangle(0, r, w, h-r, fill=bg, outline=""),
+        )
+        self.label = self.create_text(w//2, h//2, text=text, fill=fg, font=("Segoe UI", 11, "bold"))
+        self.shown_text = text
         
-        self.draw_button(bg, fg)
         self.bind("<Button-1>", self.on_click)
         self.bind("<Enter>", self.on_enter)
         self.bind("<Leave>", self.on_leave)
     
     def draw_button(self, bg_color, fg_color):
-        self.delete("all")
-        w, h = self.winfo_reqwidth(), self.winfo_reqheight()
-        r = self.corner_radius
-        
-        self.create_arc(0, 0, r*2, r*2, start=90, extent=90, fill=bg_color, outline="")
-        self.create_arc(w-r*2, 0, w, r*2, start=0, extent=90, fill=bg_color, outline="")
-        self.create_arc(0, h-r*2, r*2, h, start=180, extent=90, fill=bg_color, outline="")
-        self.create_arc(w-r*2, h-r*2, w, h, start=270, extent=90, fill=bg_color, outline="")
-        self.create_rectangle(r, 0, w-r, h, fill=bg_color, outline="")
-        self.create_rectangle(0, r, w, h-r, fill=bg_color, outline="")
-        
-        self.create_text(w//2, h//2, text=self.text, fill=fg_color, font=("Segoe UI", 11, "bold"))
+        """Bring the canvas up to date with the colours given and self.text"""
+        if bg_color != self.fill:
+            for item in self.shapes:
+                self.itemconfigure(item, fill=bg_color)
+            self.fill = bg_color
+        if fg_color != self.text_fill:
+            self.itemconfigure(self.label, fill=fg_color)
+            self.text_fill = fg_color
+        if self.text != self.shown_text:
+            self.itemconfigure(self.label, text=self.text)
+            self.shown_text = self.text
+
+    def set_text(self, text):
+        self.text = text
+        self.draw_button(self.fill, self.text_fill)
     
     def on_click(self, event):
         self.command()
@@ -88,29 +258,163 @@ class RoundedButton(tk.Canvas):
     def on_leave(self, event):
         self.draw_button(self.bg, self.fg)
 
+class VirtualList(tk.Frame):
+    """
+    Multi-select list that only draws the rows in view, so it opens instantly
+    however many items it holds. Row items are created once and relabelled
+    as the list scrolls.
+    """
+
+    def __init__(self, parent, bg, fg, select_bg, select_fg, font=("Segoe UI", 9), row_height=20):
+        super().__init__(parent, bg=bg)
+        self.bg = bg
+        self.fg = fg
+        self.select_bg = select_bg
+        self.select_fg = select_fg
+        self.font = font
+        self.row_height = row_height
+        self.items = []
+        self.selected = set()
+        self.top = 0
+        self.rows = []
+
+        self.scrollbar = tk.Scrollbar(self, command=self.yview)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.canvas = tk.Canvas(self, bg=bg, highlightthickness=0)
+        self.canvas.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+
+        self.canvas.bind("<Configure>", self.on_resize)
+        self.canvas.bind("<Button-1>", self.on_click)
+        self.canvas.bind("<MouseWheel>", lambda e: self.scroll(-e.delta // 120))
+        self.canvas.bind("<Button-4>", lambda e: self.scroll(-3))
+        self.canvas.bind("<Button-5>", lambda e: self.scroll(3))
+
+    def set_items(self, items):
+        """items is a list of (key, label); selected keys that are no longer listed are dropped"""
+        self.items = items
+        self.selected &= {key for key, _ in items}
+        self.top = max(0, min(self.top, len(items) - self.visible_rows()))
+        self.redraw()
+
+    def selection(self):
+        return [key for key, _ in self.items if key in self.selected]
+
+    def visible_rows(self):
+        return max(1, self.canvas.winfo_height() // self.row_height)
+
+    def on_resize(self, event):
+        width = event.width
+        while len(self.rows) < self.visible_rows() + 1:
+            y = len(self.rows) * self.row_height
+            rect = self.canvas.create_rectangle(0, y, width, y + self.row_height,
+                                                fill=self.bg, outline="")
+            text = self.canvas.create_text(6, y + self.row_height // 2, anchor="w",
+                                           font=self.font, fill=self.fg)
+            self.rows.append((rect, text))
+        for rect, _ in self.rows:
+            x0, y0, _, y1 = self.canvas.coords(rect)
+            self.canvas.coords(rect, x0, y0, width, y1)
+        self.redraw()
+
+    def redraw(self):
+        for i, (rect, text) in enumerate(self.rows):
+            index = self.top + i
+            if index < len(self.items):
+                key, label = self.items[index]
+                selected = key in self.selected
+                self.canvas.itemconfigure(rect, state="normal",
+                                          fill=self.select_bg if selected else self.bg)
+                self.canvas.itemconfigure(text, state="normal", text=label,
+                                          fill=self.select_fg if selected else self.fg)
+            else:
+                self.canvas.itemconfigure(rect, state="hidden")
+                self.canvas.itemconfigure(text, state="hidden")
+        if self.items:
+            first = self.top / len(self.items)
+            last = min(1.0, (self.top + self.visible_rows()) / len(self.items))
+            self.scrollbar.set(first, last)
+        else:
+            self.scrollbar.set(0, 1)
+
+    def scroll(self, rows):
+        self.top = max(0, min(self.top + rows, len(self.items) - self.visible_rows()))
+        self.redraw()
+
+    def yview(self, action, amount, unit=None):
+        if action == "moveto":
+            self.top = 0
+            self.scroll(int(float(amount) * len(self.items)))
+        elif unit == "pages":
+            self.scroll(int(amount) * self.visible_rows())
+        else:
+            self.scroll(int(amount))
+
+    def on_click(self, event):
+        index = self.top + event.y // self.row_height
+        if index < len(self.items):
+            key = self.items[index][0]
+            self.selected ^= {key}
+            self.redraw()
+
 class MusicPlayer:
     def __init__(self, root):
         self.root = root
         self.root.title("♪ Smart MP3 Player")
-        self.root.geometry("480x720")
+        self.root.geometry("480x770")
         self.root.resizable(False, False)
         
-        self.vlc_instance, self.media_player = init_vlc()
-
-        self.data = self.load_data()
-        if self.data:
-            self.files = list(self.data.keys())
-        else:
-            self.files = []
+        self.metrics = Metrics(METRICS)
+        self.tk_wakeups = self.metrics.counter("tk_wakeups_total", "Callbacks the Tk loop was woken up for")
+        self.missing_files = self.metrics.counter("missing_files_total",
+                                                  "Picked songs whose file had gone missing")
+        self.load_time = self.metrics.histogram("load_library_seconds",
+                                                "Opening the store and building the core")
+        self.first_audio_time = self.metrics.histogram("first_audio_seconds",
+                                                       "From starting a track to VLC playing it")
+        self.song_info_time = self.metrics.histogram("show_song_info_seconds",
+                                                     "From starting a track to its artist and art showing")
+        self.reported_wakeups = 0
+        self.audio_requested = None
+        self.info_requested = None
+        self.default_photo = None
+        self.profiler = None
+        if PROFILE_FILE:
+            from profiler import SamplingProfiler
+            self.profiler = SamplingProfiler().start()
+        self.dispatcher = TkDispatcher(self.after)
+
+        # Filled in by the loader threads once the window is up
+        self.vlc_instance = None
+        self.media_player = None
+        self.standby_player = None
+        self.core = None
+        self.art_loader = None
+        self.loudness = None
+        self.ready = False
+        self.scanning = False
+        self.watcher = None
+        self.control = None
+        self.zones = {}
+        self.zone_states = {}
+        self.playlists = {}
+        self.watched_folders = []
+        self.pending_changes = set()
 
         self.current_song = None
-        self.repeat_limit = 150
-        self.recent_songs = []
         self.transition_scheduled = False
+        self.next_song = None
+        self.next_media = None
+        self.next_from_queue = False
+        self.next_marked = False
+        self.transition_started = None
+        self.transition_gaps = []
+        self.prepare_job = None
+        self.fade_job = None
+        self.volume = DEFAULT_VOLUME
+        self.track_volume = self.volume
 
         self.song_duration = 0
-        self.progress_update_interval = 1000
-        self.root.after(self.progress_update_interval, self.update_progress)
+        self.last_time_second = None
 
         # Enhanced Miku color palette
         self.bg_gradient_top = "#0a0e27"
@@ -123,7 +427,148 @@ class MusicPlayer:
         self.glow_color = "#00ffff"
 
         self.setup_ui()
-        self.root.after(1000, self.check_song_end)
+        self.label.config(text="Loading library...")
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.root.bind("<Expose>", self.on_first_paint)
+        self.after_idle(self.start_loading)
+        if REPORT_WAKEUPS:
+            self.after(60000, self.report_wakeups)
+
+    def on_first_paint(self, event):
+        self.root.unbind("<Expose>")
+        self.after_idle(startup_mark, "first paint")
+
+    def start_loading(self):
+        """
+        Load VLC and the library on two threads while the window paints.
+        Nothing that needs them works until both are in; the buttons that do
+        are ignored until then.
+        """
+        def load_playback():
+            try:
+                instance, player = init_vlc()
+            except Exception as e:
+                self.dispatcher.post(self.on_vlc_failed, e)
+                return
+            self.dispatcher.post(self.on_vlc_loaded, instance, player)
+
+        def load_core():
+            try:
+                started = time.perf_counter()
+                core = load_library(self.after)
+                self.load_time.observe(time.perf_counter() - started)
+                from art_loader import ArtLoader
+                art_loader = ArtLoader(self.dispatcher.post, ART_CACHE_DIR)
+            except Exception as e:
+                self.dispatcher.post(self.on_library_failed, e)
+                return
+            self.dispatcher.post(self.on_library_loaded, core, art_loader)
+
+        threading.Thread(target=load_playback, daemon=True).start()
+        threading.Thread(target=load_core, daemon=True).start()
+
+    def on_vlc_failed(self, error):
+        if STARTUP_PROBE:
+            print(f"startup: VLC failed to load: {error}", flush=True)
+            self.on_close()
+            return
+        messagebox.showerror("VLC Error", f"Failed to initialize VLC: {error}\n"
+                                          f"Make sure VLC is included and DLLs are accessible.")
+        self.on_close()
+        sys.exit(1)
+
+    def on_library_failed(self, error):
+        if STARTUP_PROBE:
+            print(f"startup: library failed to load: {error}", flush=True)
+            self.on_close()
+            return
+        messagebox.showerror("Library Error", f"Failed to load the song library: {error}")
+        self.on_close()
+        sys.exit(1)
+
+    def on_vlc_loaded(self, instance, player):
+        startup_mark("VLC ready")
+        self.vlc_instance, self.media_player = instance, player
+        self.standby_player = instance.media_player_new()
+        for player in (self.media_player, self.standby_player):
+            self.attach_player_events(player)
+        self.finish_loading()
+
+    def on_library_loaded(self, core, art_loader):
+        startup_mark(f"library ready ({len(core.data)} songs)")
+        self.core = core
+        self.art_loader = art_loader
+        self.metrics.instrument(core, "pick_song", "save_songs", "flush_data", "save_data", "compact")
+        # Picks only rescore what the scheduler finds due; get_scores isn't on that path
+        self.metrics.instrument(core.scheduler, "refresh", "rebuild")
+        if NORMALIZE_LOUDNESS:
+            from loudness import LoudnessAnalyzer
+            self.loudness = LoudnessAnalyzer(self.dispatcher.post, core.apply_analysis, VLC_FOLDER)
+        self.finish_loading()
+
+    def finish_loading(self):
+        if self.core is None or self.media_player is None:
+            return
+        self.ready = True
+        self.set_volume(self.volume)
+        self.label.config(text="Ready to play")
+        startup_mark("ready")
+        if STARTUP_PROBE:
+            self.after(0, self.on_close)
+            return
+        self.playlists = load_playlists()
+        if self.loudness:
+            # Give the UI and first track a head start before the analysis workers spin up
+            self.after(5000, self.queue_loudness_analysis)
+        self.after(5000, self.read_missing_tags)
+        if WATCH_FOLDERS:
+            self.start_watching()
+        if ZONES:
+            self.start_zones()
+        if CONTROL_PORT:
+            self.start_control_server()
+
+    def after(self, ms, func, *args):
+        """root.after that counts how often the Tk loop is woken up"""
+        def wakeup():
+            self.tk_wakeups.inc()
+            func(*args)
+        return self.root.after(ms, wakeup)
+
+    def after_idle(self, func, *args):
+        """root.after_idle, counted like after"""
+        def wakeup():
+            self.tk_wakeups.inc()
+            func(*args)
+        return self.root.after_idle(wakeup)
+
+    def report_wakeups(self):
+        print(f"Tk wakeups in the last minute: {self.tk_wakeups.value - self.reported_wakeups}")
+        self.reported_wakeups = self.tk_wakeups.value
+        self.after(60000, self.report_wakeups)
+
+    def on_close(self):
+        if self.control:
+            self.control.stop()
+        if METRICS:
+            self.metrics.dump(METRICS_FILE)
+        if self.profiler:
+            self.profiler.stop()
+            self.profiler.save(PROFILE_FILE)
+            print(f"Wrote {self.profiler.samples} profile samples to {PROFILE_FILE}")
+        if self.watcher:
+            self.watcher.stop()
+        if self.loudness:
+            self.loudness.stop()
+        self.dispatcher.stop()
+        if self.art_loader:
+            self.art_loader.shutdown()
+        for zone in self.zones.values():
+            zone.backend.release()
+            zone.core.close()
+        if self.core:
+            self.core.close()
+        self.root.destroy()
 
     def setup_ui(self):
         # Main container with gradient effect
@@ -245,7 +690,7 @@ class MusicPlayer:
                                       command=self.set_volume,
                                       length=250,
                                       style="Miku.Horizontal.TScale")
-        self.volume_slider.set(self.media_player.audio_get_volume())
+        self.volume_slider.set(self.volume)
         self.volume_slider.pack(side=tk.LEFT)
 
         # Management buttons
@@ -276,119 +721,406 @@ class MusicPlayer:
                                  width=140, height=35)
         reset_btn.grid(row=1, column=1, padx=5, pady=5)
 
-    def show_song_info(self, filepath):
-        try:
-            audio = MP3(filepath, ID3=ID3)
-            tags = audio.tags
-
-            artist_tag = tags.get("TPE1")
-            artist_name = artist_tag.text[0] if artist_tag else "Unknown Artist"
-            self.artist_label.config(text=artist_name)
-
-            apic_key = next((k for k in tags.keys() if k.startswith("APIC")), None)
-            if apic_key:
-                img_data = tags[apic_key].data
-                image = Image.open(io.BytesIO(img_data))
-            else:
-                image = self.create_default_art()
-
-            # Round corners and add shadow effect
-            image = image.resize((180, 180))
-            image = self.add_rounded_corners(image, 20)
-            
-            self.album_art = ImageTk.PhotoImage(image)
-            self.album_art_label.config(image=self.album_art)
+        dupes_btn = RoundedButton(mgmt_frame, "⧉ Duplicates", 
+                                  self.show_duplicates,
+                                  self.card_bg, self.text_primary, self.accent_cyan,
+                                  width=140, height=35)
+        dupes_btn.grid(row=2, column=0, columnspan=2, pady=5)
+
+    def catalogued_info(self, song):
+        """(artist, art_hash) from the tag catalogue, or None until the song's tags have been read"""
+        meta = self.core.data[song]
+        return None if needs_tags(meta) else (meta.get("artist"), meta.get("art_hash"))
+
+    def show_song_info(self, filepath, info=None):
+        self.info_requested = time.perf_counter()
+        self.artist_label.config(text=(info[0] or "Unknown Artist") if info is not None else "")
+        self.art_loader.request(
+            filepath, lambda artist, image: self._show_loaded_info(filepath, artist, image), info
+        )
 
-        except Exception as e:
-            print(f"Failed to load song info: {e}")
-            self.artist_label.config(text="Unknown Artist")
-            image = self.create_default_art()
-            image = self.add_rounded_corners(image, 20)
+    def _show_loaded_info(self, filepath, artist_name, image):
+        # Ignore results that arrive after the song already changed again
+        if not self.current_song or self.core.data.get(self.current_song, {}).get("path") != filepath:
+            return
+        from PIL import ImageTk
+        self.artist_label.config(text=artist_name)
+        if image is self.art_loader.default_art:
+            # Songs without art share one image, so they share one PhotoImage too
+            if self.default_photo is None:
+                self.default_photo = ImageTk.PhotoImage(image)
+            self.album_art = self.default_photo
+        else:
             self.album_art = ImageTk.PhotoImage(image)
-            self.album_art_label.config(image=self.album_art)
+        self.album_art_label.config(image=self.album_art)
+        if self.info_requested is not None:
+            self.song_info_time.observe(time.perf_counter() - self.info_requested)
+            self.info_requested = None
 
-    def create_default_art(self):
-        """Create a gradient default album art"""
-        img = Image.new("RGB", (180, 180), color="#16213e")
-        draw = ImageDraw.Draw(img)
-        
-        # Draw gradient circles
-        for i in range(0, 180, 20):
-            alpha = int(255 * (1 - i/180))
-            color = f"#{57:02x}{197:02x}{187:02x}"  # Cyan
-            draw.ellipse([90-i, 90-i, 90+i, 90+i], outline=color, width=2)
-        
-        return img
-
-    def add_rounded_corners(self, image, radius):
-        """Add rounded corners to image"""
-        mask = Image.new('L', image.size, 0)
-        draw = ImageDraw.Draw(mask)
-        draw.rounded_rectangle([(0, 0), image.size], radius, fill=255)
-        
-        result = Image.new('RGBA', image.size)
-        result.paste(image, (0, 0))
-        result.putalpha(mask)
-        
-        return result
-    
     def set_volume(self, val):
-        volume = int(float(val))
-        if self.media_player is not None:
-            self.media_player.audio_set_volume(volume)
-
-    def load_data(self):
-        if not os.path.exists(DATA_FILE):
-            return {}
-        if os.path.getsize(DATA_FILE) == 0:
-            return {}
-        try:
-            with open(DATA_FILE, "r", encoding='utf-8') as f:
-                return json.load(f)
-        except (json.JSONDecodeError, UnicodeDecodeError):
-            return {}
+        self.volume = int(float(val))
+        if self.ready:
+            gain_db = self.core.data.get(self.current_song, {}).get("gain_db") if self.current_song else None
+            self.track_volume = self.scaled_volume(gain_db)
+            self.media_player.audio_set_volume(self.track_volume)
+            self.publish("volume", volume=self.volume)
+
+    def scaled_volume(self, gain_db):
+        """Player volume for a track with the given loudness gain (libvlc volume is linear)"""
+        if not NORMALIZE_LOUDNESS or gain_db is None:
+            return self.volume
+        return int(min(max(self.volume * 10 ** (gain_db / 20), 0), 200))
+
+    def queue_loudness_analysis(self):
+        if self.loudness:
+            self.loudness.add(self.core.songs_needing_analysis())
+
+    def read_missing_tags(self):
+        """
+        Bring the tag catalogue up to date for songs scanned before it was
+        kept, or by an older read_tags: a process pool reads them and each
+        batch is stored as it comes in, so a restart resumes where this left off
+        """
+        pending = self.core.songs_needing_tags()
+        if not pending:
+            return
+        songs = {path: song for song, path in pending}
+
+        def run():
+            started = time.perf_counter()
+            for tags in read_tags_batches(list(songs)):
+                self.dispatcher.post(self.core.apply_tags, [(songs[path], fields)
+                                                            for path, fields in tags.items()])
+            print(f"Read tags of {len(songs)} files in {time.perf_counter() - started:.1f} s")
 
-    def save_data(self, data):
-        with open(DATA_FILE, "w", encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False)
+        threading.Thread(target=run, daemon=True).start()
 
     def add_songs(self):
+        if not self.ready:
+            return
         files = filedialog.askopenfilenames(
             title="Select MP3 files",
             filetypes=[("MP3 Files", "*.mp3")]
         )
-        if files:
-            for f in files:
-                filename = os.path.basename(f)
-                if filename not in self.data:
-                    self.data[filename] = {
-                        "last_played": "2000-01-01",
-                        "vote_weight": 1.0,
-                        "path": f
-                    }
-            self.files = [f for f in self.data]
-            self.save_data(self.data)
-            messagebox.showinfo("✓ Added", f"{len(files)} song(s) added.")
+        if not files:
+            return
+        new_files = self.core.new_files(files)
+        self.label.config(text="Adding songs...")
+
+        def run():
+            from player_core import read_files
+            try:
+                found = read_files(new_files)
+            except Exception as e:
+                print(f"Adding songs failed: {e}")
+                found = None
+            self.dispatcher.post(self.finish_add_songs, new_files, found, len(files))
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def finish_add_songs(self, new_files, found, chosen):
+        """Add the songs add_songs read on its thread"""
+        self.label.config(text="Ready to play" if not self.current_song
+                          else f"♪ {self.core.display_name(self.current_song)}")
+        if found is None:
+            messagebox.showerror("Add Failed", "Could not read the selected files.")
+            return
+        self.core.add_files(new_files, found)
+        self.publish("library", songs=len(self.core.data))
+        self.queue_loudness_analysis()
+        messagebox.showinfo("✓ Added", f"{chosen} song(s) added.")
 
     def add_folder(self):
+        """Scan a folder and its subfolders; scanning it again picks up only what changed"""
+        if not self.ready:
+            return
+        if self.scanning:
+            messagebox.showinfo("Scanning", "A folder is already being scanned.")
+            return
         folder = filedialog.askdirectory(title="Select Music Folder")
         if folder:
-            new_files = [f for f in os.listdir(folder) if f.endswith(".mp3")]
-            for f in new_files:
-                filename = os.path.basename(f)
-                full_path = os.path.join(folder, f)
-                if filename not in self.data:
-                    self.data[filename] = {
-                        "last_played": "2000-01-01",
-                        "vote_weight": 1.0,
-                        "path": full_path
-                    }
-            self.files = [f for f in self.data]
-            self.save_data(self.data)
-            messagebox.showinfo("✓ Added", f"{len(new_files)} song(s) added from folder.")
-    
+            self.start_folder_scan(folder)
+
+    def start_folder_scan(self, folder):
+        known, unhashed = self.core.folder_snapshot(folder)
+        self.scanning = True
+        self.label.config(text="Scanning folder...")
+
+        def progress(count):
+            self.dispatcher.post(self.label.config, {"text": f"Scanning folder... {count} files"})
+
+        def run():
+            try:
+                result = scan_folder(folder, known, progress)
+                self.dispatcher.post(self.label.config, {"text": "Hashing new files..."})
+                hashes = hash_scan_changes(result, unhashed)
+                tags = read_scan_tags(result)
+            except Exception as e:
+                print(f"Folder scan failed: {e}")
+                result, hashes, tags = None, {}, {}
+            self.dispatcher.post(self.apply_folder_scan, folder, result, hashes, tags)
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def apply_folder_scan(self, folder, result, hashes, tags):
+        """Apply a finished scan to the library as one batch"""
+        self.scanning = False
+        self.label.config(text="Ready to play" if not self.current_song
+                          else f"♪ {self.core.display_name(self.current_song)}")
+        if result is None:
+            messagebox.showerror("Scan Failed", f"Could not scan {folder}.")
+            self.sync_changes()
+            return
+        added, moved, changed, removed = self.core.apply_folder_scan(result, hashes, tags)
+        self.drop_removed(removed)
+        self.publish("library", songs=len(self.core.data))
+        self.queue_loudness_analysis()
+        if WATCH_FOLDERS:
+            self.watch_folder(folder)
+        self.sync_changes()
+        messagebox.showinfo("✓ Scanned", f"{added} song(s) added, {moved} moved, "
+                                         f"{changed} updated, {len(removed)} removed from folder.")
+
+    def drop_removed(self, removed):
+        """Stop and forget the current or prepared song if a sync took it out of the library"""
+        if self.current_song in removed:
+            self.media_player.stop()
+            self.current_song = None
+            self.publish("stop", song=None, title=None, playing=False, position=0)
+        if self.next_song in removed:
+            self.next_song = None
+            self.next_media = None
+
+    def start_watching(self):
+        """Watch the folders added so far, catching up on what changed while the player was closed"""
+        from watcher import LibraryWatcher
+        self.watcher = LibraryWatcher(lambda paths: self.dispatcher.post(self.on_folder_changes, paths))
+        self.watched_folders = load_watched_folders()
+        for folder in self.watched_folders:
+            self.watcher.add_root(folder)
+
+    def watch_folder(self, folder):
+        """Watch a folder that was just scanned"""
+        folder = os.path.abspath(folder)
+        if folder in self.watched_folders or self.watcher is None:
+            return
+        self.watched_folders.append(folder)
+        save_watched_folders(self.watched_folders)
+        self.watcher.add_root(folder, sync=False)
+
+    def on_folder_changes(self, paths):
+        self.pending_changes.update(paths)
+        self.sync_changes()
+
+    def sync_changes(self):
+        """
+        Bring the library up to date with the files and folders the watcher
+        reported, as one batch. Changes that come in while a scan or sync is
+        running wait for the next one.
+        """
+        if self.scanning or not self.pending_changes or self.core is None:
+            return
+        paths = sorted(self.pending_changes)
+        self.pending_changes.clear()
+        known, unhashed = self.core.paths_snapshot(paths)
+        self.scanning = True
+
+        def run():
+            try:
+                result = scan_paths(paths, known)
+                hashes = hash_scan_changes(result, unhashed)
+                tags = read_scan_tags(result)
+            except Exception as e:
+                print(f"Folder sync failed: {e}")
+                result, hashes, tags = None, {}, {}
+            self.dispatcher.post(self.apply_changes, result, hashes, tags)
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def apply_changes(self, result, hashes, tags):
+        self.scanning = False
+        if result is not None:
+            added, moved, changed, removed = self.core.apply_folder_scan(result, hashes, tags)
+            self.drop_removed(removed)
+            self.publish("library", songs=len(self.core.data))
+            if added or changed or moved:
+                self.queue_loudness_analysis()
+            if added or moved or changed or removed:
+                print(f"Library sync: {added} added, {moved} moved, {changed} updated, "
+                      f"{len(removed)} removed")
+        self.sync_changes()
+
+    def start_zones(self):
+        """Start the ZONES: a profile, a media player and a headless player each, all on this thread"""
+        from playback import HeadlessPlayer, VlcPlayback
+        for name, device in parse_zones(ZONES):
+            core = load_profile(self.core, name, self.after)
+            backend = VlcPlayback(self.vlc_instance, device)
+            zone = HeadlessPlayer(core, backend,
+                                  lambda event, name=name, **fields: self.publish_zone(name, event, fields),
+                                  self.playlists)
+            backend.on_end = lambda zone=zone: self.dispatcher.post(zone.play_next)
+            self.zones[name] = zone
+            self.zone_states[name] = {"song": None, "title": None, "playing": False}
+            print(f"Zone {name} ready ({len(core.data.own)} songs with history of its own)")
+
+    def publish_zone(self, name, event, fields):
+        self.zone_states[name].update(fields)
+        # A copy, since the control server encodes it on its own thread
+        self.publish(f"{name}/{event}", zones={zone: dict(state) for zone, state in self.zone_states.items()})
+
+    def start_control_server(self):
+        from control_server import ControlServer, call_via
+        self.control = ControlServer(self.control_commands(), call_via(self.dispatcher.post),
+                                     CONTROL_HOST, CONTROL_PORT, CONTROL_TOKEN,
+                                     state={"song": None, "title": None, "playing": False,
+                                            "position": 0, "duration": 0, "volume": self.volume,
+                                            "songs": len(self.core.data), "queue": 0,
+                                            "playlist": None,
+                                            "zones": {zone: dict(state) for zone, state
+                                                      in self.zone_states.items()}},
+                                     metrics=self.metrics if METRICS else None)
+        try:
+            self.control.start()
+        except OSError as e:
+            print(f"Control server failed to start on {CONTROL_HOST}:{CONTROL_PORT}: {e}")
+            self.control = None
+            return
+        print(f"Control server listening on {CONTROL_HOST}:{self.control.port}")
+
+    def publish(self, event, **fields):
+        """Push a state change to control clients"""
+        if self.control is not None:
+            self.control.publish(event, **fields)
+
+    def control_commands(self):
+        """What the control server can ask for; these run on the Tk thread"""
+        from control_server import number_param
+        from playlists import Playlist, playlist_param
+        from playback import QUEUE_COUNT
+
+        def pause(params):
+            if self.media_player.is_playing():
+                self.toggle_pause()
+
+        def resume(params):
+            if self.current_song and not self.media_player.is_playing():
+                self.toggle_pause()
+
+        def seek(params):
+            if not self.current_song or self.song_duration <= 0:
+                raise ValueError("nothing to seek in")
+            self.seek_to(number_param(params, "position", 0, self.song_duration))
+
+        def add_folder(params):
+            folder = params.get("path")
+            if not isinstance(folder, str) or not os.path.isdir(folder):
+                raise ValueError("'path' must be a folder")
+            if self.scanning:
+                raise ValueError("a folder is already being scanned")
+            self.start_folder_scan(folder)
+            return "scanning"
+
+        def play_next(params):
+            self.play_next_song()
+            return self.current_song
+
+        def queue(params):
+            playlist = playlist_param(params, self.playlists)
+            if playlist is not None:
+                count = int(number_param({"count": QUEUE_COUNT, **params}, "count", 1, 1000))
+                queued = self.core.enqueue_playlist(playlist, count)
+            else:
+                songs = params.get("songs")
+                if not isinstance(songs, list) or not all(isinstance(song, str) for song in songs):
+                    raise ValueError("give 'songs', 'rules' or 'playlist'")
+                queued = self.core.enqueue(songs)
+            self.on_queue_changed()
+            return queued
+
+        def clear_queue(params):
+            self.core.queue.clear()
+            self.on_queue_changed()
+
+        def set_playlist(params):
+            playlist = playlist_param(params, self.playlists)
+            self.core.set_playlist(playlist)
+            self.on_queue_changed()
+            self.publish("playlist", playlist=playlist.name if playlist is not None else None)
+            return len(self.core.playlist_songs(playlist)) if playlist is not None else len(self.core.data)
+
+        def save_playlist(params):
+            name = params.get("name")
+            if not isinstance(name, str) or not name.strip():
+                raise ValueError("'name' must be a playlist name")
+            # Checked before it's kept, so a bad playlist never reaches the file
+            Playlist(params.get("rules"))
+            self.playlists[name.strip()] = params["rules"]
+            save_playlists(self.playlists)
+            return sorted(self.playlists)
+
+        commands = {
+            "play-next": play_next,
+            "pause": pause,
+            "resume": resume,
+            "toggle-pause": lambda params: self.toggle_pause(),
+            "vote": lambda params: self.vote_current_song(number_param(params, "multiplier", 0.5, 2.0)),
+            "seek": seek,
+            "add-folder": add_folder,
+            "queue": queue,
+            "clear-queue": clear_queue,
+            "playlist": set_playlist,
+            "save-playlist": save_playlist,
+            "playlists": lambda params: dict(self.playlists),
+        }
+        for name, zone in self.zones.items():
+            for command, func in zone.control_commands().items():
+                # The library is shared, so folders are added through the main player
+                if command != "add-folder":
+                    commands[f"{name}/{command}"] = func
+        return commands
+
+    def show_duplicates(self):
+        """Report songs that hold the same audio, hashing any that have no audio id yet"""
+        if not self.ready:
+            return
+        entries = self.core.duplicate_entries()
+        self.label.config(text="Looking for duplicates...")
+
+        def run():
+            unhashed = [path for _, path, ident in entries if not ident]
+            hashes = hash_files(unhashed)
+            complete = [(song, path, ident or hashes.get(path)) for song, path, ident in entries]
+            result = find_duplicates(complete)
+            self.dispatcher.post(self._show_duplicates, complete, result)
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def _show_duplicates(self, entries, result):
+        self.label.config(text="Ready to play" if not self.current_song
+                          else f"♪ {self.core.display_name(self.current_song)}")
+        self.core.backfill_audio_ids(entries)
+
+        byte_identical, audio_identical = result
+        if not byte_identical and not audio_identical:
+            messagebox.showinfo("Duplicates", "No duplicate songs found.")
+            return
+        lines = []
+        for title, groups in (("Identical files", byte_identical),
+                              ("Same audio, different tags", audio_identical)):
+            if groups:
+                lines.append(f"{title} ({len(groups)}):")
+                for group in groups[:10]:
+                    lines.append("  " + "  =  ".join(self.core.song_title(song) for song in group
+                                                     if song in self.core.data))
+                if len(groups) > 10:
+                    lines.append(f"  ...and {len(groups) - 10} more")
+        messagebox.showinfo("Duplicates", "\n".join(lines))
+
     def remove_songs(self):
-        if not self.data:
+        if not self.ready:
+            return
+        if not self.core.data:
             messagebox.showinfo("No Songs", "No songs to remove.")
             return
 
@@ -416,51 +1148,54 @@ class MusicPlayer:
                                relief=tk.FLAT, borderwidth=2)
         search_entry.pack(side=tk.LEFT, fill=tk.X, expand=True, ipady=5)
 
-        listbox_frame = tk.Frame(remove_window, bg=self.card_bg)
-        listbox_frame.pack(expand=True, fill=tk.BOTH, padx=20, pady=10)
+        list_view = VirtualList(remove_window, self.card_bg, self.text_primary,
+                                self.accent_cyan, self.text_primary)
+        list_view.pack(expand=True, fill=tk.BOTH, padx=20, pady=10)
 
-        scrollbar = tk.Scrollbar(listbox_frame)
-        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        index = self.core.get_search_index()
+        all_items = [(song, self.core.song_title(song)) for song in self.core.data]
+        search = {"query": "", "results": None, "job": None}
 
-        listbox = tk.Listbox(listbox_frame, selectmode=tk.MULTIPLE,
-                           bg=self.card_bg, fg=self.text_primary,
-                           selectbackground=self.accent_cyan,
-                           selectforeground=self.text_primary,
-                           font=("Segoe UI", 9),
-                           relief=tk.FLAT,
-                           yscrollcommand=scrollbar.set)
-        listbox.pack(expand=True, fill=tk.BOTH)
-        scrollbar.config(command=listbox.yview)
-
-        for song in self.data:
-            listbox.insert(tk.END, song)
-
-        def update_listbox(*args):
-            search_text = search_var.get().lower()
-            listbox.delete(0, tk.END)
-            for song in self.data:
-                if search_text in song.lower():
-                    listbox.insert(tk.END, song)
+        def show_results():
+            results = search["results"]
+            if results is None:
+                list_view.set_items(all_items)
+            else:
+                list_view.set_items([item for item in all_items if item[0] in results])
 
-        search_var.trace_add("write", update_listbox)
+        def run_search():
+            search["job"] = None
+            # Scheduled on the root, so it can come due after the window has closed
+            if not remove_window.winfo_exists():
+                return
+            query = search_var.get().lower()
+            previous = search["query"]
+            # Typing more of the same query only narrows the previous results
+            within = search["results"] if previous and previous in query else None
+            search["query"] = query
+            search["results"] = index.search(query, within) if query else None
+            show_results()
+
+        def schedule_search(*args):
+            if search["job"] is not None:
+                self.root.after_cancel(search["job"])
+            search["job"] = self.after(150, run_search)
+
+        search_var.trace_add("write", schedule_search)
+        show_results()
 
         def confirm_removal():
-            selected_indices = listbox.curselection()
-            if not selected_indices:
+            removed = list_view.selection()
+            if not removed:
                 return
-            for index in reversed(selected_indices):
-                song = listbox.get(index)
-                if song == self.current_song:
-                    self.media_player.stop()
-                    self.current_song = None
-                del self.data[song]
-                if song in self.files:
-                    self.files.remove(song)
-                if song in self.recent_songs:
-                    self.recent_songs.remove(song)
-                listbox.delete(index)
-            self.save_data(self.data)
-            messagebox.showinfo("✓ Removed", "Selected songs removed.")
+            self.drop_removed(removed)
+            self.core.delete_song_data(removed)
+            self.core.flush_data()
+            self.publish("library", songs=len(self.core.data))
+            gone = set(removed)
+            all_items[:] = [item for item in all_items if item[0] not in gone]
+            show_results()
+            messagebox.showinfo("✓ Removed", f"{len(removed)} song(s) removed.")
 
         btn_frame = tk.Frame(remove_window, bg=self.bg_gradient_bottom)
         btn_frame.pack(pady=15)
@@ -472,99 +1207,193 @@ class MusicPlayer:
                                   width=180, height=40)
         remove_btn.pack()
 
-    def drift_toward_one(self, vote_weight, hours_since_played, half_life_hours=100):
-        if vote_weight == 1.0:
-            return 1.0
-        decay_factor = 0.5 ** (hours_since_played / half_life_hours)
-        return 1.0 + (vote_weight - 1.0) * decay_factor
-
-    def get_scores(self):
-        scores = {}
-        now = datetime.datetime.now()
-        for song, meta in self.data.items():
-            delta = now - datetime.datetime.fromisoformat(meta["last_played"])
-            hours = delta.total_seconds() / 3600
-
-            original_weight = meta["vote_weight"]
-            adjusted_weight = self.drift_toward_one(original_weight, hours)
-            adjusted_weight = self.clamp_weight(adjusted_weight)
-
-            time_score = math.log1p(max(hours, 0.1))
-            score = time_score * adjusted_weight
-            scores[song] = score
-
-        return scores
-    
-    def clamp_weight(self, weight):
-        return min(max(weight, 0.5), 2.0)
-
     def reset_vote_weights(self):
-        for song in self.data:
-            self.data[song]["vote_weight"] = 1.0
-        self.save_data(self.data)
+        if not self.ready:
+            return
+        self.core.reset_vote_weights()
         messagebox.showinfo("✓ Reset", "All vote weights reset to 1.0")
 
     def vote_current_song(self, multiplier):
         if not self.current_song:
             return
-        self.data[self.current_song]["vote_weight"] = self.clamp_weight(
-            self.data[self.current_song]["vote_weight"] * multiplier
-        )
-        weight = self.data[self.current_song]['vote_weight']
-        self.label.config(text=f"♪ {self.current_song[:30]}... (×{weight:.2f})")
-        self.save_data(self.data)
+        weight = self.core.vote(self.current_song, multiplier)
+        self.label.config(text=f"♪ {self.core.song_title(self.current_song)[:30]}... (×{weight:.2f})")
+        self.publish("vote", weight=weight)
+        return weight
+
+    def pick_playable_song(self):
+        def on_missing(song):
+            self.missing_files.inc()
+            self.label.config(text=f"File not found: {self.core.song_title(song)}")
+        return self.core.pick_playable_song(on_missing=on_missing)
+
+    def prepare_next_song(self):
+        """
+        Pick the song after the current one and get it ready on the standby
+        player: the file is checked, the media pre-parsed and its art cached,
+        so the transition doesn't have to wait for any of it.
+        """
+        self.prepare_job = None
+        self.next_song = None
+        self.next_media = None
+        if not self.current_song:
+            return
+        song = self.pick_playable_song()
+        if song is None:
+            return
+        self.next_from_queue = self.core.picked_from_queue
+        self.next_marked = self.core.pick_marked
+        import vlc
+        path = self.core.data[song]["path"]
+        media = self.vlc_instance.media_new(path)
+        media.parse_with_options(vlc.MediaParseFlag.local, 0)
+        self.standby_player.set_media(media)
+        self.art_loader.prefetch(path, self.catalogued_info(song))
+        self.next_song = song
+        self.next_media = media
+
+    def on_queue_changed(self):
+        """Pick the prepared next song again, so a queue or playlist change starts with the next track"""
+        self.publish("queue", queue=len(self.core.queue))
+        if self.next_song is None:
+            return
+        # Picking again would leave the dropped pick counted as recently played
+        self.core.take_back(self.next_song, self.next_from_queue, self.next_marked)
+        self.prepare_next_song()
+
+    def take_next_song(self):
+        """The prepared next song, if it is still in the library and on disk"""
+        song, media = self.next_song, self.next_media
+        self.next_song = None
+        self.next_media = None
+        if song is None or not self.core.is_playable(song):
+            return None, None
+        return song, media
+
+    def play_song(self, path, media=None, fade_out=False, gain_db=None, duration=None):
+        if self.fade_job is not None:
+            # A crossfade is still running, cut it short
+            self.root.after_cancel(self.fade_job)
+            self.fade_job = None
+            self.standby_player.stop()
+        self.audio_requested = time.perf_counter()
+        old_player = self.media_player
+        if media is not None:
+            # Prepared on the standby player: swap players instead of reopening
+            self.media_player, self.standby_player = self.standby_player, self.media_player
+        else:
+            media = self.vlc_instance.media_new(path)
+            self.media_player.set_media(media)
+        old_volume = self.track_volume
+        self.track_volume = self.scaled_volume(gain_db)
+        self.media_player.audio_set_volume(0 if fade_out else self.track_volume)
+        self.media_player.play()
+        if old_player is not self.media_player:
+            if fade_out:
+                self.crossfade(old_player, old_volume, 0)
+            else:
+                old_player.stop()
+        self.playback_started_time = datetime.datetime.now()
+        self.last_time_second = None
+        # The tag catalogue or pre-parsed media already know the length, otherwise wait for LengthChanged
+        self.song_duration = duration or max(media.get_duration() / 1000, 0)
+        self.update_progress(0)
+
+    def crossfade(self, old_player, old_volume, step):
+        steps = max(1, CROSSFADE_MS // 50)
+        fraction = min(step / steps, 1.0)
+        old_player.audio_set_volume(int(old_volume * (1 - fraction)))
+        self.media_player.audio_set_volume(int(self.track_volume * fraction))
+        if fraction < 1.0:
+            self.fade_job = self.after(50, self.crossfade, old_player, old_volume, step + 1)
+        else:
+            self.fade_job = None
+            old_player.stop()
+
+    def attach_player_events(self, player):
+        import vlc
+        events = player.event_manager()
+        events.event_attach(vlc.EventType.MediaPlayerEndReached, self._vlc_end_reached, player)
+        events.event_attach(vlc.EventType.MediaPlayerLengthChanged, self._vlc_length_changed, player)
+        events.event_attach(vlc.EventType.MediaPlayerTimeChanged, self._vlc_time_changed, player)
+        events.event_attach(vlc.EventType.MediaPlayerPlaying, self._vlc_playing, player)
 
-    def pick_song(self, scores):
-        if not scores:
-            return None
+    # The _vlc_* handlers run on VLC's threads and only hand off to the Tk thread
 
-        limit = min(self.repeat_limit, len(scores))
-        available_songs = {song: score for song, score in scores.items() 
-                          if song not in self.recent_songs}
+    def _vlc_end_reached(self, event, player):
+        self.dispatcher.post(self.on_end_reached, player)
 
-        if not available_songs:
-            available_songs = scores
+    def _vlc_length_changed(self, event, player):
+        self.dispatcher.post(self.on_length_changed, player, event.u.new_length)
 
-        total = sum(available_songs.values())
-        if total == 0:
-            song = random.choice(list(available_songs.keys()))
+    def _vlc_time_changed(self, event, player):
+        # TimeChanged fires several times a second; only wake Tk when the
+        # displayed second changes, or continuously inside the crossfade window
+        if player is not self.media_player:
+            return
+        position = event.u.new_time
+        second = position // 1000
+        near_end = (LOOKAHEAD and CROSSFADE_MS and self.song_duration > 0
+                    and self.song_duration * 1000 - position <= CROSSFADE_MS)
+        if second != self.last_time_second or near_end:
+            self.last_time_second = second
+            self.dispatcher.post(self.on_time_changed, player, position)
+
+    def _vlc_playing(self, event, player):
+        self.dispatcher.post(self.on_playing, player)
+
+    def on_end_reached(self, player):
+        if player is not self.media_player or not self.current_song or self.transition_scheduled:
+            return
+        self.transition_scheduled = True
+        self.transition_started = time.perf_counter()
+        if LOOKAHEAD:
+            self._transition_to_next()
         else:
-            r = random.uniform(0, total)
-            cumulative = 0
-            for song, score in available_songs.items():
-                cumulative += score
-                if r <= cumulative:
-                    break
+            self.after(1000, self._transition_to_next)
 
-        self.recent_songs.append(song)
-        if len(self.recent_songs) > limit:
-            self.recent_songs.pop(0)
+    def on_length_changed(self, player, length):
+        if player is self.media_player and length > 0:
+            self.song_duration = length / 1000
+            self.update_progress(player.get_time())
+            self.publish("duration", duration=self.song_duration)
 
-        return song
+    def on_time_changed(self, player, position):
+        if player is not self.media_player:
+            return
+        self.update_progress(position)
+        self.publish("position", position=position // 1000)
+        remaining = self.song_duration * 1000 - position
+        if (LOOKAHEAD and CROSSFADE_MS and self.next_song and self.song_duration > 0
+                and remaining <= CROSSFADE_MS and not self.transition_scheduled):
+            self.transition_scheduled = True
+            self.transition_started = time.perf_counter()
+            self._transition_to_next(fade_out=True)
+
+    def on_playing(self, player):
+        """Reports the gap from the previous track ending to this one producing audio"""
+        if player is not self.media_player:
+            return
+        if self.audio_requested is not None:
+            self.first_audio_time.observe(time.perf_counter() - self.audio_requested)
+            self.audio_requested = None
+        if self.transition_started is None:
+            return
+        gap_ms = (time.perf_counter() - self.transition_started) * 1000
+        self.transition_started = None
+        self.transition_gaps.append(gap_ms)
+        average = sum(self.transition_gaps) / len(self.transition_gaps)
+        print(f"Track gap: {gap_ms:.0f} ms (average {average:.0f} ms over {len(self.transition_gaps)})")
 
-    def play_song(self, path):
-        media = self.vlc_instance.media_new(path)
-        self.media_player.set_media(media)
-        self.media_player.play()
-        self.playback_started_time = datetime.datetime.now()
-        self.root.after(100, self.set_song_duration)
-    
-    def set_song_duration(self):
-        duration = self.media_player.get_length() / 1000
-        if duration > 0:
-            self.song_duration = duration
-        else:
-            self.root.after(100, self.set_song_duration)
-    
     def format_time(self, seconds):
         minutes = int(seconds) // 60
         sec = int(seconds) % 60
         return f"{minutes}:{sec:02d}"
 
-    def update_progress(self):
+    def update_progress(self, position_ms):
         try:
             if self.song_duration > 0:
-                current_pos = self.media_player.get_time() / 1000
+                current_pos = max(position_ms, 0) / 1000
                 percent = min((current_pos / self.song_duration) * 100, 100)
                 self.progress["value"] = percent
 
@@ -579,8 +1408,6 @@ class MusicPlayer:
             self.progress["value"] = 0
             self.time_label.config(text="0:00 / 0:00")
 
-        self.root.after(self.progress_update_interval, self.update_progress)
-
     def seek(self, event):
         if not self.current_song or self.song_duration <= 0:
             return
@@ -588,20 +1415,14 @@ class MusicPlayer:
         click_x = event.x
         total_width = self.progress.winfo_width()
         fraction = click_x / total_width
-        new_time = int(fraction * self.song_duration * 1000)
+        self.seek_to(fraction * self.song_duration)
 
-        self.media_player.set_time(new_time)
+    def seek_to(self, seconds):
+        self.media_player.set_time(int(seconds * 1000))
+        self.publish("seek", position=seconds)
 
-    def check_song_end(self):
-        if self.current_song:
-            state = self.media_player.get_state()
-            if state == vlc.State.Ended and not self.transition_scheduled:
-                self.transition_scheduled = True
-                self.root.after(1000, self._transition_to_next)
-        self.root.after(1000, self.check_song_end)
-
-    def _transition_to_next(self):
-        self.play_next_song()
+    def _transition_to_next(self, fade_out=False):
+        self.play_next_song(fade_out)
         self.transition_scheduled = False
 
     def toggle_pause(self):
@@ -609,50 +1430,60 @@ class MusicPlayer:
             return
         if self.media_player.is_playing():
             self.media_player.pause()
-            self.pause_button_widget.text = "▶ Resume"
-            self.pause_button_widget.draw_button(self.pause_button_widget.bg, 
-                                                 self.pause_button_widget.fg)
+            self.pause_button_widget.set_text("▶ Resume")
+            self.publish("pause", playing=False)
         else:
             self.media_player.play()
-            self.pause_button_widget.text = "⏸ Pause"
-            self.pause_button_widget.draw_button(self.pause_button_widget.bg, 
-                                                 self.pause_button_widget.fg)
+            self.pause_button_widget.set_text("⏸ Pause")
+            self.publish("resume", playing=True)
+
+    def record_finish(self, completed):
+        """Log how far the current song got before it ended or was skipped"""
+        if not self.current_song:
+            return
+        duration_ms = self.song_duration * 1000
+        position_ms = duration_ms if completed else max(self.media_player.get_time(), 0)
+        self.core.finish_song(self.current_song, position_ms, duration_ms)
 
-    def play_next_song(self):
-        scores = self.get_scores()
-        song = self.pick_song(scores)
+    def play_next_song(self, fade_out=False):
+        if not self.ready:
+            return
+        # Transitions are scheduled when a track ends or reaches its crossfade;
+        # anything else is the user skipping ahead
+        self.record_finish(completed=self.transition_scheduled)
+        if self.prepare_job is not None:
+            self.root.after_cancel(self.prepare_job)
+            self.prepare_job = None
+        song, media = self.take_next_song() if LOOKAHEAD else (None, None)
+        if song is None:
+            fade_out = False
+            song = self.pick_playable_song()
         
-        self.pause_button_widget.text = "⏸ Pause"
-        self.pause_button_widget.draw_button(self.pause_button_widget.bg, 
-                                            self.pause_button_widget.fg)
+        self.pause_button_widget.set_text("⏸ Pause")
         
         if song is None:
             self.label.config(text="No songs to play")
+            self.publish("stop", song=None, title=None, playing=False, position=0)
             return
 
-        path = self.data[song]["path"]
-        
-        if not os.path.exists(path):
-            self.label.config(text=f"File not found: {song}")
-            del self.data[song]
-            if song in self.files:
-                self.files.remove(song)
-            self.save_data(self.data)
-            self.root.after(100, self.play_next_song)
-            return
-            
-        self.play_song(path)
+        meta = self.core.data[song]
+        path = meta["path"]
+        self.play_song(path, media, fade_out, meta.get("gain_db"), meta.get("duration"))
         self.current_song = song
         
-        # Truncate long song names
-        display_name = song if len(song) <= 35 else song[:32] + "..."
-        self.label.config(text=f"♪ {display_name}")
+        self.label.config(text=f"♪ {self.core.display_name(song)}")
+        self.publish("song", song=song, title=self.core.display_name(song), playing=True,
+                     position=0, duration=self.song_duration, weight=meta.get("vote_weight", 1.0))
         
-        self.data[song]["last_played"] = datetime.datetime.now().isoformat()
-        self.save_data(self.data)
-        self.show_song_info(path)
+        self.core.mark_played(song)
+        self.show_song_info(path, self.catalogued_info(song))
+
+        if LOOKAHEAD:
+            # Wait for playback (and any crossfade) to get going first
+            self.prepare_job = self.after(CROSSFADE_MS + 500, self.prepare_next_song)
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()
     root = tk.Tk()
     app = MusicPlayer(root)
     root.mainloop()
\ No newline at end of file
@@ -0,0 +1,153 @@
+import json
+import time
+import functools
+from bisect import bisect_left
+
+PREFIX = "smart_player_"
+# Histogram bucket upper bounds in seconds: 10 us doubling up to about 10 s
+BUCKETS = tuple(1e-5 * 2 ** k for k in range(21))
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def prometheus(self):
+        name = PREFIX + self.name
+        return [f"# HELP {name} {self.help}", f"# TYPE {name} counter", f"{name} {self.value}"]
+
+    def to_dict(self):
+        return {"type": "counter", "value": self.value}
+
+
+class Histogram:
+    """Durations in seconds, counted into BUCKETS"""
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q quantile; None before any observation"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS + (float("inf"),), self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def prometheus(self):
+        name = PREFIX + self.name
+        lines = [f"# HELP {name} {self.help}", f"# TYPE {name} histogram"]
+        counts = list(self.counts)
+        cumulative = 0
+        for bound, count in zip(BUCKETS, counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{le="{bound:.6g}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{le="+Inf"}} {cumulative + counts[-1]}')
+        lines.append(f"{name}_sum {self.sum:.9g}")
+        lines.append(f"{name}_count {cumulative + counts[-1]}")
+        return lines
+
+    def to_dict(self):
+        quantiles = {f"p{round(q * 100)}": self.quantile(q) for q in (0.5, 0.95, 0.99)}
+        return {"type": "histogram", "count": self.count, "sum": self.sum,
+                "mean": self.sum / self.count if self.count else None,
+                # JSON has no infinity; past the last bucket is reported as its label
+                **{key: "+Inf" if value == float("inf") else value for key, value in quantiles.items()},
+                "buckets": dict(zip([f"{bound:.6g}" for bound in BUCKETS] + ["+Inf"], self.counts))}
+
+
+class NullHistogram:
+    """What a disabled Metrics hands out: observing costs a method call and nothing else"""
+
+    count = 0
+
+    def observe(self, seconds):
+        pass
+
+
+NULL_HISTOGRAM = NullHistogram()
+
+
+class Metrics:
+    """
+    The player's counters and timing histograms, exported as Prometheus text
+    or JSON.
+
+    Counters always count; they are a single integer add. Histograms only
+    exist when enabled: disabled, histogram() hands back a do-nothing
+    stand-in and instrument() leaves methods untouched, so a player started
+    without metrics runs the same code it always did.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.metrics = {}
+
+    def counter(self, name, help_text):
+        if name not in self.metrics:
+            self.metrics[name] = Counter(name, help_text)
+        return self.metrics[name]
+
+    def histogram(self, name, help_text):
+        if not self.enabled:
+            return NULL_HISTOGRAM
+        if name not in self.metrics:
+            self.metrics[name] = Histogram(name, help_text)
+        return self.metrics[name]
+
+    def instrument(self, obj, *names):
+        """
+        Time calls to obj's methods names into histograms of the same name, by
+        shadowing each bound method with a timed one on obj itself. Calls the
+        object makes to its own methods are timed too.
+        """
+        if not self.enabled:
+            return
+        for name in names:
+            method = getattr(obj, name)
+            histogram = self.histogram(f"{name}_seconds", f"Time spent in {type(obj).__name__}.{name}")
+            setattr(obj, name, timed(method, histogram))
+
+    def prometheus(self):
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines += metric.prometheus()
+        return "\n".join(lines) + "\n"
+
+    def to_dict(self):
+        return {name: metric.to_dict() for name, metric in list(self.metrics.items())}
+
+    def dump(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+
+def timed(func, histogram):
+    perf_counter = time.perf_counter
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            histogram.observe(perf_counter() - start)
+    return wrapper
@@ -0,0 +1,239 @@
+import os
+
+# Songs queued from a playlist when the request doesn't say how many
+QUEUE_COUNT = 20
+
+
+class NullPlayback:
+    """
+    Playback backend that makes no sound. It remembers what it was asked to
+    play, so the core can be driven through whole sessions without VLC.
+    """
+
+    def __init__(self):
+        self.path = None
+        self.gain_db = None
+        self.volume = 100
+        self.playing = False
+        self.plays = 0
+        self.position_ms = 0
+
+    def play(self, path, gain_db=None):
+        self.path = path
+        self.gain_db = gain_db
+        self.playing = True
+        self.plays += 1
+        self.position_ms = 0
+
+    def pause(self):
+        self.playing = False
+
+    def resume(self):
+        self.playing = self.path is not None
+
+    def stop(self):
+        self.path = None
+        self.playing = False
+
+    def seek(self, position_ms):
+        self.position_ms = position_ms
+
+    def is_playing(self):
+        return self.playing
+
+    def set_volume(self, volume):
+        self.volume = volume
+
+
+class VlcPlayback:
+    """
+    Playback on a media player of its own from a shared vlc.Instance, so
+    several zones can play at once from one libvlc, each on its own audio
+    output device (an id from audio_output_device_enum, or None for the
+    default). on_end() is called from a libvlc thread when a track ends; it
+    must hand over to another thread before touching the player again.
+    """
+
+    def __init__(self, instance, device=None, on_end=None):
+        import vlc
+        self.instance = instance
+        self.player = instance.media_player_new()
+        self.device = device
+        self.on_end = on_end
+        self.volume = 100
+        self.gain_db = None
+        self.player.event_manager().event_attach(vlc.EventType.MediaPlayerEndReached, self._end_reached)
+
+    def _end_reached(self, event):
+        if self.on_end is not None:
+            self.on_end()
+
+    def _apply_volume(self):
+        # libvlc volume is linear; gain_db levels the track as the main player does
+        gain = 10 ** (self.gain_db / 20) if self.gain_db is not None else 1.0
+        self.player.audio_set_volume(int(min(max(self.volume * gain, 0), 200)))
+
+    def play(self, path, gain_db=None):
+        self.gain_db = gain_db
+        self.player.set_media(self.instance.media_new(path))
+        self._apply_volume()
+        self.player.play()
+        if self.device:
+            # libvlc can only switch an output that has been started, so this
+            # goes after play() and again for every track
+            self.player.audio_output_device_set(None, self.device)
+
+    def pause(self):
+        self.player.set_pause(1)
+
+    def resume(self):
+        self.player.set_pause(0)
+
+    def stop(self):
+        self.player.stop()
+
+    def seek(self, position_ms):
+        self.player.set_time(int(position_ms))
+
+    def is_playing(self):
+        return bool(self.player.is_playing())
+
+    def set_volume(self, volume):
+        self.volume = volume
+        self._apply_volume()
+
+    def release(self):
+        self.player.stop()
+        self.player.release()
+
+
+class HeadlessPlayer:
+    """
+    Play-next and vote on top of a PlayerCore and a playback backend, without a UI.
+    listener(event, **fields) hears about each change, as MusicPlayer.publish does.
+    playlists maps the names of saved playlists to their rules.
+    """
+
+    def __init__(self, core, backend=None, listener=None, playlists=None):
+        self.core = core
+        self.backend = backend if backend is not None else NullPlayback()
+        self.listener = listener
+        self.playlists = playlists if playlists is not None else {}
+        self.current_song = None
+
+    def publish(self, event, **fields):
+        if self.listener is not None:
+            self.listener(event, **fields)
+
+    def play_next(self, now=None):
+        song = self.core.pick_playable_song(now)
+        if song is None:
+            self.stop()
+            return None
+        meta = self.core.data[song]
+        self.backend.play(meta["path"], meta.get("gain_db"))
+        self.current_song = song
+        self.core.mark_played(song, now)
+        self.publish("song", song=song, title=self.core.display_name(song), playing=True,
+                     position=0, duration=meta.get("duration", 0), weight=meta.get("vote_weight", 1.0))
+        return song
+
+    def stop(self):
+        self.backend.stop()
+        self.current_song = None
+        self.publish("stop", song=None, title=None, playing=False, position=0)
+
+    def pause(self):
+        if self.current_song:
+            self.backend.pause()
+            self.publish("pause", playing=False)
+
+    def resume(self):
+        if self.current_song:
+            self.backend.resume()
+            self.publish("resume", playing=True)
+
+    def seek(self, seconds):
+        if self.current_song:
+            self.backend.seek(int(seconds * 1000))
+            self.publish("seek", position=seconds)
+
+    def vote(self, multiplier, now=None):
+        if not self.current_song:
+            return None
+        weight = self.core.vote(self.current_song, multiplier, now)
+        self.publish("vote", weight=weight)
+        return weight
+
+    def remove(self, songs):
+        if self.current_song in songs:
+            self.stop()
+        self.core.delete_song_data(songs)
+        self.publish("library", songs=len(self.core.data))
+
+    def enqueue(self, songs):
+        queued = self.core.enqueue(songs)
+        self.publish("queue", queue=len(self.core.queue))
+        return queued
+
+    def enqueue_playlist(self, playlist, count, now=None):
+        queued = self.core.enqueue_playlist(playlist, count, now)
+        self.publish("queue", queue=len(self.core.queue))
+        return queued
+
+    def clear_queue(self):
+        self.core.queue.clear()
+        self.publish("queue", queue=0)
+
+    def set_playlist(self, playlist, now=None):
+        """Keep picks to playlist (None for the whole library); returns how many songs it has"""
+        self.core.set_playlist(playlist)
+        self.publish("playlist", playlist=playlist.name if playlist is not None else None)
+        return len(self.core.playlist_songs(playlist, now)) if playlist is not None else len(self.core.data)
+
+    def add_folder(self, folder):
+        """Scan folder into the library, there and then"""
+        from scanner import scan_folder
+        from content_hash import hash_scan_changes
+        from tags import read_scan_tags
+        known, unhashed = self.core.folder_snapshot(folder)
+        result = scan_folder(folder, known)
+        added, moved, changed, removed = self.core.apply_folder_scan(
+            result, hash_scan_changes(result, unhashed), read_scan_tags(result))
+        if self.current_song in removed:
+            self.stop()
+        self.publish("library", songs=len(self.core.data))
+        return {"added": added, "moved": moved, "changed": changed, "removed": len(removed)}
+
+    def control_commands(self):
+        """The commands a ControlServer offers, each taking the request's parameters"""
+        from control_server import number_param
+        from playlists import playlist_param
+
+        def add_folder(params):
+            folder = params.get("path")
+            if not isinstance(folder, str) or not os.path.isdir(folder):
+                raise ValueError("'path' must be a folder")
+            return self.add_folder(folder)
+
+        def queue(params):
+            playlist = playlist_param(params, self.playlists)
+            if playlist is not None:
+                return self.enqueue_playlist(playlist, int(number_param({"count": QUEUE_COUNT, **params},
+                                                                        "count", 1, 1000)))
+            songs = params.get("songs")
+            if not isinstance(songs, list) or not all(isinstance(song, str) for song in songs):
+                raise ValueError("give 'songs', 'rules' or 'playlist'")
+            return self.enqueue(songs)
+
+        return {
+            "play-next": lambda params: self.play_next(),
+            "pause": lambda params: self.pause(),
+            "resume": lambda params: self.resume(),
+            "vote": lambda params: self.vote(number_param(params, "multiplier", 0.5, 2.0)),
+            "seek": lambda params: self.seek(number_param(params, "position", 0)),
+            "add-folder": add_folder,
+            "queue": queue,
+            "clear-queue": lambda params: self.clear_queue(),
+            "playlist": lambda params: self.set_playlist(playlist_param(params, self.playlists)),
+        }
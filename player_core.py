@@ -0,0 +1,623 @@
+import os
+import datetime
+from collections import deque
+from score_engine import ScoreEngine
+from sampler import WeightedSampler
+from scheduler import ScoreScheduler
+from scanner import path_key
+from loudness import ANALYSIS_VERSION, needs_analysis
+from content_hash import hash_files
+from search_index import SearchIndex
+from journal import apply_event
+from track_table import TrackTable
+from tags import TAG_FIELDS, TAGS_VERSION, needs_tags, read_tags_many
+from playlists import TagIndex
+
+# Journal events between compactions into the store
+COMPACT_EVERY = 5000
+# Songs with acoustic features needed before similarity-based picks kick in
+MIN_SIMILARITY_SONGS = 64
+# Nearest neighbours of the previous song considered for a similar pick
+NEIGHBOURS = 50
+
+
+def read_files(paths):
+    """
+    What PlayerCore.add_files needs to know about paths, from the disk:
+    (stats, hashes, tags), each keyed by path. Files that can't be read are
+    left out of stats. Slow for many files, and safe on any thread.
+    """
+    stats = {}
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except OSError as e:
+            print(f"Can't add {path}: {e}")
+            continue
+        stats[path] = (stat.st_mtime_ns, stat.st_size)
+    readable = list(stats)
+    return stats, hash_files(readable), read_tags_many(readable)
+
+
+class PlayerCore:
+    """
+    The player's library, scoring, song selection and persistence, with no Tk
+    or VLC in sight. The UI drives it and shows what it returns; benchmark.py
+    drives it directly.
+
+    schedule(ms, func) is used to batch store commits a little after a change.
+    Without one, changes stay pending until flush_data is called.
+
+    With an EventJournal, changes are appended to the journal instead of being
+    written to the store, which then only holds the snapshot the journal is
+    compacted into. Opening the core replays whatever the journal holds.
+
+    With a FeatureMatrix, songs' acoustic embeddings are kept in it, and with a
+    similarity_blend above zero that share of picks is drawn from the songs
+    most similar to the previous one, weighted by score times similarity.
+
+    score_engine replaces the default ScoreEngine, to score with other
+    half-life, weight bounds or time score (see simulator.py).
+
+    Queued songs are played first, in order. With a playlist set, picks are
+    kept to its songs, which a TagIndex over the songs' tags and history
+    works out (see playlists.py).
+    """
+
+    def __init__(self, store, schedule=None, staleness=0.01, repeat_limit=150, rng=None,
+                 flush_delay=2000, journal=None, features=None, similarity_blend=0.0,
+                 score_engine=None):
+        self.store = store
+        self.journal = journal
+        self.similarity_blend = similarity_blend
+        self.previous_song = None
+        self.schedule = schedule
+        self.flush_scheduled = False
+        self.flush_delay = flush_delay
+        # ProfileCores sharing this core's library (see profiles.py)
+        self.followers = []
+        self.queue = deque()
+        self.picked_from_queue = False
+        # Whether the last pick put its song in the sampler's repeat history
+        self.pick_marked = False
+        self.playlist = None
+        self.tag_index = None
+
+        self.open_library(store.load(), features)
+        self.dirty = set()
+        if journal is not None:
+            for event in journal.replay():
+                self.dirty.add(apply_event(self.data, event))
+            journal.next_seq = max([journal.next_seq] + [meta.get("seq", 0) + 1
+                                                         for meta in self.data.values()])
+            self.compact()
+        self.index_library()
+
+        self.repeat_limit = repeat_limit
+        self.score_engine = score_engine if score_engine is not None else ScoreEngine()
+        self.sampler = WeightedSampler(repeat_limit, rng)
+        self.scheduler = ScoreScheduler(self.score_engine, self.sampler, staleness)
+        self.rebuild_scores()
+        self.rebuild_similarity()
+
+    def open_library(self, entries, features):
+        self.data = TrackTable(entries)
+        self.features = features
+        self.similarity = None
+
+    def index_library(self):
+        self.path_index = {path_key(meta["path"]): song for song, meta in self.data.items()}
+        self.audio_index = {}
+        for song, meta in self.data.items():
+            if meta.get("audio_id"):
+                self.audio_index.setdefault(meta["audio_id"], set()).add(song)
+        self.search_index = None
+
+    def close(self):
+        if self.journal is not None:
+            self.compact()
+            self.journal.close()
+        if self.features is not None:
+            self.features.close()
+        self.store.close()
+
+    # Persistence
+
+    def save_data(self, data):
+        self.store.save_all(data)
+        self.store.flush()
+        if self.journal is not None:
+            self.dirty.clear()
+            self.journal.truncate()
+        self.index_tags(data)
+        self.rebuild_scores()
+
+    def record(self, event, now=None):
+        """Apply an event to the library and log it to the journal or the store"""
+        if self.journal is not None:
+            self.journal.append(event)
+            song = apply_event(self.data, event)
+            self.dirty.add(song)
+        else:
+            song = apply_event(self.data, event)
+            if song in self.data:
+                self.store.update_song(song, self.data[song])
+            else:
+                self.store.delete_songs([song])
+        if song in self.data and not self.data[song].get("missing"):
+            self.score_engine.update(song, self.data[song])
+            self.scheduler.touch([song], now)
+        self.index_tags([song])
+        self.schedule_flush()
+        return song
+
+    def compact(self):
+        """Write every song the journal has touched into the store, then empty the journal"""
+        changed = [(song, self.data[song]) for song in self.dirty if song in self.data]
+        removed = [song for song in self.dirty if song not in self.data]
+        if changed:
+            self.store.update_songs(changed)
+        if removed:
+            self.store.delete_songs(removed)
+        self.store.flush()
+        self.journal.truncate()
+        self.dirty.clear()
+
+    def rebuild_scores(self, now=None):
+        self.score_engine.rebuild({song: meta for song, meta in self.data.items()
+                                   if not meta.get("missing")})
+        self.scheduler.rebuild(now)
+
+    def save_songs(self, songs, now=None):
+        """Write only the given songs' entries; the commit happens in a batch shortly after"""
+        if self.journal is not None:
+            for song in songs:
+                self.journal.append({"type": "update", "song": song, "meta": dict(self.data[song])})
+                self.data[song]["seq"] = self.journal.next_seq - 1
+            self.dirty.update(songs)
+        else:
+            self.store.update_songs([(song, self.data[song]) for song in songs])
+        playable = [song for song in songs if not self.data[song].get("missing")]
+        for song in playable:
+            self.score_engine.update(song, self.data[song])
+        self.scheduler.touch(playable, now)
+        self.index_tags(songs)
+        for follower in self.followers:
+            follower.sync_songs(songs, now)
+        self.schedule_flush()
+
+    def delete_song_data(self, songs):
+        """Remove songs from the library and everything that tracks it"""
+        if not songs:
+            return
+        for song in songs:
+            meta = self.data.pop(song, None)
+            if meta is not None:
+                self.path_index.pop(path_key(meta["path"]), None)
+                self.audio_index.get(meta.get("audio_id"), set()).discard(song)
+            if self.search_index is not None:
+                self.search_index.remove(song)
+            if self.similarity is not None:
+                self.similarity.remove(song)
+            if self.tag_index is not None:
+                self.tag_index.remove(song)
+        if self.journal is not None:
+            for song in songs:
+                self.journal.append({"type": "remove", "song": song})
+            self.dirty.update(songs)
+        else:
+            self.store.delete_songs(songs)
+        for song in songs:
+            self.score_engine.remove(song)
+        self.scheduler.remove(songs)
+        for follower in self.followers:
+            follower.forget_songs(songs)
+        self.schedule_flush()
+
+    def mark_missing(self, songs):
+        """
+        Take songs whose files are gone out of rotation, but keep their history
+        so a later scan can re-link them if the files were only moved
+        """
+        for song in songs:
+            self.data[song]["missing"] = True
+            if self.similarity is not None:
+                self.similarity.remove(song)
+            self.score_engine.remove(song)
+        self.scheduler.remove(songs)
+        self.save_songs(songs)
+
+    def drop_missing(self, songs):
+        """
+        Take songs whose files are gone out of the library as one batch: those
+        with an audio id are kept as missing, the rest are deleted
+        """
+        kept = [song for song in songs if self.data[song].get("audio_id")]
+        self.mark_missing(kept)
+        self.delete_song_data([song for song in songs if not self.data[song].get("audio_id")])
+
+    def schedule_flush(self):
+        if not self.flush_scheduled:
+            self.flush_scheduled = True
+            if self.schedule is not None:
+                self.schedule(self.flush_delay, self.flush_data)
+
+    def flush_data(self):
+        self.flush_scheduled = False
+        if self.features is not None:
+            self.features.flush()
+        if self.journal is None:
+            self.store.flush()
+        elif self.journal.count >= COMPACT_EVERY:
+            self.compact()
+        else:
+            self.journal.flush()
+
+    # Library
+
+    def song_title(self, song):
+        return os.path.basename(self.data[song]["path"])
+
+    def display_name(self, song):
+        # The title from the tag catalogue if the file has one; long names are truncated
+        title = self.data[song].get("title") or self.song_title(song)
+        return title if len(title) <= 35 else title[:32] + "..."
+
+    def new_song_entry(self, path, mtime=None, size=None, audio_id=None):
+        """
+        Add a file to self.data and return its key. A file with the same audio
+        as a song whose file has gone missing is taken to be that song, moved,
+        and keeps its votes and play history.
+        """
+        song = self.find_moved_song(audio_id)
+        if song is not None:
+            meta = self.data[song]
+            self.path_index.pop(path_key(meta["path"]), None)
+            meta.pop("missing", None)
+            meta.update({"path": path, "mtime": mtime, "size": size})
+        else:
+            song = os.path.normpath(path)
+            self.data[song] = {
+                "last_played": "2000-01-01",
+                "vote_weight": 1.0,
+                "path": path,
+                "mtime": mtime,
+                "size": size
+            }
+            self.set_audio_id(song, audio_id)
+        self.path_index[path_key(path)] = song
+        if self.search_index is not None:
+            self.search_index.add(song, self.search_text(song))
+        return song
+
+    def search_text(self, song):
+        meta = self.data[song]
+        return " ".join((self.song_title(song), meta.get("artist") or "", meta.get("title") or ""))
+
+    def get_search_index(self):
+        """Built the first time it's needed, then kept up to date as songs come and go"""
+        if self.search_index is None:
+            self.search_index = SearchIndex()
+            for song in self.data:
+                self.search_index.add(song, self.search_text(song))
+        return self.search_index
+
+    def find_moved_song(self, audio_id):
+        for song in self.audio_index.get(audio_id, ()):
+            if not os.path.exists(self.data[song]["path"]):
+                return song
+        return None
+
+    def set_audio_id(self, song, audio_id):
+        meta = self.data[song]
+        if meta.get("audio_id") == audio_id:
+            return
+        self.audio_index.get(meta.get("audio_id"), set()).discard(song)
+        meta["audio_id"] = audio_id
+        if audio_id:
+            self.audio_index.setdefault(audio_id, set()).add(song)
+
+    def set_tags(self, song, fields):
+        """Store the tags read from a song's file (see tags.py); save_songs writes them"""
+        meta = self.data[song]
+        for field in TAG_FIELDS:
+            if field in fields:
+                meta[field] = fields[field]
+            elif field in meta:
+                del meta[field]
+        meta["tagged_mtime"] = meta.get("mtime")
+        meta["tags_version"] = TAGS_VERSION
+        if self.search_index is not None:
+            self.search_index.add(song, self.search_text(song))
+
+    def new_files(self, paths):
+        """The paths that aren't in the library yet"""
+        return [f for f in paths if path_key(f) not in self.path_index]
+
+    def add_files(self, paths, found=None):
+        """
+        Add the files that aren't in the library yet; returns their keys.
+        found is what read_files gave for them, if it was run elsewhere to
+        keep the disk off this thread; without it they are read here.
+        """
+        new_files = self.new_files(paths)
+        stats, hashes, tags = found if found is not None else read_files(new_files)
+        added = []
+        for f in new_files:
+            if f not in stats:
+                continue
+            mtime, size = stats[f]
+            song = self.new_song_entry(f, mtime, size, hashes.get(f))
+            if tags.get(f) is not None:
+                self.set_tags(song, tags[f])
+            added.append(song)
+        self.save_songs(added)
+        return added
+
+    def folder_snapshot(self, folder):
+        """
+        What a rescan of folder compares against: (known, unhashed), where known
+        maps path_key -> (mtime, size) and unhashed lists paths with no audio id
+        """
+        return self.paths_snapshot([folder])
+
+    def paths_snapshot(self, paths):
+        """folder_snapshot for the entries at or under any of paths, files or folders"""
+        keys = {path_key(path) for path in paths}
+        prefixes = tuple(key.rstrip(os.sep) + os.sep for key in keys)
+        known = {}
+        unhashed = []
+        for song, meta in self.data.items():
+            key = path_key(meta["path"])
+            if key in keys or key.startswith(prefixes):
+                known[key] = (meta.get("mtime"), meta.get("size"))
+                if not meta.get("audio_id"):
+                    unhashed.append(meta["path"])
+        return known, unhashed
+
+    def apply_folder_scan(self, result, hashes, tags=None):
+        """
+        Apply a finished scan to the library as one batch, with the tags read
+        from its new and changed files if given (see tags.read_scan_tags).
+        Returns (added, moved, changed, removed) where removed lists the songs
+        taken out of the library.
+        """
+        added, changed, deleted = result
+
+        touched = []
+        for path, mtime, size in changed:
+            song = self.path_index[path_key(path)]
+            self.data[song]["mtime"] = mtime
+            self.data[song]["size"] = size
+            self.set_audio_id(song, hashes.get(path))
+            touched.append(song)
+        for path, digest in hashes.items():
+            song = self.path_index.get(path_key(path))
+            if song is not None and not self.data[song].get("audio_id"):
+                self.set_audio_id(song, digest)
+                touched.append(song)
+        # Deleted files stay findable by audio id until the new paths are in
+        deleted_songs = [self.path_index[key] for key in deleted if key in self.path_index]
+        moved = 0
+        for path, mtime, size in added:
+            song = self.new_song_entry(path, mtime, size, hashes.get(path))
+            if song != os.path.normpath(path):
+                moved += 1
+            touched.append(song)
+        for path, fields in (tags or {}).items():
+            song = self.path_index.get(path_key(path))
+            if song is not None and fields is not None:
+                self.set_tags(song, fields)
+        relinked = set(touched)
+        removed = [song for song in deleted_songs if song not in relinked]
+
+        self.save_songs(touched)
+        self.delete_song_data(removed)
+        self.flush_data()
+        return len(added) - moved, moved, len(changed), removed
+
+    def duplicate_entries(self):
+        """(song, path, audio_id) for every playable song, as find_duplicates takes them"""
+        return [(song, meta["path"], meta.get("audio_id")) for song, meta in self.data.items()
+                if not meta.get("missing")]
+
+    def backfill_audio_ids(self, entries):
+        """Store audio ids hashed outside the library for songs that had none"""
+        backfilled = []
+        for song, _, ident in entries:
+            if song in self.data and ident and not self.data[song].get("audio_id"):
+                self.set_audio_id(song, ident)
+                backfilled.append(song)
+        self.save_songs(backfilled)
+
+    def songs_needing_analysis(self):
+        return [(song, meta["path"]) for song, meta in self.data.items() if needs_analysis(meta)]
+
+    def apply_analysis(self, song, fields):
+        """Store a finished loudness and feature analysis; the embedding goes to the feature matrix"""
+        if song not in self.data:
+            return
+        embedding = fields.pop("embedding", None)
+        meta = self.data[song]
+        meta.update(fields)
+        meta["analyzed_mtime"] = meta.get("mtime")
+        meta["analysis_version"] = ANALYSIS_VERSION
+        if embedding is not None and self.features is not None:
+            meta["feature_row"] = self.features.add(embedding, meta.get("feature_row"))
+            if self.similarity is not None and not self.similarity.needs_rebuild():
+                self.similarity.add(song, embedding)
+            else:
+                self.rebuild_similarity()
+        self.save_songs([song])
+
+    def songs_needing_tags(self):
+        """(song, path) for every playable song whose tags haven't been read at its current mtime"""
+        return [(song, meta["path"]) for song, meta in self.data.items()
+                if needs_tags(meta) and not meta.get("missing")]
+
+    def apply_tags(self, items):
+        """Store tags read outside the library, as (song, fields) pairs, as one batch"""
+        tagged = []
+        for song, fields in items:
+            if song in self.data and fields is not None:
+                self.set_tags(song, fields)
+                tagged.append(song)
+        self.save_songs(tagged)
+
+    def rebuild_similarity(self):
+        """Fit the similarity index to every song with features, once there are enough"""
+        if self.features is None:
+            return
+        songs = [song for song, meta in self.data.items()
+                 if "feature_row" in meta and not meta.get("missing")]
+        if len(songs) < MIN_SIMILARITY_SONGS:
+            self.similarity = None
+            return
+        from features import SimilarityIndex
+        matrix = self.features.load()
+        rows = [self.data[song]["feature_row"] for song in songs]
+        self.similarity = SimilarityIndex(songs, matrix[rows])
+
+    # Scoring and selection
+
+    def get_scores(self, now=None):
+        return self.score_engine.scores(now)
+
+    def clamp_weight(self, weight):
+        return min(max(weight, self.score_engine.min_weight), self.score_engine.max_weight)
+
+    def reset_vote_weights(self):
+        for song in self.data:
+            self.data[song]["vote_weight"] = 1.0
+        self.save_data(self.data)
+
+    def vote(self, song, multiplier, now=None):
+        """Scale a song's vote weight; returns the new weight"""
+        weight = self.clamp_weight(self.data[song]["vote_weight"] * multiplier)
+        self.record({"type": "vote", "song": song, "weight": weight}, now)
+        return weight
+
+    def pick_song(self, now=None):
+        self.sampler.repeat_limit = self.repeat_limit
+        self.picked_from_queue = False
+        self.pick_marked = True
+        while self.queue:
+            song = self.queue.popleft()
+            if song in self.data and not self.data[song].get("missing"):
+                self.picked_from_queue = True
+                self.pick_marked = self.sampler.mark_recent(song)
+                return song
+        if self.playlist is not None:
+            return self.scheduler.pick(now, within=self.playlist_songs(self.playlist, now))
+        near = None
+        if (self.similarity is not None and self.previous_song in self.similarity
+                and self.sampler.rng.random() < self.similarity_blend):
+            near = self.similarity.neighbours(self.previous_song, NEIGHBOURS)
+        return self.scheduler.pick(now, near)
+
+    # Queue and playlists
+
+    def get_tag_index(self):
+        """Built the first time a playlist needs it, then kept up to date as songs change"""
+        if self.tag_index is None:
+            self.tag_index = TagIndex(self.data, [song for song, meta in self.data.items()
+                                                  if not meta.get("missing")])
+            if self.playlist is not None:
+                self.playlist.members = None
+                self.tag_index.track(self.playlist)
+        return self.tag_index
+
+    def index_tags(self, songs):
+        """Bring the tag index, if there is one, up to date with songs' entries"""
+        if self.tag_index is None:
+            return
+        for song in songs:
+            if song in self.data and not self.data[song].get("missing"):
+                self.tag_index.update(song)
+            else:
+                self.tag_index.remove(song)
+
+    def playlist_songs(self, playlist, now=None):
+        return self.get_tag_index().members(playlist, now)
+
+    def set_playlist(self, playlist):
+        """Keep picks to a Playlist's songs from now on, or to the whole library with None"""
+        if self.playlist is not None and self.tag_index is not None:
+            self.tag_index.untrack(self.playlist)
+        self.playlist = playlist
+        if playlist is not None:
+            playlist.members = None
+            self.get_tag_index().track(playlist)
+
+    def enqueue(self, songs):
+        """Queue songs to play before any picked ones, in order; returns those queued"""
+        queued = [song for song in songs if song in self.data and not self.data[song].get("missing")]
+        self.queue.extend(queued)
+        return queued
+
+    def enqueue_playlist(self, playlist, count, now=None):
+        """Queue up to count of a Playlist's songs, picked by score; returns those queued"""
+        members = self.playlist_songs(playlist, now)
+        picked = []
+        chosen = set()
+        for _ in range(min(count, len(members))):
+            song = self.scheduler.pick(now, within=members)
+            if song is None or song in chosen:
+                break
+            picked.append(song)
+            chosen.add(song)
+        self.queue.extend(picked)
+        return picked
+
+    def requeue(self, song):
+        """Put a song taken from the queue back at its front"""
+        self.queue.appendleft(song)
+
+    def take_back(self, song, from_queue, marked):
+        """
+        Undo a pick that won't be played, given the picked_from_queue and
+        pick_marked it left: a queued song goes back to the front of the
+        queue, and the song leaves the repeat history if the pick put it there
+        """
+        if from_queue:
+            self.requeue(song)
+        if marked:
+            self.sampler.unmark_recent(song)
+
+    def pick_playable_song(self, now=None, on_missing=None):
+        """
+        Pick a song whose file still exists. Missing ones met on the way are
+        set aside and dropped together once a playable song is found.
+        on_missing(song) is called for each one.
+        """
+        missing = []
+        song = self.pick_song(now)
+        while song is not None and not os.path.exists(self.data[song]["path"]):
+            if on_missing:
+                on_missing(song)
+            missing.append(song)
+            self.scheduler.remove([song])
+            song = self.pick_song(now)
+        if missing:
+            self.drop_missing(missing)
+        return song
+
+    def is_playable(self, song):
+        """True if song is still in the library and its file is on disk"""
+        return song in self.data and os.path.exists(self.data[song]["path"])
+
+    def mark_played(self, song, now=None):
+        now = now if now is not None else datetime.datetime.now()
+        self.previous_song = song
+        self.record({"type": "play", "song": song, "at": now.isoformat()}, now)
+
+    def finish_song(self, song, position_ms, duration_ms, now=None):
+        """
+        Record how far a track got before it ended or was skipped. Nothing is
+        recorded if its length is unknown (VLC reports 0 for some files).
+        """
+        if song not in self.data or duration_ms <= 0:
+            return
+        now = now if now is not None else datetime.datetime.now()
+        self.record({"type": "finish", "song": song, "at": now.isoformat(),
+                     "position": int(position_ms), "duration": int(duration_ms)}, now)
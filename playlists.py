@@ -0,0 +1,303 @@
+import os
+import math
+import bisect
+import datetime
+from scanner import path_key
+from score_engine import to_epoch, iso_to_epoch
+
+DAY = 86400.0
+# What TagIndex keeps for each song, in this order. folder is the path_key of
+# the song's directory; last_played is in epoch seconds
+INDEX_FIELDS = ("artist", "album", "folder", "year", "duration", "weight", "last_played")
+POSITIONS = {field: i for i, field in enumerate(INDEX_FIELDS)}
+TEXT_FIELDS = frozenset(("artist", "album"))
+# Width of the buckets each number field is indexed in; a range reads the
+# buckets it overlaps, and only songs in the two at its ends need checking
+BUCKET_WIDTHS = {"year": 1, "duration": 30.0, "weight": 0.05, "last_played": DAY}
+WIDTHS = tuple(BUCKET_WIDTHS.get(field) for field in INDEX_FIELDS)
+RANGE_RULES = ("year", "duration", "weight")
+
+
+def _range(name, value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return (float(value), float(value))
+    if (isinstance(value, (list, tuple)) and len(value) == 2
+            and all(v is None or isinstance(v, (int, float)) and not isinstance(v, bool)
+                    for v in value)):
+        low, high = (None if v is None else float(v) for v in value)
+        if low is not None and high is not None and low > high:
+            raise ValueError(f"'{name}' goes from {low} down to {high}")
+        return (low, high)
+    raise ValueError(f"'{name}' must be a number or a [low, high] pair")
+
+
+def _names(name, value):
+    values = [value] if isinstance(value, str) else value
+    if not isinstance(values, (list, tuple)) or not values or not all(isinstance(v, str) for v in values):
+        raise ValueError(f"'{name}' must be a name or a list of names")
+    return values
+
+
+def parse_rules(rules):
+    """
+    Check a playlist's rules and return them in the form TagIndex reads.
+    rules is a dict, as sent to the control server or kept in playlists.json:
+
+        artist, album      a name or a list of names, matched whole, ignoring case
+        folder             a folder or a list of them; songs anywhere under one match
+        year, duration,    a number, or [low, high] with either end null for no
+        weight               limit; duration is in seconds, weight the vote weight
+        not_played_since   a number of days, or an ISO date; counted in whole days
+
+    A song has to match every rule, and any one of a rule's names or folders.
+    Raises ValueError for anything else.
+    """
+    if not isinstance(rules, dict):
+        raise ValueError("rules must be an object")
+    parsed = {}
+    for name, value in rules.items():
+        if name in TEXT_FIELDS:
+            parsed[name] = frozenset(v.strip().casefold() for v in _names(name, value))
+        elif name == "folder":
+            parsed[name] = tuple(sorted({path_key(v) for v in _names(name, value)}))
+        elif name in RANGE_RULES:
+            parsed[name] = _range(name, value)
+        elif name == "not_played_since":
+            if isinstance(value, (int, float)) and not isinstance(value, bool) and value >= 0:
+                parsed[name] = ("days", float(value))
+            elif isinstance(value, str):
+                try:
+                    parsed[name] = ("at", iso_to_epoch(value))
+                except ValueError:
+                    raise ValueError(f"'{name}' must be a number of days or an ISO date") from None
+            else:
+                raise ValueError(f"'{name}' must be a number of days or an ISO date")
+        else:
+            raise ValueError(f"unknown rule {name!r}")
+    return parsed
+
+
+def conditions(rules, now=None):
+    """
+    Parsed rules as (field, spec) conditions on TagIndex's fields at time now.
+    A relative not_played_since turns into the start of that day, so the
+    conditions, and any members worked out from them, last the day.
+    """
+    found = []
+    for name, spec in sorted(rules.items()):
+        if name == "folder":
+            found.append((name, tuple((key, key.rstrip(os.sep) + os.sep) for key in spec)))
+        elif name == "not_played_since":
+            kind, value = spec
+            if kind == "days":
+                now = now if now is not None else datetime.datetime.now()
+                value = math.floor((to_epoch(now) - value * DAY) / DAY) * DAY
+            found.append(("last_played", (None, value, True)))
+        elif name in TEXT_FIELDS:
+            found.append((name, spec))
+        else:
+            found.append((name, spec + (False,)))
+    return tuple(found)
+
+
+def matches(condition, values):
+    """True if a song with TagIndex values meets condition"""
+    field, spec = condition
+    value = values[POSITIONS[field]]
+    if value is None:
+        return False
+    if field in TEXT_FIELDS:
+        return value in spec
+    if field == "folder":
+        return any(value == key or value.startswith(prefix) for key, prefix in spec)
+    low, high, open_high = spec
+    if low is not None and value < low:
+        return False
+    return high is None or (value < high if open_high else value <= high)
+
+
+class Playlist:
+    """
+    A smart playlist: its rules and, once a TagIndex has worked them out, its
+    songs. While the index tracks it, members is kept up to date as songs
+    change, so picking from it costs nothing more per pick than the pick.
+    """
+
+    def __init__(self, rules, name=None):
+        self.rules = parse_rules(rules)
+        self.name = name
+        self.conditions = None
+        self.members = None
+
+    def test(self, values):
+        return all(matches(condition, values) for condition in self.conditions)
+
+
+class TagIndex:
+    """
+    Songs grouped by each field a playlist rule can test: by name for artist
+    and album, by directory for folder, and into BUCKET_WIDTHS buckets for
+    numbers. Rules are evaluated from the smallest set of groups any of them
+    selects, checking only those songs against the rest, so the cost follows
+    the songs that could match rather than the library.
+
+    Built from the tags and history already in the library (see tags.py);
+    the owning core calls update() and remove() as entries change.
+    """
+
+    def __init__(self, data, songs=()):
+        self.data = data
+        self.values = {}
+        self.groups = {field: {} for field in INDEX_FIELDS}
+        self.folders = None
+        # Each number field's bucket keys in order, kept as groups come and go
+        self.buckets = {field: [] for field in BUCKET_WIDTHS}
+        # path_key of each directory seen, since many songs share one
+        self.folder_keys = {}
+        self.tracked = []
+        for song in songs:
+            self._insert(song)
+
+    def __len__(self):
+        return len(self.values)
+
+    def _field(self, song, field):
+        try:
+            return self.data.get_field(song, field)
+        except KeyError:
+            return None
+
+    def song_values(self, song):
+        field = self._field
+        artist, album = field(song, "artist"), field(song, "album")
+        directory = os.path.dirname(self.data.get_field(song, "path"))
+        folder = self.folder_keys.get(directory)
+        if folder is None:
+            folder = self.folder_keys[directory] = path_key(directory)
+        return (artist.casefold() if artist else None, album.casefold() if album else None, folder,
+                field(song, "year"), field(song, "duration"), field(song, "vote_weight"),
+                self.data.last_played_epoch(song))
+
+    def _group_keys(self, values):
+        return [(field, value if width is None else math.floor(value / width))
+                for field, width, value in zip(INDEX_FIELDS, WIDTHS, values) if value is not None]
+
+    def _insert(self, song):
+        values = self.song_values(song)
+        self.values[song] = values
+        for field, key in self._group_keys(values):
+            groups = self.groups[field]
+            group = groups.get(key)
+            if group is None:
+                group = groups[key] = set()
+                if field == "folder":
+                    self.folders = None
+                elif field in self.buckets:
+                    bisect.insort(self.buckets[field], key)
+            group.add(song)
+        return values
+
+    def _discard(self, song):
+        values = self.values.pop(song, None)
+        if values is None:
+            return False
+        for field, key in self._group_keys(values):
+            groups = self.groups[field]
+            group = groups[key]
+            group.discard(song)
+            if not group:
+                del groups[key]
+                if field == "folder":
+                    self.folders = None
+                elif field in self.buckets:
+                    keys = self.buckets[field]
+                    del keys[bisect.bisect_left(keys, key)]
+        return True
+
+    def update(self, song):
+        """A song was added or its entry changed"""
+        old = self.values.get(song)
+        if old is not None and old == self.song_values(song):
+            return
+        self._discard(song)
+        values = self._insert(song)
+        for playlist in self.tracked:
+            if playlist.members is not None:
+                if playlist.test(values):
+                    playlist.members.add(song)
+                else:
+                    playlist.members.discard(song)
+
+    def remove(self, song):
+        """A song left the library or went missing"""
+        if self._discard(song):
+            for playlist in self.tracked:
+                if playlist.members is not None:
+                    playlist.members.discard(song)
+
+    def track(self, playlist):
+        """Keep playlist's members up to date from now on"""
+        if playlist not in self.tracked:
+            self.tracked.append(playlist)
+
+    def untrack(self, playlist):
+        if playlist in self.tracked:
+            self.tracked.remove(playlist)
+
+    def candidates(self, condition):
+        """The groups holding every song that could meet condition"""
+        field, spec = condition
+        groups = self.groups[field]
+        if field in TEXT_FIELDS:
+            return [groups[name] for name in spec if name in groups]
+        if field == "folder":
+            if self.folders is None:
+                self.folders = sorted(groups)
+            found = []
+            for key, prefix in spec:
+                if key in groups and key != prefix:
+                    found.append(groups[key])
+                # Every directory under prefix sorts between it and prefix with the separator bumped
+                start = bisect.bisect_left(self.folders, prefix)
+                end = bisect.bisect_left(self.folders, prefix[:-1] + chr(ord(os.sep) + 1))
+                found.extend(groups[directory] for directory in self.folders[start:end])
+            return found
+        low, high, _ = spec
+        width = BUCKET_WIDTHS[field]
+        keys = self.buckets[field]
+        start = 0 if low is None else bisect.bisect_left(keys, math.floor(low / width))
+        end = len(keys) if high is None else bisect.bisect_right(keys, math.floor(high / width))
+        return [groups[key] for key in keys[start:end]]
+
+    def evaluate(self, found):
+        """Songs meeting every condition in found (see conditions())"""
+        if not found:
+            return set(self.values)
+        smallest = min((self.candidates(condition) for condition in found),
+                       key=lambda groups: sum(map(len, groups)))
+        values = self.values
+        return {song for group in smallest for song in group
+                if all(matches(condition, values[song]) for condition in found)}
+
+    def members(self, playlist, now=None):
+        """playlist's songs at time now, worked out again only when its conditions change"""
+        found = conditions(playlist.rules, now)
+        if playlist.members is None or found != playlist.conditions:
+            playlist.conditions = found
+            playlist.members = self.evaluate(found)
+        return playlist.members
+
+
+def playlist_param(params, saved=None):
+    """
+    The Playlist a control request names, as inline 'rules' or the name of a
+    saved 'playlist', or None if it names neither
+    """
+    if "rules" in params:
+        return Playlist(params["rules"], params.get("name"))
+    name = params.get("playlist")
+    if name is None:
+        return None
+    if not saved or name not in saved:
+        raise ValueError(f"no playlist named {name!r}")
+    return Playlist(saved[name], name)
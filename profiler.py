@@ -0,0 +1,71 @@
+import os
+import sys
+import time
+import threading
+from collections import Counter
+
+# Seconds between samples
+INTERVAL = 0.01
+
+
+class SamplingProfiler:
+    """
+    Samples the Python stacks of every other thread from a thread of its
+    own, every interval seconds, and counts how often each stack is seen.
+    save() writes them in the folded format flamegraph.pl, inferno and
+    speedscope read: one "thread;outer;...;inner count" line per stack.
+
+    Nothing is traced, so the profiled code runs at full speed; the cost is
+    this thread waking up every interval.
+    """
+
+    def __init__(self, interval=INTERVAL):
+        self.interval = interval
+        self.stacks = Counter()
+        self.labels = {}
+        self.samples = 0
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self.thread.start()
+        return self
+
+    def _run(self):
+        own = threading.get_ident()
+        while self.running:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                codes = []
+                while frame is not None:
+                    codes.append(frame.f_code)
+                    frame = frame.f_back
+                self.stacks[(names.get(ident, str(ident)),) + tuple(reversed(codes))] += 1
+            self.samples += 1
+            time.sleep(self.interval)
+
+    def _label(self, code):
+        label = self.labels.get(code)
+        if label is None:
+            label = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+            self.labels[code] = label
+        return label
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+
+    def folded(self):
+        lines = []
+        for (thread, *codes), count in self.stacks.most_common():
+            lines.append(";".join([thread] + [self._label(code) for code in codes]) + f" {count}")
+        return "\n".join(lines) + "\n"
+
+    def save(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self.folded())
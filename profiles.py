@@ -0,0 +1,303 @@
+from collections.abc import Mapping, MutableMapping
+from library_store import LibraryStore
+from player_core import PlayerCore
+from track_table import TrackTable, TrackView, _to_epoch
+
+# Entry fields that belong to a listener rather than to the song: each profile
+# keeps its own, everything else is read from the shared catalogue
+PROFILE_FIELDS = frozenset(("last_played", "vote_weight", "completions", "skips", "seq"))
+# What a profile reads for a song it has never played or voted on
+PROFILE_DEFAULTS = {"last_played": "2000-01-01", "vote_weight": 1.0}
+DEFAULT_EPOCH = _to_epoch(PROFILE_DEFAULTS["last_played"])
+
+
+class ProfileTable(MutableMapping):
+    """
+    One profile's library: every song in the catalogue (a TrackTable shared
+    with the host core), with the profile's own PROFILE_FIELDS laid over it.
+    Only songs the profile has played or voted on take a row of their own;
+    the rest read PROFILE_DEFAULTS.
+
+    The songs themselves belong to the catalogue. Assigning an entry only
+    takes its profile fields, and deleting one forgets them.
+    """
+
+    def __init__(self, catalogue, entries=()):
+        self.catalogue = catalogue
+        self.own = TrackTable()
+        items = entries.items() if isinstance(entries, Mapping) else entries
+        for key, meta in items:
+            if key in catalogue:
+                self[key] = meta
+
+    # Fields
+
+    def get_field(self, key, field):
+        if field not in PROFILE_FIELDS:
+            return self.catalogue.get_field(key, field)
+        if key in self.own:
+            try:
+                return self.own.get_field(key, field)
+            except KeyError:
+                pass
+        if field in PROFILE_DEFAULTS:
+            return PROFILE_DEFAULTS[field]
+        raise KeyError(field)
+
+    def last_played_epoch(self, key):
+        epoch = self.own.last_played_epoch(key) if key in self.own else None
+        return epoch if epoch is not None else DEFAULT_EPOCH
+
+    def set_field(self, key, field, value):
+        if field not in PROFILE_FIELDS:
+            self.catalogue.set_field(key, field, value)
+            return
+        if key not in self.own:
+            self.own[key] = {}
+        self.own.set_field(key, field, value)
+
+    def delete_field(self, key, field):
+        if field not in PROFILE_FIELDS:
+            self.catalogue.delete_field(key, field)
+        elif key in self.own:
+            self.own.delete_field(key, field)
+        else:
+            raise KeyError(field)
+
+    def fields(self, key):
+        for field in self.catalogue.fields(key):
+            if field not in PROFILE_FIELDS:
+                yield field
+        own = set(self.own.fields(key)) if key in self.own else set()
+        yield from own
+        for field in PROFILE_DEFAULTS:
+            if field not in own:
+                yield field
+
+    # Mapping
+
+    def __getitem__(self, key):
+        if key not in self.catalogue:
+            raise KeyError(key)
+        return TrackView(self, key)
+
+    def __setitem__(self, key, meta):
+        if key not in self.catalogue:
+            raise KeyError(key)
+        self.own[key] = {field: value for field, value in meta.items() if field in PROFILE_FIELDS}
+
+    def __delitem__(self, key):
+        if key in self.own:
+            del self.own[key]
+        elif key not in self.catalogue:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in self.catalogue
+
+    def __iter__(self):
+        return iter(self.catalogue)
+
+    def __len__(self):
+        return len(self.catalogue)
+
+
+class ProfileStore(LibraryStore):
+    """
+    Wraps a profile's store so it only holds the profile's fields, plus each
+    song's path to keep entries readable (the SQLite store requires one)
+    """
+
+    def __init__(self, store):
+        self.store = store
+
+    def _own(self, meta):
+        return {field: meta[field] for field in ("path", *PROFILE_FIELDS) if field in meta}
+
+    def load(self):
+        return self.store.load()
+
+    def save_all(self, data):
+        self.store.save_all({key: self._own(meta) for key, meta in data.items()})
+
+    def update_song(self, key, meta):
+        self.store.update_song(key, self._own(meta))
+
+    def update_songs(self, items):
+        self.store.update_songs([(key, self._own(meta)) for key, meta in items])
+
+    def delete_songs(self, keys):
+        self.store.delete_songs(keys)
+
+    def flush(self):
+        self.store.flush()
+
+    def close(self):
+        self.store.close()
+
+
+class ProfileCore(PlayerCore):
+    """
+    Another listener on a host PlayerCore's library: its own vote weights,
+    play and skip history, repeat history and picks, over the host's
+    catalogue, path and audio indexes, search index and acoustic features.
+    Each profile costs its scoring state and the songs it has played, not
+    another copy of the library. Its queue, playlist and tag index are its
+    own too, since playlists can test its weights and history.
+
+    Library changes (songs added, moved, removed or analysed) are made on the
+    host, whichever core they are asked of, and the host passes them on to
+    every profile through sync_songs and forget_songs. Like the host, a
+    profile is only used from the thread that owns the host.
+
+    store and journal hold the profile's fields alone; songs they mention
+    that the host no longer has are dropped on open.
+    """
+
+    def __init__(self, host, store, schedule=None, staleness=0.01, repeat_limit=150, rng=None,
+                 flush_delay=2000, journal=None):
+        self.host = host
+        super().__init__(ProfileStore(store), schedule, staleness, repeat_limit, rng, flush_delay,
+                         journal, similarity_blend=host.similarity_blend)
+        host.followers.append(self)
+
+    def open_library(self, entries, features):
+        stale = [key for key in entries if key not in self.host.data]
+        if stale:
+            self.store.delete_songs(stale)
+            self.store.flush()
+        self.data = ProfileTable(self.host.data, entries)
+
+    def index_library(self):
+        pass
+
+    # Shared with the host
+
+    @property
+    def features(self):
+        return self.host.features
+
+    @property
+    def similarity(self):
+        return self.host.similarity
+
+    @property
+    def path_index(self):
+        return self.host.path_index
+
+    @property
+    def audio_index(self):
+        return self.host.audio_index
+
+    @property
+    def search_index(self):
+        return self.host.search_index
+
+    def close(self):
+        if self in self.host.followers:
+            self.host.followers.remove(self)
+        if self.journal is not None:
+            self.compact()
+            self.journal.close()
+        self.store.close()
+
+    def reset_vote_weights(self):
+        for song in self.data.own:
+            self.data.own.set_field(song, "vote_weight", 1.0)
+        self.save_data({song: self.data[song] for song in self.data.own})
+
+    # Library changes made on the host
+
+    def sync_songs(self, songs, now=None):
+        """Songs the host added or changed: rescore those still playable, drop the rest from rotation"""
+        playable, gone = [], []
+        for song in songs:
+            if song in self.data and not self.data[song].get("missing"):
+                playable.append(song)
+            else:
+                gone.append(song)
+        for song in playable:
+            self.score_engine.update(song, self.data[song])
+        self.scheduler.touch(playable, now)
+        for song in gone:
+            self.score_engine.remove(song)
+        self.scheduler.remove(gone)
+        self.index_tags(songs)
+
+    def forget_songs(self, songs):
+        """Songs the host removed from the library"""
+        for song in songs:
+            self.score_engine.remove(song)
+            if self.tag_index is not None:
+                self.tag_index.remove(song)
+        self.scheduler.remove(songs)
+        known = [song for song in songs if song in self.data.own]
+        if not known:
+            return
+        for song in known:
+            del self.data.own[song]
+        if self.journal is not None:
+            for song in known:
+                self.journal.append({"type": "remove", "song": song})
+            self.dirty.update(known)
+        else:
+            self.store.delete_songs(known)
+        self.schedule_flush()
+
+    def new_song_entry(self, path, mtime=None, size=None, audio_id=None):
+        return self.host.new_song_entry(path, mtime, size, audio_id)
+
+    def get_search_index(self):
+        return self.host.get_search_index()
+
+    def find_moved_song(self, audio_id):
+        return self.host.find_moved_song(audio_id)
+
+    def set_audio_id(self, song, audio_id):
+        self.host.set_audio_id(song, audio_id)
+
+    def new_files(self, paths):
+        return self.host.new_files(paths)
+
+    def add_files(self, paths, found=None):
+        return self.host.add_files(paths, found)
+
+    def delete_song_data(self, songs):
+        self.host.delete_song_data(songs)
+
+    def mark_missing(self, songs):
+        self.host.mark_missing(songs)
+
+    def drop_missing(self, songs):
+        self.host.drop_missing(songs)
+
+    def paths_snapshot(self, paths):
+        return self.host.paths_snapshot(paths)
+
+    def apply_folder_scan(self, result, hashes, tags=None):
+        return self.host.apply_folder_scan(result, hashes, tags)
+
+    def duplicate_entries(self):
+        return self.host.duplicate_entries()
+
+    def backfill_audio_ids(self, entries):
+        self.host.backfill_audio_ids(entries)
+
+    def songs_needing_analysis(self):
+        return self.host.songs_needing_analysis()
+
+    def apply_analysis(self, song, fields):
+        self.host.apply_analysis(song, fields)
+
+    def set_tags(self, song, fields):
+        self.host.set_tags(song, fields)
+
+    def songs_needing_tags(self):
+        return self.host.songs_needing_tags()
+
+    def apply_tags(self, items):
+        self.host.apply_tags(items)
+
+    def rebuild_similarity(self):
+        # The host's index is shared, and the host keeps it up to date
+        pass
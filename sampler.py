@@ -0,0 +1,272 @@
+import random
+from collections import deque
+import numpy as np
+
+# A set of songs holding at least 1 / REJECTION_SHARE of the library is picked
+# from by drawing from the whole tree until a member comes up
+REJECTION_SHARE = 8
+REJECTION_TRIES = 32
+
+
+def build_fenwick(values):
+    """1-based Fenwick tree over values, built in one vectorized pass"""
+    prefix = np.zeros(len(values) + 1)
+    np.cumsum(values, out=prefix[1:])
+    idx = np.arange(1, len(values) + 1)
+    tree = np.zeros(len(values) + 1)
+    tree[1:] = prefix[idx] - prefix[idx - (idx & -idx)]
+    return tree.tolist()
+
+
+class WeightedSampler:
+    """
+    Weighted random song picker backed by a Fenwick tree.
+    Recently picked songs have their weight zeroed in the tree and restored once
+    they fall out of the history, so picks and updates are O(log n).
+    """
+
+    def __init__(self, repeat_limit=150, rng=None):
+        self.repeat_limit = repeat_limit
+        self.rng = rng if rng is not None else random.Random()
+        self.keys = []
+        self.index = {}
+        self.weights = []     # base weight per row
+        self.values = [0.0]   # weight currently in the tree (0 while recent), 1-based
+        self.tree = [0.0]
+        self.capacity = 0
+        self.updates_since_build = 0
+        self.recent = deque()
+        self.recent_counts = {}
+
+    def __len__(self):
+        return len(self.keys)
+
+    def rebuild(self, keys, weights):
+        """Replace every weight at once. keys and weights must be in the same order."""
+        if keys != self.keys:
+            self.keys = list(keys)
+            self.index = {key: i for i, key in enumerate(self.keys)}
+            for key in [k for k in self.recent_counts if k not in self.index]:
+                del self.recent_counts[key]
+                self.recent = deque(k for k in self.recent if k != key)
+        self.weights = np.asarray(weights, dtype=np.float64).tolist()
+        self._build_tree(len(self.keys))
+
+    def _build_tree(self, capacity):
+        values = np.zeros(capacity)
+        values[:len(self.weights)] = self.weights
+        for key in self.recent_counts:
+            values[self.index[key]] = 0.0
+        self.values = [0.0] + values.tolist()
+        self.tree = build_fenwick(values)
+        self.capacity = capacity
+        self.updates_since_build = 0
+
+    def _add(self, pos, delta):
+        tree = self.tree
+        while pos <= self.capacity:
+            tree[pos] += delta
+            pos += pos & -pos
+
+    def _set_value(self, row, value):
+        pos = row + 1
+        delta = value - self.values[pos]
+        if delta:
+            self.values[pos] = value
+            self._add(pos, delta)
+            self.updates_since_build += 1
+
+    def _find(self, r):
+        """Row whose cumulative weight range contains r (0 < r <= total)"""
+        pos = 0
+        step = 1 << self.capacity.bit_length()
+        tree = self.tree
+        while step:
+            nxt = pos + step
+            if nxt <= self.capacity and tree[nxt] < r:
+                pos = nxt
+                r -= tree[nxt]
+            step >>= 1
+        return min(pos, len(self.keys) - 1)
+
+    def total(self):
+        pos, total = self.capacity, 0.0
+        while pos:
+            total += self.tree[pos]
+            pos -= pos & -pos
+        return total
+
+    def update(self, key, weight):
+        """Set a song's weight, adding it if it's new"""
+        row = self.index.get(key)
+        if row is None:
+            row = len(self.keys)
+            self.keys.append(key)
+            self.index[key] = row
+            self.weights.append(weight)
+            if row >= self.capacity:
+                self._build_tree(max(16, 2 * self.capacity))
+                return
+        else:
+            self.weights[row] = weight
+        self._set_value(row, 0.0 if key in self.recent_counts else weight)
+
+    def update_many(self, keys, weights):
+        """
+        update() for many songs at once. Once they are a large enough share
+        of the library, setting the weights and rebuilding the tree in one
+        vectorized pass beats a tree update per song.
+        """
+        if len(keys) * self.capacity.bit_length() >= self.capacity:
+            try:
+                rows = np.fromiter((self.index[key] for key in keys), dtype=np.intp, count=len(keys))
+            except KeyError:
+                # New songs need rows of their own first
+                rows = None
+            if rows is not None:
+                all_weights = np.array(self.weights)
+                all_weights[rows] = weights
+                self.weights = all_weights.tolist()
+                self._build_tree(self.capacity)
+                return
+        for key, weight in zip(keys, np.asarray(weights).tolist()):
+            self.update(key, weight)
+
+    def remove(self, key):
+        row = self.index.pop(key, None)
+        if row is None:
+            return
+        if key in self.recent_counts:
+            del self.recent_counts[key]
+            self.recent = deque(k for k in self.recent if k != key)
+        last = len(self.keys) - 1
+        if row != last:
+            moved = self.keys[last]
+            self.keys[row] = moved
+            self.index[moved] = row
+            self.weights[row] = self.weights[last]
+            self._set_value(row, self.values[last + 1])
+        self._set_value(last, 0.0)
+        self.keys.pop()
+        self.weights.pop()
+
+    def _push_recent(self, song):
+        if song not in self.recent_counts:
+            self.recent_counts[song] = 0
+            self._set_value(self.index[song], 0.0)
+        self.recent_counts[song] += 1
+        self.recent.append(song)
+
+        limit = min(self.repeat_limit, len(self.keys))
+        while len(self.recent) > limit:
+            old = self.recent.popleft()
+            self.recent_counts[old] -= 1
+            if not self.recent_counts[old]:
+                del self.recent_counts[old]
+                row = self.index[old]
+                self._set_value(row, self.weights[row])
+
+    def _pick_linear(self, keys, weights):
+        total = sum(weights)
+        if total == 0:
+            return self.rng.choice(keys)
+        r = self.rng.uniform(0, total)
+        cumulative = 0
+        for song, weight in zip(keys, weights):
+            cumulative += weight
+            if r <= cumulative:
+                break
+        return song
+
+    def pick_near(self, keys, similarities):
+        """
+        Pick among keys, weighted by score times similarity, or None if none of
+        them is available. Recent songs are excluded as in pick().
+        """
+        weights = []
+        for key, similarity in zip(keys, similarities):
+            row = self.index.get(key)
+            weights.append(self.values[row + 1] * max(similarity, 0.0) if row is not None else 0.0)
+        if not sum(weights):
+            return None
+        song = self._pick_linear(keys, weights)
+        self._push_recent(song)
+        return song
+
+    def pick_within(self, members):
+        """
+        Pick among members (a set of keys) only, by weight, or None if none of
+        them is in the sampler. Recent songs are excluded as in pick() unless
+        every member is recent. A set with a good share of the library is
+        drawn from the whole tree, retrying until a member comes up; a small
+        one is weighed song by song, so the cost stays below both the set's
+        size and the library's.
+        """
+        if not members:
+            return None
+        if len(members) * REJECTION_SHARE >= len(self.keys):
+            total = self.total()
+            for _ in range(REJECTION_TRIES if total > 0 else 0):
+                song = self.keys[self._find(total * (1.0 - self.rng.random()))]
+                if song in members and song not in self.recent_counts:
+                    self._push_recent(song)
+                    return song
+        keys = [key for key in members if key in self.index]
+        if not keys:
+            return None
+        weights = [self.values[self.index[key] + 1] for key in keys]
+        if not sum(weights):
+            # Every member was played recently
+            weights = [self.weights[self.index[key]] for key in keys]
+        song = self._pick_linear(keys, weights)
+        self._push_recent(song)
+        return song
+
+    def mark_recent(self, song):
+        """
+        Put a song chosen some other way (e.g. queued) in the repeat history,
+        if it isn't there; returns True if it was put there
+        """
+        if song in self.index and song not in self.recent_counts:
+            self._push_recent(song)
+            return True
+        return False
+
+    def unmark_recent(self, song):
+        """Take a song's latest pick back out of the repeat history, for a pick that won't be played"""
+        if song not in self.recent_counts:
+            return
+        for i in range(len(self.recent) - 1, -1, -1):
+            if self.recent[i] == song:
+                del self.recent[i]
+                break
+        self.recent_counts[song] -= 1
+        if not self.recent_counts[song]:
+            del self.recent_counts[song]
+            row = self.index[song]
+            self._set_value(row, self.weights[row])
+
+    def pick(self):
+        if not self.keys:
+            return None
+
+        # Rebuild now and then so rounding from incremental updates can't pile up
+        if self.updates_since_build > max(1024, self.capacity):
+            self._build_tree(self.capacity)
+
+        if len(self.recent_counts) >= len(self.keys):
+            # Everything was played recently, fall back to the whole library
+            song = self._pick_linear(self.keys, self.weights)
+        else:
+            total = self.total()
+            song = None
+            if total > 0:
+                song = self.keys[self._find(total * (1.0 - self.rng.random()))]
+            if song is None or song in self.recent_counts:
+                available = [k for k in self.keys if k not in self.recent_counts]
+                song = self._pick_linear(
+                    available, [self.weights[self.index[k]] for k in available]
+                )
+
+        self._push_recent(song)
+        return song
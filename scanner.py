@@ -0,0 +1,106 @@
+import os
+import stat as stat_module
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+AUDIO_EXTENSIONS = (".mp3",)
+PROGRESS_EVERY = 500
+
+
+def path_key(path):
+    """Normalized form of a path for comparing library entries"""
+    return os.path.normcase(os.path.abspath(path))
+
+
+def _scan_dir(path):
+    """Audio files (path, mtime_ns, size) and subdirectories directly inside path"""
+    files, dirs = [], []
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        dirs.append(entry.path)
+                    elif entry.name.lower().endswith(AUDIO_EXTENSIONS) and entry.is_file():
+                        stat = entry.stat()
+                        files.append((entry.path, stat.st_mtime_ns, stat.st_size))
+                except OSError:
+                    continue
+    except OSError as e:
+        print(f"Failed to scan {path}: {e}")
+    return files, dirs
+
+
+def walk_audio_files(root, max_workers=8):
+    """
+    Recursively yield (path, mtime_ns, size) for every audio file under root.
+    Each directory is listed as its own task on a thread pool, so slow disks
+    and network shares are read in parallel.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        pending = {pool.submit(_scan_dir, root)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                files, dirs = future.result()
+                yield from files
+                pending |= {pool.submit(_scan_dir, d) for d in dirs}
+
+
+def scan_folder(root, known, progress=None, max_workers=8):
+    """
+    Compare the audio files under root against known, a dict of
+    path_key -> (mtime_ns, size) for the library entries under root.
+    Returns (added, changed, deleted): lists of (path, mtime_ns, size) for new
+    and modified files, and the path keys of known files that are gone.
+    progress(count) is called from this thread every PROGRESS_EVERY files.
+    """
+    added, changed = [], []
+    seen = set()
+    for count, (path, mtime, size) in enumerate(walk_audio_files(root, max_workers), 1):
+        key = path_key(path)
+        seen.add(key)
+        previous = known.get(key)
+        if previous is None:
+            added.append((path, mtime, size))
+        elif previous != (mtime, size):
+            changed.append((path, mtime, size))
+        if progress and count % PROGRESS_EVERY == 0:
+            progress(count)
+    deleted = [key for key in known if key not in seen]
+    return added, changed, deleted
+
+
+def scan_paths(paths, known, max_workers=8):
+    """
+    scan_folder for just the files and directories a watcher reported as
+    changed. known maps path_key -> (mtime_ns, size) for the library entries
+    at or under any of paths; those not found again are deleted.
+    Returns (added, changed, deleted) like scan_folder.
+    """
+    added, changed = [], []
+    seen = set()
+
+    def check(path, mtime, size):
+        key = path_key(path)
+        if key in seen:
+            return
+        seen.add(key)
+        previous = known.get(key)
+        if previous is None:
+            added.append((path, mtime, size))
+        elif previous != (mtime, size):
+            changed.append((path, mtime, size))
+
+    for path in paths:
+        if os.path.isdir(path):
+            for found in walk_audio_files(path, max_workers):
+                check(*found)
+        elif path.lower().endswith(AUDIO_EXTENSIONS):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if stat_module.S_ISREG(stat.st_mode):
+                check(path, stat.st_mtime_ns, stat.st_size)
+    deleted = [key for key in known if key not in seen]
+    return added, changed, deleted
@@ -0,0 +1,109 @@
+import datetime
+import numpy as np
+from score_engine import to_epoch
+
+# Bucket k is rescored every MIN_PERIOD * 2**k seconds
+MIN_PERIOD = 30.0
+BUCKET_COUNT = 14
+
+
+class ScoreScheduler:
+    """
+    Keeps the sampler's weights close to the exact scores without rescoring
+    the whole library on every pick.
+
+    Played, voted and added songs are rescored immediately. Every other song
+    sits in a bucket chosen from how fast its score is changing, and a bucket
+    is only rescored when its period is up. Songs that haven't been played for
+    a long time barely move, so most of the library is rescored rarely and the
+    per-pick cost stops growing with library size.
+
+    max_staleness is the largest relative error allowed between a song's
+    sampler weight and its exact score. Songs played in the last few minutes
+    change faster than MIN_PERIOD allows for, but those are excluded by the
+    repeat history anyway.
+    """
+
+    def __init__(self, engine, sampler, max_staleness=0.01):
+        self.engine = engine
+        self.sampler = sampler
+        self.max_staleness = max_staleness
+        self.buckets = [set() for _ in range(BUCKET_COUNT)]
+        self.bucket_of = {}
+        self.next_due = [0.0] * BUCKET_COUNT
+
+    def _now(self, now):
+        return now if now is not None else datetime.datetime.now()
+
+    def _bucket_rows(self, rows, now):
+        """Bucket for each row: the longest period that keeps it within max_staleness"""
+        allowed = self.max_staleness / self.engine.score_rates(rows, now) * 3600
+        buckets = np.floor(np.log2(np.maximum(allowed / MIN_PERIOD, 1.0)))
+        return np.clip(buckets, 0, BUCKET_COUNT - 1).astype(int)
+
+    def _rescore(self, keys, now):
+        """Rescore keys exactly, push the scores to the sampler and re-bucket them"""
+        if not keys:
+            return
+        rows = np.fromiter((self.engine.index[key] for key in keys),
+                           dtype=np.intp, count=len(keys))
+        scores = self.engine.score_rows(rows, now)
+        buckets = self._bucket_rows(rows, now)
+
+        self.sampler.update_many(keys, scores)
+        for key, bucket in zip(keys, buckets.tolist()):
+            old = self.bucket_of.get(key)
+            if old != bucket:
+                if old is not None:
+                    self.buckets[old].discard(key)
+                self.buckets[bucket].add(key)
+                self.bucket_of[key] = bucket
+
+    def rebuild(self, now=None):
+        """Rescore everything, e.g. after the library was replaced"""
+        now = self._now(now)
+        keys = self.engine.keys
+        rows = slice(0, len(keys))
+        self.sampler.rebuild(keys, self.engine.score_rows(rows, now))
+
+        self.bucket_of = dict(zip(keys, self._bucket_rows(rows, now).tolist()))
+        self.buckets = [set() for _ in range(BUCKET_COUNT)]
+        for key, bucket in self.bucket_of.items():
+            self.buckets[bucket].add(key)
+
+        start = to_epoch(now)
+        self.next_due = [start + MIN_PERIOD * 2 ** k for k in range(BUCKET_COUNT)]
+
+    def touch(self, songs, now=None):
+        """Songs whose entry changed (played, voted or newly added)"""
+        self._rescore(list(songs), self._now(now))
+
+    def remove(self, songs):
+        for song in songs:
+            bucket = self.bucket_of.pop(song, None)
+            if bucket is not None:
+                self.buckets[bucket].discard(song)
+            self.sampler.remove(song)
+
+    def refresh(self, now=None):
+        """Rescore the buckets whose period is up"""
+        now = self._now(now)
+        t = to_epoch(now)
+        for k in range(BUCKET_COUNT):
+            if t >= self.next_due[k]:
+                self._rescore(list(self.buckets[k]), now)
+                self.next_due[k] = t + MIN_PERIOD * 2 ** k
+
+    def pick(self, now=None, near=None, within=None):
+        """
+        near is an optional (keys, similarities) pair to pick from first;
+        within, a set of songs to keep the pick to
+        """
+        self.refresh(now)
+        if within is not None:
+            return self.sampler.pick_within(within)
+        if near is not None:
+            song = self.sampler.pick_near(*near)
+            if song is not None:
+                return song
+        return self.sampler.pick()
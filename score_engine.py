@@ -0,0 +1,163 @@
+import math
+import datetime
+import numpy as np
+
+HALF_LIFE_HOURS = 100
+MIN_WEIGHT = 0.5
+MAX_WEIGHT = 2.0
+# How far listening habits can move a song's weight: from 1 - LISTEN_STRENGTH for a
+# song that is always skipped straight away to 1 + LISTEN_STRENGTH for one always
+# played through
+LISTEN_STRENGTH = 0.3
+# Plays it takes before the listening weight gets halfway to its limit
+LISTEN_PRIOR = 3.0
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+# How a song's score grows with the hours since it was last played, and a
+# bound on that score's relative change per hour (see ScoreEngine.score_rates).
+# Hours are at least 0.1 by then.
+TIME_SCORES = {
+    "log1p": (np.log1p, lambda hours: 1.0 / ((1.0 + hours) * np.log1p(hours))),
+    "sqrt": (np.sqrt, lambda hours: 0.5 / hours),
+    "linear": (lambda hours: hours, lambda hours: 1.0 / hours),
+}
+
+
+def to_epoch(dt):
+    """
+    Seconds since 1970 for a naive datetime, ignoring the local UTC offset.
+    This keeps hour deltas identical to subtracting naive datetimes, which is
+    what the scoring formula has always done (no DST jumps).
+    """
+    return (dt - EPOCH).total_seconds()
+
+
+def iso_to_epoch(value):
+    return to_epoch(datetime.datetime.fromisoformat(value))
+
+
+def last_played_epoch(meta):
+    """Epoch seconds of a song's last play, read straight from a Track without a round trip"""
+    epoch = getattr(meta, "last_played_epoch", None)
+    return epoch if epoch is not None else iso_to_epoch(meta["last_played"])
+
+
+def listen_weight(meta):
+    """
+    Weight multiplier from how much of a song tends to get played.
+    completions and skips are the played and unplayed shares of each play,
+    summed over the song's history.
+    """
+    completions = meta.get("completions", 0)
+    skips = meta.get("skips", 0)
+    ratio = (completions - skips) / (completions + skips + LISTEN_PRIOR)
+    return 1.0 + LISTEN_STRENGTH * ratio
+
+
+def song_weight(meta):
+    """The weight that scoring drifts toward one: votes combined with listening habits"""
+    return meta["vote_weight"] * listen_weight(meta)
+
+
+class ScoreEngine:
+    """
+    Columnar copy of the library for scoring every song in one NumPy pass.
+    Holds last_played as epoch floats and weights (votes combined with skip
+    history, see song_weight) in parallel arrays; rows are removed by
+    swapping in the last row so updates stay O(1).
+    """
+
+    def __init__(self, half_life_hours=HALF_LIFE_HOURS,
+                 min_weight=MIN_WEIGHT, max_weight=MAX_WEIGHT, time_score="log1p"):
+        self.half_life_hours = half_life_hours
+        self.min_weight = min_weight
+        self.max_weight = max_weight
+        self.time_score, self.time_rate = TIME_SCORES[time_score]
+        self.keys = []
+        self.index = {}
+        self.last_played = np.zeros(0)
+        self.weights = np.zeros(0)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def rebuild(self, data):
+        self.keys = list(data)
+        self.index = {key: i for i, key in enumerate(self.keys)}
+        self.last_played = np.fromiter(
+            (last_played_epoch(meta) for meta in data.values()),
+            dtype=np.float64, count=len(self.keys)
+        )
+        self.weights = np.fromiter(
+            (song_weight(meta) for meta in data.values()),
+            dtype=np.float64, count=len(self.keys)
+        )
+
+    def _grow(self):
+        capacity = max(16, len(self.last_played) * 2)
+        self.last_played = np.resize(self.last_played, capacity)
+        self.weights = np.resize(self.weights, capacity)
+
+    def update(self, key, meta):
+        i = self.index.get(key)
+        if i is None:
+            i = len(self.keys)
+            if i >= len(self.last_played):
+                self._grow()
+            self.keys.append(key)
+            self.index[key] = i
+        self.last_played[i] = last_played_epoch(meta)
+        self.weights[i] = song_weight(meta)
+
+    def remove(self, key):
+        i = self.index.pop(key, None)
+        if i is None:
+            return
+        last = len(self.keys) - 1
+        if i != last:
+            moved = self.keys[last]
+            self.keys[i] = moved
+            self.index[moved] = i
+            self.last_played[i] = self.last_played[last]
+            self.weights[i] = self.weights[last]
+        self.keys.pop()
+
+    def _hours(self, rows, now):
+        if now is None:
+            now = datetime.datetime.now()
+        return (to_epoch(now) - self.last_played[rows]) / 3600
+
+    def _adjusted_weights(self, weights, hours):
+        decay = 0.5 ** (hours / self.half_life_hours)
+        adjusted = np.where(weights == 1.0, 1.0, 1.0 + (weights - 1.0) * decay)
+        return np.clip(adjusted, self.min_weight, self.max_weight), decay
+
+    def score_rows(self, rows, now=None):
+        """Scores for the given row indices (an index array or slice)"""
+        hours = self._hours(rows, now)
+        adjusted, _ = self._adjusted_weights(self.weights[rows], hours)
+        time_score = self.time_score(np.maximum(hours, 0.1))
+        return time_score * adjusted
+
+    def score_rates(self, rows, now=None):
+        """
+        Upper bound on how fast each row's score changes, as a relative change
+        per hour. Both the time score and the weight drift slow down as a song
+        ages, so the bound stays valid until the row is next rescored.
+        """
+        hours = np.maximum(self._hours(rows, now), 0.1)
+        weights = self.weights[rows]
+        adjusted, decay = self._adjusted_weights(weights, hours)
+
+        time_rate = self.time_rate(hours)
+        drift_rate = (np.abs(weights - 1.0) * decay * math.log(2)
+                      / self.half_life_hours / adjusted)
+        return time_rate + drift_rate
+
+    def score_array(self, now=None):
+        """Scores for self.keys, in the same order"""
+        return self.score_rows(slice(0, len(self.keys)), now)
+
+    def scores(self, now=None):
+        return dict(zip(self.keys, self.score_array(now).tolist()))
@@ -0,0 +1,60 @@
+class SearchIndex:
+    """
+    Trigram index over each song's searchable text (file name, artist, title).
+    Queries of three or more characters intersect posting sets and then check
+    the few candidates with a substring match; shorter queries scan. Passing
+    the previous result as within narrows an extended query incrementally.
+    """
+
+    def __init__(self):
+        self.texts = {}
+        self.postings = {}
+
+    def __len__(self):
+        return len(self.texts)
+
+    @staticmethod
+    def trigrams(text):
+        return {text[i:i + 3] for i in range(len(text) - 2)}
+
+    def add(self, song, text):
+        text = text.lower()
+        if self.texts.get(song) == text:
+            return
+        self.remove(song)
+        self.texts[song] = text
+        for gram in self.trigrams(text):
+            self.postings.setdefault(gram, set()).add(song)
+
+    def remove(self, song):
+        text = self.texts.pop(song, None)
+        if text is None:
+            return
+        for gram in self.trigrams(text):
+            posting = self.postings.get(gram)
+            if posting is not None:
+                posting.discard(song)
+                if not posting:
+                    del self.postings[gram]
+
+    def search(self, query, within=None):
+        """Songs whose text contains query (case-insensitive)"""
+        query = query.lower()
+        if not query:
+            return set(self.texts) if within is None else set(within)
+
+        grams = self.trigrams(query)
+        if grams:
+            postings = sorted((self.postings.get(gram, set()) for gram in grams), key=len)
+            candidates = set(postings[0])
+            for posting in postings[1:]:
+                candidates &= posting
+                if not candidates:
+                    break
+            if within is not None:
+                candidates &= within
+        else:
+            candidates = self.texts if within is None else within
+
+        texts = self.texts
+        return {song for song in candidates if song in texts and query in texts[song]}
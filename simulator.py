@@ -0,0 +1,287 @@
+"""
+Fast-forward listening simulator for tuning song selection. Run with:
+
+    python simulator.py --tracks 100000 --days 90 --repeat-limit 150 300 --half-life 50 100 200
+
+Every combination of the parameters given is simulated on the real
+PlayerCore, with a virtual clock and seeded randomness, against a synthetic
+listener who skips and votes by a hidden taste for each song. The same
+arguments always give the same numbers. Combinations run in parallel, one
+process each, up to --processes.
+
+Only the listener's random draws and the metrics are vectorized. Plays are
+stepped one at a time through PlayerCore, since each pick depends on the
+repeat history and weights the plays before it left, and going through
+the real core is what makes the numbers worth tuning by. Sweep timings are
+those of that per-play loop.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import datetime
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+from library_store import LibraryStore
+from player_core import PlayerCore
+from score_engine import ScoreEngine, TIME_SCORES, HALF_LIFE_HOURS, MIN_WEIGHT, MAX_WEIGHT
+
+START = datetime.datetime(2030, 1, 1)
+# Listener reactions drawn at a time
+BATCH = 4096
+
+# How each kind of listener skips and votes: skip chance is
+# 1 / (1 + exp(skip_strength * taste - skip_bias)), so a song of average taste is
+# skipped with chance 1 / (1 + exp(-skip_bias)); a vote is cast on vote_rate of
+# plays, liking the top like_share of songs by taste and disliking the bottom
+# dislike_share
+LISTENERS = {
+    "casual": {"skip_bias": -2.0, "skip_strength": 1.5, "vote_rate": 0.02,
+               "like_share": 0.2, "dislike_share": 0.1},
+    "picky": {"skip_bias": -0.5, "skip_strength": 2.5, "vote_rate": 0.05,
+              "like_share": 0.1, "dislike_share": 0.3},
+    "voter": {"skip_bias": -1.5, "skip_strength": 2.0, "vote_rate": 0.3,
+              "like_share": 0.2, "dislike_share": 0.2},
+}
+DEFAULTS = {
+    "tracks": 100_000, "days": 90, "hours_per_day": 4.0, "listener": "casual", "seed": 0,
+    "repeat_limit": 150, "half_life_hours": HALF_LIFE_HOURS, "min_weight": MIN_WEIGHT,
+    "max_weight": MAX_WEIGHT, "time_score": "log1p",
+}
+
+
+class NullStore(LibraryStore):
+    """Hands out a ready-made library and forgets every write"""
+
+    def __init__(self, data):
+        self.data = data
+
+    def load(self):
+        data, self.data = self.data, None
+        return data
+
+    def save_all(self, data):
+        pass
+
+    def update_song(self, key, meta):
+        pass
+
+    def update_songs(self, items):
+        pass
+
+    def delete_songs(self, keys):
+        pass
+
+
+class Listener:
+    """
+    A synthetic listener with a fixed taste for every song, drawn from seed.
+    Songs they like less are skipped more often and sooner; now and then
+    they vote on what's playing, with the player's own Like (1.1) and
+    Dislike (0.9) multipliers.
+
+    The random draws behind their reactions are made BATCH at a time, as
+    uniform arrays; deciding a reaction is then a few array lookups.
+    """
+
+    def __init__(self, tracks, seed=0, skip_bias=-2.0, skip_strength=1.5, vote_rate=0.02,
+                 like_share=0.2, dislike_share=0.1, like=1.1, dislike=0.9):
+        self.rng = np.random.default_rng(seed)
+        self.taste = self.rng.standard_normal(tracks)
+        self.skip_chance = 1.0 / (1.0 + np.exp(skip_strength * self.taste - skip_bias))
+        self.vote_rate = vote_rate
+        self.likes = self.taste >= np.quantile(self.taste, 1.0 - like_share)
+        self.dislikes = self.taste <= np.quantile(self.taste, dislike_share)
+        self.like = like
+        self.dislike = dislike
+        self.draws = np.empty((0, 3))
+        self.next = 0
+
+    def react(self, row):
+        """(share of the track heard, vote multiplier or None) for a play of song row"""
+        if self.next == len(self.draws):
+            self.draws = self.rng.random((BATCH, 3))
+            self.next = 0
+        skip, heard, vote = self.draws[self.next]
+        self.next += 1
+        # A skip comes somewhere in the first half
+        heard = heard * 0.5 if skip < self.skip_chance[row] else 1.0
+        if vote < self.vote_rate:
+            if self.likes[row]:
+                return heard, self.like
+            if self.dislikes[row]:
+                return heard, self.dislike
+        return heard, None
+
+
+def simulate(params):
+    """
+    Simulate params (DEFAULTS overridden by any given) and return the metrics
+    as a dict, with the parameters and the time it took. Each play is a
+    pick, play, vote and finish on the core in turn, not an array step.
+    """
+    params = {**DEFAULTS, **params}
+    started = time.perf_counter()
+    tracks, seed = params["tracks"], params["seed"]
+    keys = [f"song_{i:06d}.mp3" for i in range(tracks)]
+    rows = {key: i for i, key in enumerate(keys)}
+    core = PlayerCore(
+        NullStore({key: {"last_played": "2000-01-01", "vote_weight": 1.0, "path": f"/music/{key}"}
+                   for key in keys}),
+        repeat_limit=params["repeat_limit"], rng=random.Random(seed),
+        score_engine=ScoreEngine(params["half_life_hours"], params["min_weight"],
+                                 params["max_weight"], params["time_score"]))
+    core.rebuild_scores(START)
+    listener = Listener(tracks, seed, **LISTENERS[params["listener"]])
+    rng = np.random.default_rng(seed + 1)
+    durations = rng.uniform(150, 360, tracks)
+
+    played_rows, played_hours, heard_shares = [], [], []
+    session = datetime.timedelta(hours=params["hours_per_day"])
+    for day in range(params["days"]):
+        now = START + datetime.timedelta(days=day)
+        end = now + session
+        while now < end:
+            song = core.pick_song(now)
+            row = rows[song]
+            core.mark_played(song, now)
+            heard, vote = listener.react(row)
+            if vote is not None:
+                core.vote(song, vote, now)
+            played_rows.append(row)
+            played_hours.append((now - START).total_seconds() / 3600)
+            heard_shares.append(heard)
+            now += datetime.timedelta(seconds=durations[row] * heard)
+            core.finish_song(song, durations[row] * heard * 1000, durations[row] * 1000, now)
+    simulated = time.perf_counter() - started
+
+    weights = np.fromiter((core.data[key]["vote_weight"] for key in keys), dtype=np.float64,
+                          count=tracks)
+    metrics = play_metrics(np.array(played_rows), np.array(played_hours), np.array(heard_shares),
+                           listener.taste, weights, params)
+    metrics["seconds"] = simulated
+    return {"params": params, "metrics": metrics}
+
+
+def gini(counts):
+    """0 when every song is played equally often, towards 1 when a few get all the plays"""
+    counts = np.sort(counts)
+    n = len(counts)
+    if n == 0 or counts.sum() == 0:
+        return 0.0
+    ranks = np.arange(1, n + 1)
+    return float((2 * ranks - n - 1) @ counts / (n * counts.sum()))
+
+
+def play_metrics(rows, hours, heard, taste, weights, params):
+    """Repeat intervals, coverage and fairness of a play log, in arrays"""
+    tracks = len(taste)
+    plays = len(rows)
+    counts = np.bincount(rows, minlength=tracks)
+
+    # Gaps between consecutive plays of the same song
+    order = np.lexsort((hours, rows))
+    same = rows[order][1:] == rows[order][:-1]
+    gaps = np.diff(hours[order])[same]
+    # Plays between those two plays, which is what repeat_limit counts in
+    play_gaps = np.diff(order)[same]
+
+    first_play = np.full(tracks, np.inf)
+    np.minimum.at(first_play, rows, hours)
+    covered = np.sort(first_play[np.isfinite(first_play)])
+    half = tracks // 2
+
+    top = taste >= np.quantile(taste, 0.8)
+    bottom = taste <= np.quantile(taste, 0.2)
+    return {
+        "plays": plays,
+        "skip_rate": float(np.mean(heard < 1.0)) if plays else 0.0,
+        "heard": float(np.mean(heard)) if plays else 0.0,
+        "coverage": float(np.count_nonzero(counts) / tracks),
+        "days_to_half_coverage": float(covered[half - 1] / 24) if len(covered) >= half else None,
+        "repeats": int(len(gaps)),
+        "repeat_min_plays": int(play_gaps.min()) if len(gaps) else None,
+        "repeat_median_days": float(np.median(gaps) / 24) if len(gaps) else None,
+        "repeat_p5_days": float(np.percentile(gaps, 5) / 24) if len(gaps) else None,
+        "repeats_within_day": int(np.count_nonzero(gaps < 24)),
+        "gini": gini(counts),
+        "max_plays": int(counts.max()) if plays else 0,
+        # How much more the songs the listener likes best get played than those they like least
+        "taste_lift": float(counts[top].mean() / max(counts[bottom].mean(), 1e-9)),
+        "at_weight_bounds": float(np.mean((weights <= params["min_weight"])
+                                          | (weights >= params["max_weight"]))),
+    }
+
+
+def sweep(grid, processes=None):
+    """
+    Simulate every combination of grid, a dict of parameter -> list of
+    values, in up to processes worker processes. Results come back in grid
+    order whatever order they finish in.
+    """
+    names = list(grid)
+    configs = [dict(zip(names, values)) for values in itertools.product(*grid.values())]
+    processes = processes or os.cpu_count() or 1
+    if processes == 1 or len(configs) == 1:
+        return [simulate(config) for config in configs]
+    with ProcessPoolExecutor(max_workers=min(processes, len(configs))) as pool:
+        return list(pool.map(simulate, configs))
+
+
+COLUMNS = (("plays", "{:>7}"), ("skip_rate", "{:>6.3f}"), ("coverage", "{:>6.3f}"),
+           ("repeat_min_plays", "{!s:>6}"), ("repeat_p5_days", "{:>7.2f}"),
+           ("repeat_median_days", "{:>7.2f}"), ("repeats_within_day", "{:>6}"),
+           ("gini", "{:>6.3f}"), ("taste_lift", "{:>6.2f}"), ("seconds", "{:>6.1f}"))
+HEADINGS = ("plays", "skips", "cover", "min", "p5 d", "med d", "<1d", "gini", "lift", "secs")
+
+
+def format_results(results, varied):
+    lines = ["  ".join([f"{name:>12}" for name in varied] + [f"{h:>6}" for h in HEADINGS])]
+    for result in results:
+        params, metrics = result["params"], result["metrics"]
+        cells = [f"{params[name]!s:>12}" for name in varied]
+        for (key, fmt), _ in zip(COLUMNS, HEADINGS):
+            value = metrics[key]
+            cells.append(f"{'-':>6}" if value is None else fmt.format(value))
+        lines.append("  ".join(cells))
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip(),
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tracks", type=int, nargs="+", default=[DEFAULTS["tracks"]])
+    parser.add_argument("--days", type=int, nargs="+", default=[DEFAULTS["days"]])
+    parser.add_argument("--hours-per-day", type=float, nargs="+", default=[DEFAULTS["hours_per_day"]])
+    parser.add_argument("--listener", choices=sorted(LISTENERS), nargs="+", default=[DEFAULTS["listener"]])
+    parser.add_argument("--seed", type=int, nargs="+", default=[DEFAULTS["seed"]])
+    parser.add_argument("--repeat-limit", type=int, nargs="+", default=[DEFAULTS["repeat_limit"]])
+    parser.add_argument("--half-life", dest="half_life_hours", type=float, nargs="+",
+                        default=[DEFAULTS["half_life_hours"]])
+    parser.add_argument("--min-weight", type=float, nargs="+", default=[DEFAULTS["min_weight"]])
+    parser.add_argument("--max-weight", type=float, nargs="+", default=[DEFAULTS["max_weight"]])
+    parser.add_argument("--time-score", choices=sorted(TIME_SCORES), nargs="+",
+                        default=[DEFAULTS["time_score"]])
+    parser.add_argument("--processes", type=int, default=None,
+                        help="worker processes (default: one per CPU)")
+    parser.add_argument("--json", help="also write every result to this file")
+    args = vars(parser.parse_args(argv))
+    processes = args.pop("processes")
+    json_path = args.pop("json")
+
+    varied = [name for name, values in args.items() if len(values) > 1] or ["repeat_limit"]
+    started = time.perf_counter()
+    results = sweep(args, processes)
+    print(format_results(results, varied))
+    print(f"{len(results)} simulations in {time.perf_counter() - started:.1f} s")
+    if json_path:
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,140 @@
+import os
+import re
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+# Entry fields filled in from a file's tags when it is scanned: the tags
+# themselves, the audio's length (seconds) and bitrate (bits per second), and a
+# hash of the embedded cover art, the same for every track carrying that image
+TAG_FIELDS = ("artist", "album", "title", "year", "duration", "bitrate", "art_hash")
+# Bumped when read_tags starts producing new fields or reading them differently,
+# so every file is read again
+TAGS_VERSION = 3
+# Files read per process pool task; below this many, files are read on threads
+TAG_BATCH = 256
+YEAR = re.compile(r"\s*(\d{4})")
+ID3_FRAMES = {"artist": "TPE1", "album": "TALB", "title": "TIT2", "date": "TDRC"}
+# Picture type of a front cover, in ID3 and FLAC alike
+FRONT_COVER = 3
+
+
+def _text(tags, field):
+    if hasattr(tags, "getall"):
+        frames = tags.getall(ID3_FRAMES[field])
+        values = frames[0].text if frames else []
+    else:
+        values = tags.get(field) or []
+    return str(values[0]).strip() if values else ""
+
+
+def cover_picture(pictures):
+    """
+    The one of a file's embedded pictures to show as its art: the front
+    cover if one is marked as such, else the first. None if there are none.
+    The art loader and art_hash both choose with this, so they agree.
+    """
+    return next((picture for picture in pictures if picture.type == FRONT_COVER),
+                pictures[0] if pictures else None)
+
+
+def _art(audio):
+    """Bytes of the file's cover picture, or None"""
+    tags = audio.tags
+    if tags is not None and hasattr(tags, "getall"):
+        pictures = tags.getall("APIC")
+    else:
+        pictures = getattr(audio, "pictures", None) or []
+    picture = cover_picture(pictures)
+    return picture.data if picture is not None else None
+
+
+def read_tags(path):
+    """
+    The TAG_FIELDS a file gives, for its library entry. Fields it has no tag
+    for are left out, and a file mutagen can't read gives {}. None if
+    mutagen isn't installed, so the file is read again once it is.
+    """
+    try:
+        from mutagen import File
+    except ImportError:
+        # Tags only feed playlists, search and the song info; the library works without them
+        return None
+    try:
+        audio = File(path)
+        if audio is None:
+            return {}
+        fields = {}
+        tags = audio.tags
+        if tags is not None:
+            for field in ("artist", "album", "title"):
+                value = _text(tags, field)
+                if value:
+                    fields[field] = value
+            year = YEAR.match(_text(tags, "date"))
+            if year:
+                fields["year"] = int(year.group(1))
+        length = getattr(audio.info, "length", None)
+        if length:
+            fields["duration"] = round(float(length), 3)
+        bitrate = getattr(audio.info, "bitrate", None)
+        if bitrate:
+            fields["bitrate"] = int(bitrate)
+        art = _art(audio)
+        if art:
+            fields["art_hash"] = hashlib.sha1(art).hexdigest()[:16]
+        return fields
+    except Exception:
+        # mutagen has an error type per format for damaged files, and odd
+        # frames can trip up the parsing above
+        return {}
+
+
+def needs_tags(meta):
+    """True until the file's tags have been read at its current mtime by the current read_tags"""
+    return (meta.get("tagged_mtime", "never") != meta.get("mtime")
+            or meta.get("tags_version", 1) != TAGS_VERSION)
+
+
+def _read_tags_batch(paths):
+    return [read_tags(path) for path in paths]
+
+
+def read_tags_batches(paths, max_workers=None, batch=TAG_BATCH):
+    """
+    Yield {path: read_tags(path)} for paths, a batch at a time in order, read
+    on a process pool: parsing tags is Python-bound, so threads would take
+    turns on the GIL. Damaged files come back as {} like any other; a batch
+    lost with a worker that died comes back as None for each file, to be
+    read again next time.
+    """
+    chunks = [paths[start:start + batch] for start in range(0, len(paths), batch)]
+    if not chunks:
+        return
+    with ProcessPoolExecutor(max_workers=min(max_workers or os.cpu_count() or 1, len(chunks))) as pool:
+        futures = [pool.submit(_read_tags_batch, chunk) for chunk in chunks]
+        for chunk, future in zip(chunks, futures):
+            try:
+                results = future.result()
+            except Exception as e:
+                print(f"Reading tags failed for {len(chunk)} files: {e}")
+                results = [None] * len(chunk)
+            yield dict(zip(chunk, results))
+
+
+def read_tags_many(paths, max_workers=8):
+    """path -> read_tags(path); a few files are read on threads, many on a process pool"""
+    if not paths:
+        return {}
+    if len(paths) >= TAG_BATCH:
+        tags = {}
+        for batch in read_tags_batches(paths):
+            tags.update(batch)
+        return tags
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        return dict(zip(paths, pool.map(read_tags, paths)))
+
+
+def read_scan_tags(result):
+    """Tags of a scan's new and changed files. result is what scan_folder returns."""
+    added, changed, _ = result
+    return read_tags_many([path for path, _, _ in added + changed])
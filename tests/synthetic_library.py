@@ -0,0 +1,30 @@
+"""Synthetic libraries shared by the tests"""
+import random
+import datetime
+
+NOW = datetime.datetime(2030, 1, 1, 12, 0)
+
+
+def played_library(n, seed=0, now=NOW):
+    """
+    Entries with last plays from never to a few months back (and a few just
+    ahead of now, as after a clock change), votes across and past the weight
+    bounds, and skip history
+    """
+    rng = random.Random(seed)
+    data = {}
+    for i in range(n):
+        meta = {"last_played": "2000-01-01", "vote_weight": 1.0,
+                "path": f"C:/Music/Artist {i % 50}/song_{i:06d}.mp3"}
+        roll = rng.random()
+        if roll < 0.8:
+            meta["last_played"] = (now - datetime.timedelta(hours=rng.uniform(0, 2000))).isoformat()
+        elif roll < 0.82:
+            meta["last_played"] = (now + datetime.timedelta(minutes=rng.uniform(1, 90))).isoformat()
+        if rng.random() < 0.3:
+            meta["vote_weight"] = rng.choice([0.3, 0.5, 0.81, 0.9, 1.1, 1.21, 2.0, 3.0])
+        if rng.random() < 0.2:
+            meta["completions"] = round(rng.uniform(0, 20), 3)
+            meta["skips"] = round(rng.uniform(0, 20), 3)
+        data[f"song_{i:06d}.mp3"] = meta
+    return data
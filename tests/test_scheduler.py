@@ -0,0 +1,42 @@
+import os
+import random
+import datetime
+import pytest
+from synthetic_library import NOW, played_library
+from library_store import JsonLibraryStore
+from player_core import PlayerCore
+from track_table import TrackTable
+
+STEP = datetime.timedelta(minutes=3.5)
+
+
+def worst_drift(core, now):
+    """
+    Largest relative error of a pickable song's sampler weight against
+    get_scores, as a pick at now would draw from them: after the refresh
+    that every pick starts with
+    """
+    core.scheduler.refresh(now)
+    exact = core.get_scores(now)
+    sampler = core.sampler
+    return max(abs(weight - exact[song]) / exact[song]
+               for song, weight in zip(sampler.keys, sampler.weights)
+               if song not in sampler.recent_counts)
+
+
+@pytest.mark.parametrize("staleness", [0.01, 0.001])
+def test_incremental_scores_stay_within_staleness(staleness):
+    core = PlayerCore(JsonLibraryStore(os.devnull), staleness=staleness, rng=random.Random(0))
+    core.data = TrackTable(played_library(5_000, seed=6))
+    rng = random.Random(1)
+    now = NOW
+    core.rebuild_scores(now)
+    for i in range(1_500):
+        now += STEP
+        song = core.pick_song(now)
+        core.mark_played(song, now)
+        if rng.random() < 0.1:
+            core.vote(rng.choice(list(core.data)), rng.choice([0.9, 1.1]), now)
+        if i % 100 == 99:
+            # Checked just before the next pick is due, when weights are at their oldest
+            assert worst_drift(core, now + STEP - datetime.timedelta(seconds=1)) <= staleness
@@ -0,0 +1,76 @@
+import math
+import datetime
+import pytest
+from synthetic_library import NOW, played_library
+from score_engine import ScoreEngine, song_weight
+from track_table import TrackTable
+
+
+def reference_scores(data, now):
+    """The original per-song MusicPlayer.get_scores loop, with votes and skips combined"""
+    scores = {}
+    for song, meta in data.items():
+        delta = now - datetime.datetime.fromisoformat(meta["last_played"])
+        hours = delta.total_seconds() / 3600
+
+        weight = song_weight(meta)
+        if weight != 1.0:
+            weight = 1.0 + (weight - 1.0) * 0.5 ** (hours / 100)
+        weight = min(max(weight, 0.5), 2.0)
+
+        scores[song] = math.log1p(max(hours, 0.1)) * weight
+    return scores
+
+
+def assert_same_scores(actual, expected):
+    assert actual.keys() == expected.keys()
+    for song, score in expected.items():
+        assert actual[song] == pytest.approx(score, rel=1e-9), song
+
+
+@pytest.mark.parametrize("size, seed", [(1, 0), (50, 1), (5_000, 2)])
+def test_scores_match_reference_loop(size, seed):
+    data = played_library(size, seed)
+    engine = ScoreEngine()
+    engine.rebuild(data)
+    for hours in (0, 1.5, 500):
+        now = NOW + datetime.timedelta(hours=hours)
+        assert_same_scores(engine.scores(now), reference_scores(data, now))
+
+
+def test_scores_match_reference_loop_from_track_table():
+    data = played_library(2_000, seed=3)
+    engine = ScoreEngine()
+    engine.rebuild(TrackTable(data))
+    assert_same_scores(engine.scores(NOW), reference_scores(data, NOW))
+
+
+def test_updates_and_removals_keep_parity():
+    data = played_library(500, seed=4)
+    engine = ScoreEngine()
+    engine.rebuild(data)
+    songs = list(data)
+    for i, song in enumerate(songs[:200]):
+        if i % 3 == 0:
+            del data[song]
+            engine.remove(song)
+        else:
+            data[song]["last_played"] = (NOW - datetime.timedelta(minutes=i)).isoformat()
+            data[song]["vote_weight"] = 1.0 + (i % 7 - 3) / 10
+            engine.update(song, data[song])
+    for i in range(100):
+        song = f"added_{i:03d}.mp3"
+        data[song] = {"last_played": "2000-01-01", "vote_weight": 1.2, "path": song}
+        engine.update(song, data[song])
+    assert_same_scores(engine.scores(NOW), reference_scores(data, NOW))
+
+
+def test_score_array_follows_keys():
+    data = played_library(100, seed=5)
+    engine = ScoreEngine()
+    engine.rebuild(data)
+    expected = reference_scores(data, NOW)
+    scores = engine.score_array(NOW)
+    assert len(scores) == len(engine.keys)
+    for song, score in zip(engine.keys, scores):
+        assert score == pytest.approx(expected[song], rel=1e-9)
@@ -0,0 +1,282 @@
+import os
+import sys
+import math
+import datetime
+from array import array
+from collections.abc import Mapping, MutableMapping
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+# Entry fields kept in typed columns. last_played is held as epoch seconds.
+FLOAT_FIELDS = ("last_played", "vote_weight", "loudness", "peak", "gain_db",
+                "tempo", "centroid", "energy", "completions", "skips", "duration")
+INT_FIELDS = ("mtime", "size", "analyzed_mtime", "analysis_version", "feature_row", "seq", "missing",
+              "year", "tagged_mtime", "tags_version", "bitrate")
+OBJECT_FIELDS = ("audio_id", "artist", "album", "title", "art_hash")
+BOOL_FIELDS = frozenset(("missing",))
+# Text fields many songs share, kept as one string object each
+INTERNED_FIELDS = frozenset(("artist", "album", "art_hash"))
+
+INT_ABSENT = -2 ** 63
+_ABSENT = object()
+
+
+def _to_epoch(value):
+    return (datetime.datetime.fromisoformat(value) - EPOCH).total_seconds()
+
+
+def _from_epoch(seconds):
+    return (EPOCH + datetime.timedelta(seconds=seconds)).isoformat()
+
+
+class TrackView(MutableMapping):
+    """
+    A library entry as a dict-like view onto its row in a TrackTable.
+    Reads and writes go straight to the table's columns.
+    """
+
+    __slots__ = ("table", "key")
+
+    def __init__(self, table, key):
+        self.table = table
+        self.key = key
+
+    @property
+    def last_played_epoch(self):
+        """last_played without the round trip through an ISO string"""
+        return self.table.last_played_epoch(self.key)
+
+    def __getitem__(self, field):
+        return self.table.get_field(self.key, field)
+
+    def __setitem__(self, field, value):
+        self.table.set_field(self.key, field, value)
+
+    def __delitem__(self, field):
+        self.table.delete_field(self.key, field)
+
+    def __iter__(self):
+        return self.table.fields(self.key)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return f"TrackView({self.key!r}, {dict(self)!r})"
+
+
+class TrackTable(MutableMapping):
+    """
+    The library as parallel columns instead of a dict of dicts: one row per
+    song, floats and ints in arrays, paths as an interned directory plus a
+    file name. Values that don't fit their column (None, a float where an
+    int goes) and fields without a column go in a small per-song dict.
+
+    It reads like the dict of entry dicts it replaces: table[key] is a
+    TrackView, and assigning a plain dict stores its fields. Removing a song
+    moves the last row into its place, so iteration order isn't insertion
+    order.
+    """
+
+    def __init__(self, data=()):
+        self.keys_list = []
+        self.index = {}
+        self.directories = []
+        self.directory_ids = {}
+        self.directory_column = array("I")
+        self.names = []
+        self.float_columns = {field: array("d") for field in FLOAT_FIELDS}
+        self.int_columns = {field: array("q") for field in INT_FIELDS}
+        self.object_columns = {field: [] for field in OBJECT_FIELDS}
+        self.extra = {}
+        items = data.items() if isinstance(data, Mapping) else data
+        for key, meta in items:
+            self[key] = meta
+
+    # Rows
+
+    def _append_row(self, key):
+        row = len(self.keys_list)
+        self.keys_list.append(key)
+        self.index[key] = row
+        self.directory_column.append(0)
+        self.names.append(None)
+        for column in self.float_columns.values():
+            column.append(math.nan)
+        for column in self.int_columns.values():
+            column.append(INT_ABSENT)
+        for column in self.object_columns.values():
+            column.append(_ABSENT)
+        return row
+
+    def _clear_row(self, key):
+        row = self.index[key]
+        self.names[row] = None
+        for column in self.float_columns.values():
+            column[row] = math.nan
+        for column in self.int_columns.values():
+            column[row] = INT_ABSENT
+        for column in self.object_columns.values():
+            column[row] = _ABSENT
+        self.extra.pop(key, None)
+
+    def _columns(self):
+        yield self.directory_column
+        yield self.names
+        yield from self.float_columns.values()
+        yield from self.int_columns.values()
+        yield from self.object_columns.values()
+
+    # Fields
+
+    def get_field(self, key, field):
+        row = self.index[key]
+        if field == "path":
+            name = self.names[row]
+            if name is None:
+                raise KeyError(field)
+            return self.directories[self.directory_column[row]] + name
+        if field in self.float_columns:
+            value = self.float_columns[field][row]
+            if not math.isnan(value):
+                return _from_epoch(value) if field == "last_played" else value
+        elif field in self.int_columns:
+            value = self.int_columns[field][row]
+            if value != INT_ABSENT:
+                return bool(value) if field in BOOL_FIELDS else value
+        elif field in self.object_columns:
+            value = self.object_columns[field][row]
+            if value is not _ABSENT:
+                return value
+        extra = self.extra.get(key)
+        if extra is None or field not in extra:
+            raise KeyError(field)
+        return extra[field]
+
+    def last_played_epoch(self, key):
+        value = self.float_columns["last_played"][self.index[key]]
+        return None if math.isnan(value) else value
+
+    def set_field(self, key, field, value):
+        row = self.index[key]
+        if field == "path":
+            name = os.path.basename(value)
+            directory = value[:len(value) - len(name)]
+            directory_id = self.directory_ids.get(directory)
+            if directory_id is None:
+                directory_id = len(self.directories)
+                self.directories.append(sys.intern(directory))
+                self.directory_ids[directory] = directory_id
+            self.directory_column[row] = directory_id
+            self.names[row] = name
+            return
+        stored = False
+        if field in self.float_columns:
+            if field == "last_played" and isinstance(value, str):
+                value = _to_epoch(value)
+                stored = True
+            elif isinstance(value, (int, float)) and not isinstance(value, bool) and value == value:
+                stored = field != "last_played"
+            self.float_columns[field][row] = value if stored else math.nan
+        elif field in self.int_columns:
+            if field in BOOL_FIELDS:
+                stored = isinstance(value, bool)
+            else:
+                stored = (isinstance(value, int) and not isinstance(value, bool)
+                          and INT_ABSENT < value < 2 ** 63)
+            self.int_columns[field][row] = int(value) if stored else INT_ABSENT
+        elif field in self.object_columns:
+            stored = True
+            if field in INTERNED_FIELDS and type(value) is str:
+                value = sys.intern(value)
+            self.object_columns[field][row] = value
+
+        extra = self.extra.get(key)
+        if stored:
+            if extra is not None:
+                extra.pop(field, None)
+        else:
+            if extra is None:
+                extra = self.extra[key] = {}
+            extra[field] = value
+
+    def delete_field(self, key, field):
+        row = self.index[key]
+        if field not in set(self.fields(key)):
+            raise KeyError(field)
+        if field == "path":
+            self.names[row] = None
+        elif field in self.float_columns:
+            self.float_columns[field][row] = math.nan
+        elif field in self.int_columns:
+            self.int_columns[field][row] = INT_ABSENT
+        elif field in self.object_columns:
+            self.object_columns[field][row] = _ABSENT
+        extra = self.extra.get(key)
+        if extra is not None:
+            extra.pop(field, None)
+
+    def fields(self, key):
+        row = self.index[key]
+        if self.names[row] is not None:
+            yield "path"
+        for field, column in self.float_columns.items():
+            if not math.isnan(column[row]):
+                yield field
+        for field, column in self.int_columns.items():
+            if column[row] != INT_ABSENT:
+                yield field
+        for field, column in self.object_columns.items():
+            if column[row] is not _ABSENT:
+                yield field
+        yield from self.extra.get(key, ())
+
+    # Mapping
+
+    def __getitem__(self, key):
+        if key not in self.index:
+            raise KeyError(key)
+        return TrackView(self, key)
+
+    def __setitem__(self, key, meta):
+        if isinstance(meta, TrackView):
+            meta = dict(meta)
+        if key in self.index:
+            self._clear_row(key)
+        else:
+            self._append_row(key)
+        for field, value in meta.items():
+            self.set_field(key, field, value)
+
+    def __delitem__(self, key):
+        row = self.index.pop(key)
+        last = len(self.keys_list) - 1
+        if row != last:
+            moved = self.keys_list[last]
+            self.keys_list[row] = moved
+            self.index[moved] = row
+            for column in self._columns():
+                column[row] = column[last]
+        self.keys_list.pop()
+        for column in self._columns():
+            column.pop()
+        self.extra.pop(key, None)
+
+    def pop(self, key, *default):
+        """Remove a song and return its fields as a plain dict"""
+        if key not in self.index:
+            if default:
+                return default[0]
+            raise KeyError(key)
+        meta = dict(TrackView(self, key))
+        del self[key]
+        return meta
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def __iter__(self):
+        return iter(self.keys_list)
+
+    def __len__(self):
+        return len(self.keys_list)
@@ -0,0 +1,250 @@
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import threading
+import ctypes
+import ctypes.util
+from scanner import AUDIO_EXTENSIONS, walk_audio_files
+
+# Quiet time after the last change before a batch is handed on
+DEBOUNCE_SECONDS = 1.0
+# Longest a change waits while more keep coming (a big copy in progress)
+MAX_DELAY_SECONDS = 10.0
+# How often the polling fallback rescans the watched folders
+POLL_SECONDS = 30.0
+# Longest the watcher thread sleeps with nothing pending
+IDLE_WAIT = 1.0
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+WATCH_MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+              | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+EVENT_HEADER = struct.Struct("iIII")
+AUDIO_SUFFIXES = tuple(ext.encode() for ext in AUDIO_EXTENSIONS)
+
+
+class InotifyWatch:
+    """Linux inotify on every directory under the watched folders, through libc"""
+
+    def __init__(self):
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.paths = {}
+        self.wds = {}
+
+    def add_tree(self, root):
+        for directory, _, _ in os.walk(root):
+            if directory in self.wds:
+                continue
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+            if wd < 0:
+                error = ctypes.get_errno()
+                if error == errno.ENOSPC:
+                    print("Out of inotify watches, raise fs.inotify.max_user_watches; "
+                          f"changes under {directory} won't be seen")
+                    return
+                # Gone again or unreadable
+                continue
+            self.paths[wd] = directory
+            self.wds[directory] = wd
+
+    def remove_tree(self, root):
+        prefix = root.rstrip(os.sep) + os.sep
+        for directory in [d for d in self.wds if d == root or d.startswith(prefix)]:
+            wd = self.wds.pop(directory)
+            del self.paths[wd]
+            self.libc.inotify_rm_watch(self.fd, wd)
+
+    def wait(self, timeout):
+        """
+        Files and folders that changed within timeout seconds, or None if the
+        kernel's queue overflowed and anything may have changed
+        """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            buffer = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        changed = []
+        offset = 0
+        while offset < len(buffer):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(buffer, offset)
+            name = buffer[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b"\0")
+            offset += EVENT_HEADER.size + length
+            if mask & IN_Q_OVERFLOW:
+                return None
+            directory = self.paths.get(wd)
+            if directory is None:
+                continue
+            if mask & IN_IGNORED:
+                del self.paths[wd]
+                self.wds.pop(directory, None)
+            elif mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                # Only a watched folder itself reports this without its parent seeing it
+                self.remove_tree(directory)
+                changed.append(directory)
+            elif mask & IN_ISDIR:
+                path = os.path.join(directory, os.fsdecode(name))
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    # Files may land in it before its watch is added; the
+                    # folder is rescanned as a whole anyway
+                    self.add_tree(path)
+                elif mask & IN_MOVED_FROM:
+                    self.remove_tree(path)
+                changed.append(path)
+            elif name.lower().endswith(AUDIO_SUFFIXES) and not mask & IN_CREATE:
+                # A new file is reported again once it has been written
+                changed.append(os.path.join(directory, os.fsdecode(name)))
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatch:
+    """Fallback without inotify: rescans the watched folders every interval and reports what differs"""
+
+    def __init__(self, interval=POLL_SECONDS):
+        self.interval = interval
+        self.snapshots = {}
+        self.next_poll = time.monotonic() + interval
+        self.closed = threading.Event()
+
+    def _snapshot(self, root):
+        if not os.path.isdir(root):
+            return {}
+        return {path: (mtime, size) for path, mtime, size in walk_audio_files(root)}
+
+    def add_tree(self, root):
+        self.snapshots[root] = self._snapshot(root)
+
+    def remove_tree(self, root):
+        self.snapshots.pop(root, None)
+
+    def wait(self, timeout):
+        delay = self.next_poll - time.monotonic()
+        if delay > timeout:
+            self.closed.wait(timeout)
+            return []
+        if self.closed.wait(max(delay, 0)):
+            return []
+        self.next_poll = time.monotonic() + self.interval
+        changed = []
+        for root, before in list(self.snapshots.items()):
+            after = self._snapshot(root)
+            changed += [path for path, stat in after.items() if before.get(path) != stat]
+            changed += [path for path in before if path not in after]
+            self.snapshots[root] = after
+        return changed
+
+    def close(self):
+        self.closed.set()
+
+
+class LibraryWatcher:
+    """
+    Watches library folders on a thread of its own and hands on what changed
+    in them in batches: on_batch(paths) is called from that thread with the
+    files and folders that changed, once DEBOUNCE_SECONDS pass without
+    another change or MAX_DELAY_SECONDS after the first one. A burst of
+    changes (a folder copied in, an album retagged) makes one batch.
+
+    Uses inotify on Linux and falls back to polling elsewhere, or if
+    polling is set.
+    """
+
+    def __init__(self, on_batch, debounce=DEBOUNCE_SECONDS, max_delay=MAX_DELAY_SECONDS,
+                 poll_interval=POLL_SECONDS, polling=False):
+        self.on_batch = on_batch
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.watch = None
+        if not polling and sys.platform.startswith("linux"):
+            try:
+                self.watch = InotifyWatch()
+            except (OSError, AttributeError) as e:
+                print(f"inotify unavailable, polling library folders instead: {e}")
+        if self.watch is None:
+            self.watch = PollingWatch(poll_interval)
+
+        self.roots = set()
+        self.requested = []
+        self.lock = threading.Lock()
+        self.pending = set()
+        self.first_change = None
+        self.last_change = None
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def add_root(self, folder, sync=True):
+        """
+        Start watching folder. With sync, the whole folder is handed on with
+        the next batch, to catch up on changes made while nobody was watching.
+        """
+        with self.lock:
+            self.requested.append((os.path.abspath(folder), sync))
+
+    def _add_requested(self, now):
+        with self.lock:
+            requested, self.requested = self.requested, []
+        for folder, sync in requested:
+            if folder not in self.roots:
+                self.roots.add(folder)
+                self.watch.add_tree(folder)
+            if sync:
+                self._changed([folder], now)
+
+    def _changed(self, paths, now):
+        self.pending.update(paths)
+        if self.first_change is None:
+            self.first_change = now
+        self.last_change = now
+
+    def _run(self):
+        while self.running:
+            self._add_requested(time.monotonic())
+            if self.pending:
+                timeout = max(0.0, min(self.last_change + self.debounce,
+                                       self.first_change + self.max_delay) - time.monotonic())
+            else:
+                timeout = IDLE_WAIT
+            try:
+                changed = self.watch.wait(timeout)
+            except (OSError, ValueError):
+                if not self.running:
+                    return
+                raise
+            now = time.monotonic()
+            if changed is None:
+                print("Missed folder changes, rescanning watched folders")
+                changed = list(self.roots)
+            if changed:
+                self._changed(changed, now)
+            if self.pending and (now - self.last_change >= self.debounce
+                                 or now - self.first_change >= self.max_delay):
+                batch = sorted(self.pending)
+                self.pending.clear()
+                self.first_change = self.last_change = None
+                self.on_batch(batch)
+
+    def stop(self):
+        self.running = False
+        self.thread.join(timeout=2 * IDLE_WAIT)
+        self.watch.close()